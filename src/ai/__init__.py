@@ -5,5 +5,7 @@ logging.captureWarnings(True)
 
 OPENAI_MODEL_NAME = "gpt-3.5-turbo"
 OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+DEFAULT_CONVERSATION_ID = "default"
 CHAT_HISTORY_PATH: str = "./misc/chat_history.json"
 CHAT_HISTORY_JQ_SCHEMA = ".[].context_text"
@@ -1,13 +1,24 @@
 from langchain import PromptTemplate
 from langchain.chains import StuffDocumentsChain, LLMChain
-from langchain.memory import ConversationBufferWindowMemory
+import asyncio
 import logging
+import re
+import time
+import numpy as np
+from langchain.schema import Document
 from langchain.schema.language_model import BaseLanguageModel
-from dataclasses import dataclass
-from langchain.llms import OpenAI
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 
+from ai.backends import new_llm
+from ai.batching import Coalescer
+from ai.cache import ResponseCache
+from ai.context import ContextBuilder
 from ai.db import VectorDB
-from typing import Optional
+from ai.memory import ConversationMemoryStore, DEFAULT_CONVERSATION_ID
+from ai.callbacks import TokenMetrics
+from ai.metrics import STAGE_SECONDS, current_stage
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
 
 from ai import OPENAI_MODEL_NAME
 
@@ -64,17 +75,65 @@ class Response:
     answer: str
     chat_history: str
     context: str
+    timings: dict[str, float] = field(default_factory=dict)  # Seconds per stage.
+
+
+T = TypeVar("T")
+
+
+@contextmanager
+def _timed(timings: dict[str, float], stage: str):
+    # Labels the tokens of the LLM calls made meanwhile. Not `reset`, which fails
+    # when a streaming generator is closed from another task.
+    previous = current_stage.get()
+    current_stage.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+        current_stage.set(previous)
+
+
+async def _atimed(timings: dict[str, float], stage: str, aw: Awaitable[T]) -> T:
+    with _timed(timings, stage):
+        return await aw
+
+
+def merge_documents(*results: list[Document], limit: int) -> list[Document]:
+    """Interleaves several search results, dropping duplicate chunks."""
+    merged: list[Document] = []
+    seen: set[str] = set()
+    for rank in range(max((len(docs) for docs in results), default=0)):
+        for docs in results:
+            if rank >= len(docs) or docs[rank].page_content in seen:
+                continue
+
+            seen.add(docs[rank].page_content)
+            merged.append(docs[rank])
+
+    return merged[:limit]
+
+
+def adds_words(query: str, message: str) -> bool:
+    """Whether the rewritten `query` has a word, case aside, the message lacks."""
+    words = set(re.findall(r"\w+", message.casefold()))
+    return any(word not in words for word in re.findall(r"\w+", query.casefold()))
 
 
 class BuddyAI:
     model_name: str
 
     vectordb: Optional[VectorDB]
+    pipelined: bool
+    cache: Optional[ResponseCache]
+    context_builder: ContextBuilder
 
     query_chain: Optional[LLMChain] = None
+    query_batcher: Optional[Coalescer[dict, dict]] = None
     llm: BaseLanguageModel
     combine_docs_chain: StuffDocumentsChain
-    memory: ConversationBufferWindowMemory
+    memories: ConversationMemoryStore
     chain: LLMChain
 
     def __init__(
@@ -82,13 +141,53 @@ class BuddyAI:
         vectordb: Optional[VectorDB] = None,
         with_query_chain: bool = True,
         memory_interactions=5,
+        max_conversations=1000,
         temperature=0.7,
         model_name: str = OPENAI_MODEL_NAME,
+        llm: Optional[BaseLanguageModel] = None,
+        llm_backend: str = "openai",
+        pipelined: bool = False,
+        cache: Optional[ResponseCache] = None,
+        query_batch_window: float = 0.0,
+        max_query_batch_size: int = 20,
+        context_builder: Optional[ContextBuilder] = None,
     ):
+        """
+        Without an `llm`, one is built by the `llm_backend` registered in
+        `ai.backends`, e.g. "openai" or "fake".
+
+        With `pipelined` set, `acall` searches the vector db with the raw message
+        while the query chain is still rewriting it. When the rewrite adds no words
+        to the message, those results are used and the search after the rewrite is
+        skipped, which saves its latency. Otherwise the rewritten query is searched
+        as well and both results are merged: an extra search for better recall,
+        without saving any time.
+
+        An optional `cache` reuses the context summary, and optionally the answer,
+        given to a recent near-duplicate message.
+
+        With a `query_batch_window`, query rewrites of concurrent `acall`s arriving
+        within that many seconds are sent to the LLM as one batch of prompts. Only
+        use it with LLMs that take several prompts per request, like the OpenAI
+        completion models.
+
+        The `context_builder` decides whether the found documents are summarised
+        or fit into the main prompt as they are.
+        """
         self.model_name = model_name
         self.vectordb = vectordb
+        self.pipelined = pipelined
+        self.cache = cache
+        self.context_builder = context_builder or ContextBuilder(model_name=model_name)
 
-        llm = OpenAI(temperature=temperature, model_name=self.model_name)
+        if llm is None:
+            llm = new_llm(llm_backend, self.model_name, temperature)
+        if not any(isinstance(cb, TokenMetrics) for cb in llm.callbacks or []):
+            # Priced by the model the LLM runs, not `model_name`, which only the
+            # OpenAI backend uses.
+            metrics = TokenMetrics(getattr(llm, "model_name", None))
+            llm.callbacks = [*(llm.callbacks or []), metrics]
+        self.llm = llm
 
         self.combine_docs_chain = StuffDocumentsChain(
             llm_chain=LLMChain(llm=llm, prompt=relevant_history_prompt),
@@ -96,44 +195,319 @@ class BuddyAI:
             document_variable_name="context",
         )
 
-        self.memory = ConversationBufferWindowMemory(
-            k=memory_interactions,
-            input_key="human_message",
-            memory_key="chat_history",
-            ai_prefix="(ШІ)",
-            human_prefix="(Людина)",
+        self.memories = ConversationMemoryStore(
+            memory_interactions=memory_interactions,
+            max_conversations=max_conversations,
         )
 
         if self.vectordb and with_query_chain:
             self.query_chain = LLMChain(llm=llm, prompt=prompt_query)
 
-        self.chain = LLMChain(llm=llm, memory=self.memory, prompt=prompt_ai)
+            if query_batch_window > 0:
+                self.query_batcher = Coalescer(
+                    self.query_chain.aapply,
+                    window=query_batch_window,
+                    max_batch_size=max_query_batch_size,
+                )
+
+        self.chain = LLMChain(llm=llm, prompt=prompt_ai)
 
-    def __call__(self, message_content: str) -> Response:
+    def warm_up(self):
+        """
+        Pays the one-off costs of the first request up front. Building `BuddyAI`
+        already creates the LLM client and loads the tokenizer; this loads the
+        vector index and the embedding cache.
+        """
+        if self.vectordb:
+            self.vectordb.warm_up()
+
+    def __call__(
+        self,
+        message_content: str,
+        conversation_id: str = DEFAULT_CONVERSATION_ID,
+    ) -> Response:
         """
         1. Load a whole telegram channel history to a vector database.
         2. Initially when the chat history is empty -- retrieve the last few messages from a telegram channel.
         3. Use the chat history and load new questions and AI's answers to the vector db.
+
+        Recent messages are remembered per `conversation_id` (a chat or channel id).
         """
-        context = ""
-        if self.vectordb:
-            query = message_content
-            if self.query_chain:
-                query = self.query_chain({"human_message": message_content})["text"]
-                log.debug(f"Query chain output: {query}")
+        timings: dict[str, float] = {}
+        with _timed(timings, "total"):
+            embedding = None
+            if self.cache:
+                with _timed(timings, "cache"):
+                    embedding = self.cache.embed(message_content)
+
+            chain_resp = self._cached_answer(
+                embedding, message_content, conversation_id
+            )
+            if chain_resp is None:
+                context = self._cached_context(embedding)
+                if context is None:
+                    context = self._context(message_content, timings)
+                    self._cache_context(embedding, context)
+
+                with _timed(timings, "memory"):
+                    chat_history = self.memories.load(conversation_id)
+
+                with _timed(timings, "answer"):
+                    chain_resp: dict = self.chain(
+                        {
+                            "human_message": message_content,
+                            "context": context,
+                            "chat_history": chat_history,
+                        }
+                    )
+                self._cache_answer(embedding, conversation_id, chain_resp)
+
+        return self._response(chain_resp, conversation_id, timings)
+
+    async def acall(
+        self,
+        message_content: str,
+        conversation_id: str = DEFAULT_CONVERSATION_ID,
+    ) -> Response:
+        """
+        Same as `__call__`, but awaits the chains' async APIs instead of blocking
+        the event loop while the LLM round-trips are in flight.
+        """
+        timings: dict[str, float] = {}
+        with _timed(timings, "total"):
+            embedding, chain_resp = await self._aprepare(
+                message_content, conversation_id, timings
+            )
+            if "text" not in chain_resp:
+                chain_resp = await _atimed(
+                    timings, "answer", self.chain.acall(chain_resp)
+                )
+                self._cache_answer(embedding, conversation_id, chain_resp)
+
+        return self._response(chain_resp, conversation_id, timings)
+
+    async def astream(
+        self,
+        message_content: str,
+        conversation_id: str = DEFAULT_CONVERSATION_ID,
+    ) -> AsyncIterator[str]:
+        """
+        Same as `acall`, but yields the answer piece by piece while the LLM is still
+        generating it.
+        """
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+
+        embedding, chain_resp = await self._aprepare(
+            message_content, conversation_id, timings
+        )
+        if "text" in chain_resp:
+            yield chain_resp["text"]
+        else:
+            prompt = self.chain.prompt.format(**chain_resp)
+            pieces: list[str] = []
+            with _timed(timings, "answer"):
+                async for piece in self.llm.astream(prompt):
+                    if not pieces:
+                        timings["first_token"] = time.perf_counter() - start
+                    pieces.append(piece)
+                    yield piece
+
+            chain_resp = {**chain_resp, "text": "".join(pieces)}
+            self._cache_answer(embedding, conversation_id, chain_resp)
+
+        timings["total"] = time.perf_counter() - start
+        resp = self._response(chain_resp, conversation_id, timings)
+        log.debug(f"Streamed answer timings: {resp.timings}")
 
+    async def _aprepare(
+        self,
+        message_content: str,
+        conversation_id: str,
+        timings: dict[str, float],
+    ) -> tuple[Optional[np.ndarray], dict]:
+        """
+        Returns the message embedding (if there is a cache) and the main chain inputs,
+        or a whole chain response when the answer was cached.
+        """
+        embedding = None
+        if self.cache:
+            embedding = await _atimed(
+                timings, "cache", self.cache.aembed(message_content)
+            )
+
+        chain_resp = self._cached_answer(embedding, message_content, conversation_id)
+        if chain_resp is not None:
+            return embedding, chain_resp
+
+        context = self._cached_context(embedding)
+        if context is None:
+            context = await self._acontext(message_content, timings)
+            self._cache_context(embedding, context)
+
+        with _timed(timings, "memory"):
+            chat_history = self.memories.load(conversation_id)
+
+        return embedding, {
+            "human_message": message_content,
+            "context": context,
+            "chat_history": chat_history,
+        }
+
+    def _context(self, message_content: str, timings: dict[str, float]) -> str:
+        if not self.vectordb:
+            return ""
+
+        query = message_content
+        if self.query_chain:
+            with _timed(timings, "query"):
+                query_resp = self.query_chain({"human_message": message_content})
+            query = query_resp["text"]
+            log.debug(f"Query chain output: {query}")
+
+        with _timed(timings, "search"):
             docs = self.vectordb.get_relevant_documents(query)
-            log.debug(f"Relevant docs from the DB: {docs}")
+        log.debug(f"Relevant docs from the DB: {docs}")
+
+        context = self.context_builder.direct_context(docs)
+        if context is not None:
+            return context
+
+        docs = self.context_builder.summary_documents(docs)
+        with _timed(timings, "summary"):
+            docs_resp = self.combine_docs_chain({"input_documents": docs})
+        context = docs_resp["output_text"]
+        log.debug(f"Generated context: {context}")
+
+        return context
+
+    async def _acontext(self, message_content: str, timings: dict[str, float]) -> str:
+        if not self.vectordb:
+            return ""
+
+        if self.pipelined:
+            docs = await self._apipelined_search(message_content, timings)
+        else:
+            docs = await self._asearch(message_content, timings)
+        log.debug(f"Relevant docs from the DB: {docs}")
+
+        context = self.context_builder.direct_context(docs)
+        if context is not None:
+            return context
+
+        docs = self.context_builder.summary_documents(docs)
+        docs_resp = await _atimed(
+            timings,
+            "summary",
+            self.combine_docs_chain.acall({"input_documents": docs}),
+        )
+        context = docs_resp["output_text"]
+        log.debug(f"Generated context: {context}")
+
+        return context
+
+    async def _aquery(self, message_content: str) -> str:
+        inputs = {"human_message": message_content}
+        if self.query_batcher:
+            return (await self.query_batcher(inputs))["text"]
+
+        return (await self.query_chain.acall(inputs))["text"]
 
-            context = self.combine_docs_chain({"input_documents": docs})["output_text"]
-            log.debug(f"Generated context: {context}")
+    def _cached_answer(
+        self,
+        embedding: Optional[np.ndarray],
+        message_content: str,
+        conversation_id: str,
+    ) -> Optional[dict]:
+        if embedding is None or self.cache.answers is None:
+            return None
+
+        cached = self.cache.answers.lookup(embedding, scope=conversation_id)
+        if cached is None:
+            return None
+
+        log.debug(f"Answer cache hit: {cached}")
+        return {
+            "human_message": message_content,
+            "chat_history": self.memories.load(conversation_id),
+            **cached,
+        }
+
+    def _cache_answer(
+        self, embedding: Optional[np.ndarray], conversation_id: str, chain_resp: dict
+    ):
+        if embedding is None or self.cache.answers is None:
+            return
+
+        self.cache.answers.store(
+            embedding,
+            {"context": chain_resp["context"], "text": chain_resp.get("text", "")},
+            scope=conversation_id,
+        )
+
+    def _cached_context(self, embedding: Optional[np.ndarray]) -> Optional[str]:
+        if embedding is None or not self.vectordb:
+            return None
+
+        return self.cache.contexts.lookup(embedding)
+
+    def _cache_context(self, embedding: Optional[np.ndarray], context: str):
+        if embedding is None or not self.vectordb:
+            return
+
+        self.cache.contexts.store(embedding, context)
+
+    async def _asearch(
+        self, message_content: str, timings: dict[str, float]
+    ) -> list[Document]:
+        query = message_content
+        if self.query_chain:
+            query = await _atimed(timings, "query", self._aquery(message_content))
+            log.debug(f"Query chain output: {query}")
+
+        return await _atimed(
+            timings, "search", self.vectordb.aget_relevant_documents(query)
+        )
+
+    async def _apipelined_search(
+        self, message_content: str, timings: dict[str, float]
+    ) -> list[Document]:
+        if not self.query_chain:
+            return await self._asearch(message_content, timings)
+
+        speculative = asyncio.ensure_future(
+            _atimed(
+                timings,
+                "speculative_search",
+                self.vectordb.aget_relevant_documents(message_content),
+            )
+        )
+        query = await _atimed(timings, "query", self._aquery(message_content))
+        log.debug(f"Query chain output: {query}")
+        if not adds_words(query, message_content):
+            return await speculative
+
+        docs = await _atimed(
+            timings, "search", self.vectordb.aget_relevant_documents(query)
+        )
+        speculative_docs = await speculative
+
+        return merge_documents(
+            docs, speculative_docs, limit=max(len(docs), len(speculative_docs))
+        )
 
-        chain_resp: dict = self.chain(
-            {"human_message": message_content, "context": context}
+    def _response(
+        self, chain_resp: dict, conversation_id: str, timings: dict[str, float]
+    ) -> Response:
+        self.memories.save(
+            conversation_id, chain_resp["human_message"], chain_resp.get("text", "")
         )
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
 
         return Response(
             answer=chain_resp.get("text", ""),
             chat_history=chain_resp.get("chat_history", ""),
             context=chain_resp.get("context", ""),
+            timings=timings,
         )
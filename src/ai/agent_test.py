@@ -0,0 +1,195 @@
+import asyncio
+import unittest
+from typing import Optional
+
+from langchain.embeddings import DeterministicFakeEmbedding
+from langchain.schema import Document
+
+from ai.agent import BuddyAI, merge_documents
+from ai.cache import ResponseCache
+from ai.context import ContextBuilder
+from ai.fake import FakeLLM
+
+
+class StubVectorDB:
+    """
+    Answers every search with a document named after the query. With `llm` set,
+    `llm_in_flight` records the LLM calls awaited when each search finished.
+    """
+
+    def __init__(self, latency: float = 0.0, llm: Optional[FakeLLM] = None):
+        self.latency = latency
+        self.llm = llm
+        self.queries: list[str] = []
+        self.llm_in_flight: dict[str, int] = {}
+
+    def get_relevant_documents(self, query: str) -> list[Document]:
+        self.queries.append(query)
+        if self.llm is not None:
+            self.llm_in_flight[query] = self.llm.in_flight
+        return [Document(page_content=f"doc for {query}")]
+
+    async def aget_relevant_documents(self, query: str) -> list[Document]:
+        await asyncio.sleep(self.latency)
+        return self.get_relevant_documents(query)
+
+
+class TestBuddyAIConversations(unittest.TestCase):
+    def test_interleaved_conversations_do_not_leak(self):
+        buddy_ai = BuddyAI(llm=FakeLLM(latency=0.01))
+
+        async def talk(conversation_id: str, n: int):
+            return [
+                await buddy_ai.acall(f"{conversation_id}-{i}", conversation_id)
+                for i in range(n)
+            ]
+
+        async def interleave():
+            return await asyncio.gather(talk("alpha", 3), talk("beta", 3))
+
+        alpha, beta = asyncio.run(interleave())
+
+        self.assertEqual(alpha[0].chat_history, "")
+        self.assertEqual(beta[0].chat_history, "")
+        self.assertIn("alpha-0", alpha[-1].chat_history)
+        self.assertIn("alpha-1", alpha[-1].chat_history)
+        self.assertIn("beta-1", beta[-1].chat_history)
+        for resp in alpha:
+            self.assertNotIn("beta", resp.chat_history)
+        for resp in beta:
+            self.assertNotIn("alpha", resp.chat_history)
+
+        alpha_history = buddy_ai.memories.load("alpha")
+        buddy_ai("beta-3", "beta")
+        self.assertEqual(buddy_ai.memories.load("alpha"), alpha_history)
+
+    def test_streamed_answer_is_remembered(self):
+        buddy_ai = BuddyAI(llm=FakeLLM(response="раз два три"))
+
+        async def stream():
+            return [piece async for piece in buddy_ai.astream("hello", "a")]
+
+        self.assertEqual(asyncio.run(stream()), ["раз ", "два ", "три"])
+        self.assertIn("раз два три", buddy_ai.memories.load("a"))
+
+    def test_first_piece_arrives_early(self):
+        llm = FakeLLM(response="a b c d e f", token_latency=0.01)
+        buddy_ai = BuddyAI(llm=llm)
+
+        async def in_flight_at_first_piece() -> int:
+            async for _ in buddy_ai.astream("hello"):
+                return llm.in_flight
+
+        # The answer is still being generated when its first piece arrives.
+        self.assertEqual(asyncio.run(in_flight_at_first_piece()), 1)
+
+
+class TestBuddyAIPipeline(unittest.TestCase):
+    latency = 0.1
+
+    def answer(self, pipelined: bool):
+        llm = FakeLLM(response="keywords", latency=self.latency)
+        vectordb = StubVectorDB(latency=self.latency, llm=llm)
+        buddy_ai = BuddyAI(
+            vectordb=vectordb,
+            llm=llm,
+            pipelined=pipelined,
+            # Always summarise, so that every stage is timed.
+            context_builder=ContextBuilder(max_context_tokens=0),
+        )
+        return vectordb, asyncio.run(buddy_ai.acall("hello"))
+
+    def test_sequential_stages_are_timed(self):
+        vectordb, resp = self.answer(pipelined=False)
+
+        self.assertEqual(vectordb.queries, ["keywords"])
+        for stage in ["query", "search", "summary", "memory", "answer", "total"]:
+            self.assertIn(stage, resp.timings)
+        self.assertGreaterEqual(resp.timings["total"], 4 * self.latency)
+        self.assertEqual(vectordb.llm_in_flight, {"keywords": 0})
+
+    def test_pipelined_search_overlaps_query_rewrite(self):
+        vectordb, resp = self.answer(pipelined=True)
+
+        self.assertCountEqual(vectordb.queries, ["hello", "keywords"])
+        self.assertIn("speculative_search", resp.timings)
+        self.assertLess(resp.timings["speculative_search"], resp.timings["total"])
+        # The extra search ran while the query was being rewritten.
+        self.assertEqual(vectordb.llm_in_flight, {"hello": 1, "keywords": 0})
+
+    def test_rewrite_adding_nothing_skips_the_second_search(self):
+        llm = FakeLLM(response="Hello!")
+        vectordb = StubVectorDB(llm=llm)
+        buddy_ai = BuddyAI(vectordb=vectordb, llm=llm, pipelined=True)
+        resp = asyncio.run(buddy_ai.acall("hello there"))
+
+        self.assertEqual(vectordb.queries, ["hello there"])
+        self.assertNotIn("search", resp.timings)
+
+    def test_concurrent_query_rewrites_are_batched(self):
+        buddy_ai = BuddyAI(
+            vectordb=StubVectorDB(),
+            llm=FakeLLM(response="keywords"),
+            query_batch_window=0.01,
+        )
+
+        async def load():
+            return await asyncio.gather(*[buddy_ai.acall(f"hi {i}") for i in range(5)])
+
+        responses = asyncio.run(load())
+
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(buddy_ai.query_batcher.batches, 1)
+        self.assertEqual(buddy_ai.query_batcher.items, 5)
+
+    def test_summary_is_skipped_when_docs_fit(self):
+        llm = FakeLLM(response="keywords")
+        buddy_ai = BuddyAI(vectordb=StubVectorDB(), llm=llm)
+        resp = asyncio.run(buddy_ai.acall("hello"))
+
+        self.assertEqual(resp.context, "doc for keywords")
+        self.assertNotIn("summary", resp.timings)
+        self.assertEqual(llm.calls, 2)  # The query rewrite and the answer.
+        self.assertEqual(buddy_ai.context_builder.stats()["direct"], 1)
+
+    def test_merge_documents_dedupes(self):
+        a, b, c = (Document(page_content=text) for text in "abc")
+        merged = merge_documents([a, b], [b, c], limit=3)
+        self.assertEqual([doc.page_content for doc in merged], ["a", "b", "c"])
+
+
+class TestBuddyAICache(unittest.TestCase):
+    def buddy_ai(self, cache_answers: bool):
+        self.vectordb = StubVectorDB()
+        self.llm = FakeLLM()
+        self.cache = ResponseCache(
+            DeterministicFakeEmbedding(size=8), cache_answers=cache_answers
+        )
+        return BuddyAI(vectordb=self.vectordb, llm=self.llm, cache=self.cache)
+
+    def test_context_is_reused(self):
+        buddy_ai = self.buddy_ai(cache_answers=False)
+        buddy_ai("hello")
+        llm_calls = self.llm.calls
+        resp = asyncio.run(buddy_ai.acall("hello"))
+
+        self.assertEqual(len(self.vectordb.queries), 1)
+        self.assertEqual(self.llm.calls, llm_calls + 1)  # Only the answer.
+        self.assertNotIn("summary", resp.timings)
+        self.assertEqual(self.cache.stats()["context"]["hits"], 1)
+
+    def test_answer_is_reused_per_conversation(self):
+        buddy_ai = self.buddy_ai(cache_answers=True)
+        first = buddy_ai("hello", "a")
+        llm_calls = self.llm.calls
+        second = buddy_ai("hello", "a")
+
+        self.assertEqual(self.llm.calls, llm_calls)
+        self.assertEqual(second.answer, first.answer)
+        self.assertIn("hello", second.chat_history)
+
+        buddy_ai("hello", "b")
+        self.assertEqual(self.llm.calls, llm_calls + 1)
+        self.assertEqual(
+            self.cache.stats()["answer"], {"hits": 1, "misses": 2, "size": 2}
+        )
@@ -0,0 +1,108 @@
+import logging
+from typing import Callable, Optional
+
+from langchain.embeddings.base import Embeddings
+from langchain.schema.language_model import BaseLanguageModel
+
+from ai import LOCAL_EMBEDDING_MODEL, OPENAI_EMBEDDING_MODEL
+
+log = logging.getLogger(__name__)
+
+
+EmbeddingsFactory = Callable[[str], Embeddings]
+LLMFactory = Callable[[str, float], BaseLanguageModel]
+
+EMBEDDING_BACKENDS: dict[str, EmbeddingsFactory] = {}
+# The model each embedding backend uses unless another one is asked for.
+EMBEDDING_MODELS: dict[str, str] = {}
+LLM_BACKENDS: dict[str, LLMFactory] = {}
+
+
+def register_embeddings(
+    name: str, default_model: str = ""
+) -> Callable[[EmbeddingsFactory], EmbeddingsFactory]:
+    """Registers a factory that builds an embedding model from its name."""
+
+    def register(factory: EmbeddingsFactory) -> EmbeddingsFactory:
+        EMBEDDING_BACKENDS[name] = factory
+        EMBEDDING_MODELS[name] = default_model
+        return factory
+
+    return register
+
+
+def register_llm(name: str) -> Callable[[LLMFactory], LLMFactory]:
+    """Registers a factory that builds an LLM from its name and temperature."""
+
+    def register(factory: LLMFactory) -> LLMFactory:
+        LLM_BACKENDS[name] = factory
+        return factory
+
+    return register
+
+
+def embedding_model(backend: str, model: Optional[str] = None) -> str:
+    """`model`, or the default model of the backend."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}, "
+            f"expected one of {sorted(EMBEDDING_BACKENDS)}"
+        )
+
+    return model or EMBEDDING_MODELS[backend]
+
+
+def new_embeddings(backend: str, model: Optional[str] = None) -> Embeddings:
+    model = embedding_model(backend, model)
+    log.info(f"Using {backend} embeddings {model}")
+    return EMBEDDING_BACKENDS[backend](model)
+
+
+def new_llm(backend: str, model_name: str, temperature: float) -> BaseLanguageModel:
+    if backend not in LLM_BACKENDS:
+        raise ValueError(
+            f"Unknown LLM backend {backend!r}, expected one of {sorted(LLM_BACKENDS)}"
+        )
+
+    log.info(f"Using {backend} LLM {model_name}")
+    return LLM_BACKENDS[backend](model_name, temperature)
+
+
+@register_embeddings("openai", default_model=OPENAI_EMBEDDING_MODEL)
+def _openai_embeddings(model: str) -> Embeddings:
+    from langchain.embeddings import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=model)
+
+
+@register_embeddings("local", default_model=LOCAL_EMBEDDING_MODEL)
+def _local_embeddings(model: str) -> Embeddings:
+    """A sentence-transformers model run on the CPU; needs `sentence-transformers`."""
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=model,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+@register_embeddings("fake", default_model="fake")
+def _fake_embeddings(model: str) -> Embeddings:
+    from ai.fake import FakeEmbeddings
+
+    return FakeEmbeddings()
+
+
+@register_llm("openai")
+def _openai_llm(model_name: str, temperature: float) -> BaseLanguageModel:
+    from langchain.llms import OpenAI
+
+    return OpenAI(temperature=temperature, model_name=model_name)
+
+
+@register_llm("fake")
+def _fake_llm(model_name: str, temperature: float) -> BaseLanguageModel:
+    from ai.fake import FakeLLM
+
+    return FakeLLM()
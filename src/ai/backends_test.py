@@ -0,0 +1,81 @@
+import asyncio
+import importlib.util
+import tempfile
+import unittest
+
+from langchain.schema import Document
+
+from ai import LOCAL_EMBEDDING_MODEL, OPENAI_EMBEDDING_MODEL
+from ai.agent import BuddyAI
+from ai.backends import (
+    EMBEDDING_BACKENDS,
+    embedding_model,
+    new_embeddings,
+    new_llm,
+    register_embeddings,
+)
+from ai.db import VectorDB, VectorDBConfig
+from ai.fake import FakeEmbeddings, FakeLLM
+
+
+class TestBackends(unittest.TestCase):
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            new_embeddings("nope", "model")
+        with self.assertRaises(ValueError):
+            new_llm("nope", "model", 0.7)
+
+    def test_register(self):
+        @register_embeddings("small")
+        def small(model: str):
+            return FakeEmbeddings(size=8)
+
+        try:
+            self.assertEqual(len(new_embeddings("small", "").embed_query("a")), 8)
+        finally:
+            del EMBEDDING_BACKENDS["small"]
+
+    def test_default_models(self):
+        self.assertEqual(embedding_model("openai"), OPENAI_EMBEDDING_MODEL)
+        self.assertEqual(embedding_model("local"), LOCAL_EMBEDDING_MODEL)
+        self.assertEqual(embedding_model("local", "other"), "other")
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("sentence_transformers"),
+        "needs sentence-transformers",
+    )
+    def test_local_embeddings(self):
+        """Downloads the model on the first run."""
+        with tempfile.TemporaryDirectory() as dir:
+            vectordb = VectorDB(
+                VectorDBConfig(embedding_backend="local", persistent_dir=dir)
+            )
+            vectordb.store_documents(
+                [Document(page_content=text) for text in ("пиво", "погода", "кіт")]
+            )
+            docs = vectordb.get_relevant_documents("яке сьогодні пиво?")
+            self.assertEqual(docs[0].page_content, "пиво")
+
+    def test_offline_pipeline(self):
+        with tempfile.TemporaryDirectory() as dir:
+            vectordb = VectorDB(
+                VectorDBConfig(
+                    embedding_backend="fake",
+                    embedding_model="fake",
+                    persistent_dir=dir,
+                    search_k=2,
+                )
+            )
+            vectordb.store_documents(
+                [Document(page_content=f"повідомлення {i}") for i in range(10)]
+            )
+            buddy_ai = BuddyAI(vectordb=vectordb, llm_backend="fake")
+            resp = asyncio.run(buddy_ai.acall("повідомлення 3"))
+
+        self.assertIsInstance(buddy_ai.llm, FakeLLM)
+        self.assertEqual(resp.answer, FakeLLM().response)
+        self.assertIn("повідомлення", resp.context)
+
+
+if __name__ == "__main__":
+    unittest.main()
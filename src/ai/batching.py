@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Coalescer(Generic[T, R]):
+    """
+    Collects the calls arriving within `window` seconds of the first one, up to
+    `max_batch_size` of them, and serves them with a single call of `fn`, which maps
+    a list of items to the list of their results, one per item in order.
+    """
+
+    fn: Callable[[list[T]], Awaitable[list[R]]]
+    window: float
+    max_batch_size: int
+
+    batches: int
+    items: int
+
+    def __init__(
+        self,
+        fn: Callable[[list[T]], Awaitable[list[R]]],
+        window: float = 0.005,
+        max_batch_size: int = 32,
+    ):
+        self.fn = fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.items = 0
+        self._pending: list[tuple[T, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # The loop only keeps weak references to tasks; these are the running batches.
+        self._tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[T, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        log.debug(f"Running a batch of {len(batch)}")
+
+        try:
+            results = await self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(
+                    f"Got {len(results)} results for a batch of {len(batch)}"
+                )
+        except Exception as err:
+            self._fail(batch, err)
+            return
+        except BaseException as err:
+            # Cancelled or interrupted: the callers must not wait forever either.
+            self._fail(batch, err)
+            raise
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _fail(batch: list[tuple[T, asyncio.Future]], err: BaseException):
+        for _, future in batch:
+            if future.done():
+                continue
+            if isinstance(err, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(err)
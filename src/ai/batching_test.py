@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from ai.batching import Coalescer
+
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.batches: list[list[int]] = []
+
+    async def double(self, items: list[int]) -> list[int]:
+        self.batches.append(items)
+        if 0 in items:
+            raise ValueError("zero")
+        return [item * 2 for item in items]
+
+    def test_concurrent_calls_share_a_batch(self):
+        coalescer = Coalescer(self.double, window=0.01)
+
+        async def run():
+            return await asyncio.gather(*[coalescer(i) for i in range(1, 6)])
+
+        self.assertEqual(asyncio.run(run()), [2, 4, 6, 8, 10])
+        self.assertEqual(self.batches, [[1, 2, 3, 4, 5]])
+
+    def test_max_batch_size(self):
+        coalescer = Coalescer(self.double, window=10, max_batch_size=2)
+
+        async def run():
+            return await asyncio.gather(*[coalescer(i) for i in range(1, 5)])
+
+        self.assertEqual(asyncio.run(run()), [2, 4, 6, 8])
+        self.assertEqual(self.batches, [[1, 2], [3, 4]])
+
+    def test_errors_reach_every_caller(self):
+        coalescer = Coalescer(self.double, window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                coalescer(0), coalescer(1), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(res, ValueError) for res in results))
+
+    def test_missing_results_fail_the_callers(self):
+        async def short(items: list[int]) -> list[int]:
+            return items[:1]
+
+        coalescer = Coalescer(short, window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                coalescer(1), coalescer(2), return_exceptions=True
+            )
+
+        results = asyncio.run(asyncio.wait_for(run(), timeout=5))
+        self.assertTrue(all(isinstance(res, ValueError) for res in results))
+
+    def test_cancelled_batch_cancels_the_callers(self):
+        async def cancelled(items: list[int]) -> list[int]:
+            raise asyncio.CancelledError()
+
+        coalescer = Coalescer(cancelled, window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                coalescer(1), coalescer(2), return_exceptions=True
+            )
+
+        results = asyncio.run(asyncio.wait_for(run(), timeout=5))
+        self.assertTrue(all(isinstance(res, asyncio.CancelledError) for res in results))
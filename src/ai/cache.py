@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from ai.metrics import CACHE_LOOKUPS
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    embedding: np.ndarray  # Normalised.
+    value: Any
+    scope: str
+    expires_at: float
+
+
+class SemanticCache:
+    """
+    Stores values keyed by text embeddings. A lookup returns the value of the most
+    similar unexpired entry within the same scope if its cosine similarity reaches
+    `threshold`. Holds at most `max_size` entries, evicting the least recently used.
+    Lookups are counted in `CACHE_LOOKUPS` under `name`.
+    """
+
+    name: str
+    threshold: float
+    ttl: float
+    max_size: int
+
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        ttl: float = 600.0,
+        max_size=256,
+        name: str = "semantic",
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._next_key = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, embedding: np.ndarray, scope: str = "") -> Optional[Any]:
+        with self._lock:
+            self._expire()
+
+            keys = [k for k, e in self._entries.items() if e.scope == scope]
+            if keys:
+                matrix = np.stack([self._entries[k].embedding for k in keys])
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+                    self._entries.move_to_end(keys[best])
+                    return self._entries[keys[best]].value
+
+            self.misses += 1
+            CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+
+    def store(self, embedding: np.ndarray, value: Any, scope: str = ""):
+        with self._lock:
+            self._entries[self._next_key] = CacheEntry(
+                embedding=embedding,
+                value=value,
+                scope=scope,
+                expires_at=time.monotonic() + self.ttl,
+            )
+            self._next_key += 1
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [k for k, e in self._entries.items() if e.expires_at <= now]
+        for k in expired:
+            del self._entries[k]
+
+
+class ResponseCache:
+    """
+    Caches `BuddyAI` results for near-duplicate messages. The `context` summary is
+    shared by all conversations; final answers are only cached when `cache_answers`
+    is set, and only reused within the conversation they were given in, so the
+    personality reply can stay fresh.
+    """
+
+    embeddings: Embeddings
+    contexts: SemanticCache
+    answers: Optional[SemanticCache]
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = 0.95,
+        ttl: float = 600.0,
+        max_size: int = 256,
+        cache_answers: bool = False,
+    ):
+        self.embeddings = embeddings
+        self.contexts = SemanticCache(
+            threshold=threshold, ttl=ttl, max_size=max_size, name="context"
+        )
+        self.answers = None
+        if cache_answers:
+            self.answers = SemanticCache(
+                threshold=threshold, ttl=ttl, max_size=max_size, name="answer"
+            )
+
+    def embed(self, text: str) -> np.ndarray:
+        return self._normalise(self.embeddings.embed_query(text))
+
+    async def aembed(self, text: str) -> np.ndarray:
+        try:
+            embedding = await self.embeddings.aembed_query(text)
+        except NotImplementedError:
+            embedding = await asyncio.get_running_loop().run_in_executor(
+                None, self.embeddings.embed_query, text
+            )
+
+        return self._normalise(embedding)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        stats = {"context": self.contexts.stats()}
+        if self.answers is not None:
+            stats["answer"] = self.answers.stats()
+
+        return stats
+
+    @staticmethod
+    def _normalise(embedding: list[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
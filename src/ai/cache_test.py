@@ -0,0 +1,58 @@
+import time
+import unittest
+
+import numpy as np
+
+from ai.cache import SemanticCache
+from ai.metrics import CACHE_LOOKUPS
+
+
+def unit(*values: float) -> np.ndarray:
+    vec = np.array(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+class TestSemanticCache(unittest.TestCase):
+    def test_threshold(self):
+        cache = SemanticCache(threshold=0.9)
+        cache.store(unit(1, 0), "x")
+
+        self.assertEqual(cache.lookup(unit(1, 0.1)), "x")
+        self.assertIsNone(cache.lookup(unit(1, 1)))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_lookups_are_counted(self):
+        hits = CACHE_LOOKUPS.value(cache="test", result="hit")
+        misses = CACHE_LOOKUPS.value(cache="test", result="miss")
+        cache = SemanticCache(name="test")
+        cache.store(unit(1, 0), "x")
+        cache.lookup(unit(1, 0))
+        cache.lookup(unit(0, 1))
+
+        self.assertEqual(CACHE_LOOKUPS.value(cache="test", result="hit"), hits + 1)
+        self.assertEqual(CACHE_LOOKUPS.value(cache="test", result="miss"), misses + 1)
+
+    def test_scope(self):
+        cache = SemanticCache()
+        cache.store(unit(1, 0), "x", scope="a")
+
+        self.assertIsNone(cache.lookup(unit(1, 0), scope="b"))
+        self.assertEqual(cache.lookup(unit(1, 0), scope="a"), "x")
+
+    def test_ttl(self):
+        cache = SemanticCache(ttl=0.01)
+        cache.store(unit(1, 0), "x")
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.lookup(unit(1, 0)))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = SemanticCache(max_size=2)
+        cache.store(unit(1, 0, 0), "x")
+        cache.store(unit(0, 1, 0), "y")
+        cache.lookup(unit(1, 0, 0))
+        cache.store(unit(0, 0, 1), "z")
+
+        self.assertEqual(cache.lookup(unit(1, 0, 0)), "x")
+        self.assertIsNone(cache.lookup(unit(0, 1, 0)))
@@ -0,0 +1,60 @@
+import logging
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from ai import OPENAI_MODEL_NAME
+from ai.context import token_counter
+from ai.metrics import LLM_COST, LLM_TOKENS, current_stage, llm_cost
+
+log = logging.getLogger(__name__)
+
+
+class TokenMetrics(BaseCallbackHandler):
+    """
+    Counts the prompt and completion tokens of every LLM call in `LLM_TOKENS`,
+    labelled with the current stage, and their price in `LLM_COST`. Uses the usage
+    the API reports, or counts the tokens locally when there is none, as with
+    streaming. Calls are priced by `model_name`, the model of the LLM; without one,
+    as with the fake LLM, or with a model that has no price, they are not priced.
+    """
+
+    # Async runs hand other handlers to an executor, which loses `current_stage`.
+    run_inline = True
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name
+        self.count_tokens = token_counter(model_name or OPENAI_MODEL_NAME)
+        self._prompts: dict[UUID, tuple[str, list[str]]] = {}
+
+    def on_llm_start(
+        self, serialized: dict[str, Any], prompts: list[str], *, run_id: UUID, **kwargs
+    ):
+        self._prompts[run_id] = (current_stage.get(), prompts)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        stage, prompts = self._prompts.pop(run_id, ("", []))
+        usage: Optional[dict] = (response.llm_output or {}).get("token_usage")
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens = sum(self.count_tokens(prompt) for prompt in prompts)
+            completion_tokens = sum(
+                self.count_tokens(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+
+        LLM_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, stage=stage, kind="completion")
+        if self.model_name is None:
+            return
+        cost = llm_cost(self.model_name, prompt_tokens, completion_tokens)
+        if cost is not None:
+            LLM_COST.inc(cost, stage=stage, model=self.model_name)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._prompts.pop(run_id, None)
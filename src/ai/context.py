@@ -0,0 +1,114 @@
+import functools
+import logging
+from typing import Callable, Optional
+
+import tiktoken
+from langchain.schema import Document
+
+from ai import OPENAI_MODEL_NAME
+from ai.metrics import CONTEXTS, SUMMARY_TOKENS
+
+log = logging.getLogger(__name__)
+
+
+DOCUMENT_SEPARATOR = "\n\n"  # The one `StuffDocumentsChain` joins documents with.
+BYTES_PER_TOKEN = 4
+
+
+def token_counter(model_name: str = OPENAI_MODEL_NAME) -> Callable[[str], int]:
+    """
+    Counts tokens locally with the model's tokenizer. If the tokenizer cannot be
+    loaded, as offline on its first use, tokens are estimated from the UTF-8 size,
+    which slightly overcounts for both Latin and Cyrillic text, with a warning.
+    """
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return lambda text: -(-len(text.encode()) // BYTES_PER_TOKEN)
+
+    return lambda text: len(encoding.encode(text))
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model_name: str) -> Optional[tiktoken.Encoding]:
+    # tiktoken downloads the tokenizers on first use, then reads them from its cache.
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning(f"Estimating token counts, no tokenizer for {model_name}: {e!r}")
+        return None
+
+
+class ContextBuilder:
+    """
+    Turns the found documents into the context of the main prompt. When all of
+    them fit into `max_context_tokens`, they are used as they are and the summary
+    call is skipped. Otherwise the best ranked documents that fit into
+    `max_summary_tokens` are handed to the summary chain. Contexts are counted in
+    `CONTEXTS` by mode, and the summarised tokens in `SUMMARY_TOKENS`.
+    """
+
+    max_context_tokens: int
+    max_summary_tokens: int
+    count_tokens: Callable[[str], int]
+
+    direct: int
+    summarised: int
+    summary_tokens: int
+
+    def __init__(
+        self,
+        max_context_tokens: int = 500,
+        max_summary_tokens: int = 2000,
+        model_name: str = OPENAI_MODEL_NAME,
+    ):
+        self.max_context_tokens = max_context_tokens
+        self.max_summary_tokens = max_summary_tokens
+        self.count_tokens = token_counter(model_name)
+        self.direct = 0
+        self.summarised = 0
+        self.summary_tokens = 0
+
+    def direct_context(self, docs: list[Document]) -> Optional[str]:
+        """The documents joined, or None if they need to be summarised."""
+        context = DOCUMENT_SEPARATOR.join(doc.page_content for doc in docs)
+        if self.count_tokens(context) > self.max_context_tokens:
+            return None
+
+        self.direct += 1
+        CONTEXTS.inc(mode="direct")
+        return context
+
+    def summary_documents(self, docs: list[Document]) -> list[Document]:
+        """Packs the documents, best ranked first, into the summary budget."""
+        separator_tokens = self.count_tokens(DOCUMENT_SEPARATOR)
+        packed: list[Document] = []
+        tokens = 0
+        for doc in docs:
+            doc_tokens = self.count_tokens(doc.page_content)
+            if packed:
+                doc_tokens += separator_tokens
+                # The best document is kept even when it alone is over budget.
+                if tokens + doc_tokens > self.max_summary_tokens:
+                    continue
+
+            packed.append(doc)
+            tokens += doc_tokens
+
+        log.debug(
+            f"Summarising {len(packed)} of {len(docs)} documents, {tokens} tokens"
+        )
+        self.summarised += 1
+        self.summary_tokens += tokens
+        CONTEXTS.inc(mode="summarised")
+        SUMMARY_TOKENS.inc(tokens)
+        return packed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "direct": self.direct,
+            "summarised": self.summarised,
+            "summary_tokens": self.summary_tokens,
+        }
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+import tiktoken
+from langchain.schema import Document
+
+from ai.context import ContextBuilder, token_counter
+from ai.metrics import CONTEXTS, SUMMARY_TOKENS
+
+
+class TestContextBuilder(unittest.TestCase):
+    def setUp(self):
+        self.builder = ContextBuilder(max_context_tokens=30, max_summary_tokens=60)
+        # One token per word keeps the budgets easy to follow.
+        self.builder.count_tokens = lambda text: len(text.split())
+
+    @staticmethod
+    def docs(*sizes: int) -> list[Document]:
+        return [Document(page_content=" ".join(["слово"] * size)) for size in sizes]
+
+    def test_docs_that_fit_are_used_directly(self):
+        docs = self.docs(10, 20)
+
+        self.assertEqual(
+            self.builder.direct_context(docs),
+            "\n\n".join(doc.page_content for doc in docs),
+        )
+        self.assertEqual(self.builder.stats()["direct"], 1)
+
+    def test_docs_over_budget_are_packed_for_summary(self):
+        docs = self.docs(25, 40, 20, 30)
+        summarised = CONTEXTS.value(mode="summarised")
+        summary_tokens = SUMMARY_TOKENS.value()
+
+        self.assertIsNone(self.builder.direct_context(docs))
+        self.assertEqual(self.builder.summary_documents(docs), [docs[0], docs[2]])
+        self.assertEqual(
+            self.builder.stats(), {"direct": 0, "summarised": 1, "summary_tokens": 45}
+        )
+        self.assertEqual(CONTEXTS.value(mode="summarised"), summarised + 1)
+        self.assertEqual(SUMMARY_TOKENS.value(), summary_tokens + 45)
+
+    def test_best_doc_is_always_summarised(self):
+        docs = self.docs(100, 10)
+        self.assertEqual(self.builder.summary_documents(docs), docs[:1])
+
+
+class TestTokenCounter(unittest.TestCase):
+    def test_offline_tokenizer_is_estimated_loudly(self):
+        offline = mock.Mock(side_effect=ConnectionError("offline"))
+        with mock.patch.multiple(
+            tiktoken, encoding_for_model=offline, get_encoding=offline
+        ), self.assertLogs("ai.context", level="WARNING") as logs:
+            count_tokens = token_counter("offline-model")
+
+        self.assertEqual(count_tokens("привіт"), 3)  # 12 bytes.
+        self.assertIn("offline-model", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,43 +1,306 @@
 from langchain.vectorstores import Chroma
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores.base import VectorStoreRetriever
+from chromadb.api.models.Collection import Collection
+from langchain.embeddings.base import Embeddings
 from langchain.docstore.document import Document
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.schema import Document
 
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional, Union
 from dataclasses import dataclass
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 
-from ai import OPENAI_EMBEDDING_MODEL
-import sqlite3
+from ai.backends import embedding_model, new_embeddings
+from ai.batching import Coalescer
+from ai.embeddings import CachedEmbeddings
+from ai.index import NumpyIndex
+from ai.metadata import MetadataStore  # noqa: F401, re-exported.
+from ai.metrics import RETRIEVED_DOCUMENTS, VECTORDB_SECONDS
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
 
 def create_documents(texts: list[str], separator="\n\n") -> list[Document]:
-    text_splitter = CharacterTextSplitter(
-        separator=separator,
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    united_texts = separator.join(texts)
+    return list(iter_documents(texts, separator=separator))
+
+
+def iter_documents(
+    messages: Iterable,
+    separator: str = "\n\n",
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    metadata: Optional[dict] = None,
+) -> Iterator[Document]:
+    """
+    Lazily merges messages into chunks of up to `chunk_size` characters that overlap
+    by up to `chunk_overlap` characters, like `CharacterTextSplitter` does with
+    the joined texts, but never splits a message. Only the current chunk is kept in
+    memory.
+
+    `messages` are either texts or `telegram.channel.Message`s; chunks of the latter
+    carry the ids, time range and authors of their messages as metadata. `metadata`
+    is added to every chunk.
+    """
+    separator_len = len(separator)
+    current: deque = deque()
+    total = 0
+
+    for msg in messages:
+        text = msg if isinstance(msg, str) else msg.context_text
+        if text == "":
+            continue
+
+        if total + len(text) + (separator_len if current else 0) > chunk_size:
+            if total > chunk_size:
+                log.warning(
+                    f"Created a chunk of size {total}, "
+                    f"which is longer than the specified {chunk_size}"
+                )
+            if current:
+                document = _join_messages(current, separator, metadata)
+                if document is not None:
+                    yield document
+
+                while total > chunk_overlap or (
+                    total + len(text) + (separator_len if current else 0) > chunk_size
+                    and total > 0
+                ):
+                    total -= len(_text(current[0])) + (
+                        separator_len if len(current) > 1 else 0
+                    )
+                    current.popleft()
+
+        current.append(msg)
+        total += len(text) + (separator_len if len(current) > 1 else 0)
+
+    document = _join_messages(current, separator, metadata)
+    if document is not None:
+        yield document
+
+
+def _text(msg) -> str:
+    return msg if isinstance(msg, str) else msg.context_text
+
+
+def _timestamp(value) -> Optional[float]:
+    if isinstance(value, datetime):
+        return value.timestamp()
+
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
 
-    return text_splitter.create_documents([united_texts])
+def _join_messages(
+    messages: deque, separator: str, extra: Optional[dict] = None
+) -> Optional[Document]:
+    text = separator.join(_text(msg) for msg in messages).strip()
+    if text == "":
+        return None
+
+    metadata = dict(extra or {})
+    msgs = [msg for msg in messages if not isinstance(msg, str)]
+    if msgs:
+        metadata.update(
+            {
+                "first_msg_id": msgs[0].id,
+                "last_msg_id": msgs[-1].id,
+                "first_time": str(msgs[0].time),
+                "last_time": str(msgs[-1].time),
+                "authors": ",".join(dict.fromkeys(msg.name for msg in msgs)),
+            }
+        )
+        # One key per author, which the index can filter on; see `author_key`.
+        metadata.update((author_key(msg.name), True) for msg in msgs)
+        # Numeric copies of the time range, for Chroma's range filters.
+        for key, msg in (("first_ts", msgs[0]), ("last_ts", msgs[-1])):
+            ts = _timestamp(msg.time)
+            if ts is not None:
+                metadata[key] = ts
+
+    return Document(page_content=text, metadata=metadata)
+
+
+def document_id(document: Document) -> str:
+    """
+    A hash of the text and metadata: chunking the same messages again gives the
+    same ids, while equal texts of different messages or channels stay apart.
+    """
+    if not document.metadata:
+        return hashlib.sha256(document.page_content.encode()).hexdigest()
+
+    metadata = json.dumps(document.metadata, sort_keys=True, default=str)
+    return hashlib.sha256(f"{document.page_content}\0{metadata}".encode()).hexdigest()
+
+
+def _batches(documents: Iterable[Document], size: int) -> Iterator[list[Document]]:
+    batch: list[Document] = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
 
 
 @dataclass(frozen=True)
 class VectorDBConfig:
     search_k: int = 10
-    embedding_model: str = OPENAI_EMBEDDING_MODEL
+    # One of `ai.backends.EMBEDDING_BACKENDS`: "openai", "local" or "fake".
+    embedding_backend: str = "openai"
+    # None for the backend's default, e.g. `ai.OPENAI_EMBEDDING_MODEL` or
+    # `ai.LOCAL_EMBEDDING_MODEL`.
+    embedding_model: Optional[str] = None
     collection_name: str = "group_history"
     persistent_dir: str = "./chroma"
+    embedding_cache: bool = True
+    embedding_cache_size: int = 100_000
+    # "chroma", or "numpy" for the in-process `ai.index.NumpyIndex`.
+    index: str = "chroma"
+    # Concurrent async searches arriving within `batch_window` seconds are embedded
+    # concurrently and share one index query; 0 disables batching.
+    batch_window: float = 0.0
+    max_batch_size: int = 32
+    # Re-ranking: `fetch_k` candidates are scored by similarity blended with
+    # recency, then `search_k` of them are picked with maximal marginal relevance.
+    # Candidates more similar than `max_duplicate_similarity` to an already picked
+    # one are dropped, so near-duplicate chunks are not summarised twice.
+    fetch_k: int = 30
+    recency_weight: float = 0.2
+    recency_half_life: float = 30 * 24 * 3600.0  # Seconds.
+    mmr_lambda: float = 0.7
+    max_duplicate_similarity: float = 0.95
+
+
+def author_key(name: str) -> str:
+    """The metadata key that marks the chunks with messages of the author."""
+    return f"author:{name}"
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Restricts a search to the chunks of some authors, channel or time range."""
+
+    authors: tuple[str, ...] = ()
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    channel_id: Optional[int] = None
+
+    def where(self) -> Optional[dict]:
+        """The Chroma `where` clause, also understood by `NumpyIndex`."""
+        conditions = []
+        if self.authors:
+            authors = [{author_key(author): True} for author in self.authors]
+            conditions.append(authors[0] if len(authors) == 1 else {"$or": authors})
+        if self.channel_id is not None:
+            conditions.append({"channel_id": self.channel_id})
+        if self.since is not None:
+            conditions.append({"last_ts": {"$gte": self.since.timestamp()}})
+        if self.until is not None:
+            conditions.append({"first_ts": {"$lte": self.until.timestamp()}})
+
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return {"$and": conditions}
+
+
+def rerank(
+    query_embedding: np.ndarray,
+    embeddings: np.ndarray,
+    timestamps: list[Optional[float]],
+    cfg: VectorDBConfig,
+    now: Optional[float] = None,
+) -> list[int]:
+    """
+    Picks up to `cfg.search_k` of the candidate `embeddings` and returns their
+    indices, most relevant first. The relevance of a candidate is its cosine
+    similarity to the query blended with the recency of its last message, which
+    halves every `cfg.recency_half_life` seconds; undated candidates get none.
+    """
+    if len(embeddings) == 0:
+        return []
 
+    now = time.time() if now is None else now
+    vectors = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    query = query_embedding / np.linalg.norm(query_embedding)
 
-def new_chroma_client(cfg: VectorDBConfig) -> Chroma:
-    embeddings = OpenAIEmbeddings(model=cfg.embedding_model)
+    recency = np.array(
+        [
+            0.0 if ts is None else 0.5 ** (max(now - ts, 0.0) / cfg.recency_half_life)
+            for ts in timestamps
+        ]
+    )
+    relevance = (1 - cfg.recency_weight) * (vectors @ query) + (
+        cfg.recency_weight * recency
+    )
+
+    selected: list[int] = []
+    candidates = list(range(len(vectors)))
+    redundancy = np.zeros(len(vectors))
+    while candidates and len(selected) < cfg.search_k:
+        scores = [
+            cfg.mmr_lambda * relevance[i] - (1 - cfg.mmr_lambda) * redundancy[i]
+            for i in candidates
+        ]
+        best = candidates.pop(int(np.argmax(scores)))
+        if selected and redundancy[best] > cfg.max_duplicate_similarity:
+            continue
+
+        selected.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+
+    return selected
+
+
+def new_embedding_function(
+    cfg: VectorDBConfig, embeddings: Optional[Embeddings] = None
+) -> Embeddings:
+    model = embedding_model(cfg.embedding_backend, cfg.embedding_model)
+    if embeddings is None:
+        embeddings = new_embeddings(cfg.embedding_backend, model)
+
+    if cfg.embedding_cache:
+        os.makedirs(cfg.persistent_dir, exist_ok=True)
+        embeddings = CachedEmbeddings(
+            embeddings,
+            path=os.path.join(cfg.persistent_dir, "embedding_cache.sqlite3"),
+            namespace=model,
+            max_entries=cfg.embedding_cache_size,
+        )
+
+    return embeddings
+
+
+def _chroma_collection(db: Chroma) -> Collection:
+    # langchain's `Chroma` has no public accessor for its collection, which the
+    # bulk inserts and the batched queries need; this is the one place reading it.
+    return db._collection
+
+
+def new_chroma_client(
+    cfg: VectorDBConfig, embeddings: Optional[Embeddings] = None
+) -> Chroma:
     vectordb = Chroma(
         collection_name=cfg.collection_name,
-        embedding_function=embeddings,
+        embedding_function=new_embedding_function(cfg, embeddings),
         persist_directory=cfg.persistent_dir,
     )
 
@@ -45,60 +308,237 @@ def new_chroma_client(cfg: VectorDBConfig) -> Chroma:
 
 
 class VectorDB:
-    db: Chroma
-    retriever: VectorStoreRetriever
+    cfg: VectorDBConfig
+    db: Optional[Chroma]  # None with the "numpy" index.
+    collection: Union[Collection, NumpyIndex]
+    embeddings: Embeddings
+    batcher: Optional[
+        Coalescer[tuple[str, Optional[SearchFilter]], list[Document]]
+    ] = None
 
-    def __init__(self, cfg: VectorDBConfig = VectorDBConfig()) -> None:
-        self.db = new_chroma_client(cfg)
-        self.retriever = self.db.as_retriever(search_kwargs={"k": cfg.search_k})
+    def __init__(
+        self,
+        cfg: VectorDBConfig = VectorDBConfig(),
+        embeddings: Optional[Embeddings] = None,
+    ) -> None:
+        self.cfg = cfg
+        if cfg.index == "numpy":
+            self.db = None
+            self.embeddings = new_embedding_function(cfg, embeddings)
+            self.collection = NumpyIndex(cfg.persistent_dir, cfg.collection_name)
+        elif cfg.index == "chroma":
+            self.db = new_chroma_client(cfg, embeddings)
+            self.embeddings = self.db.embeddings
+            self.collection = _chroma_collection(self.db)
+        else:
+            raise ValueError(f"Unknown index {cfg.index!r}")
+
+        if cfg.batch_window > 0:
+            self.batcher = Coalescer(
+                self._aget_relevant_documents_batch,
+                window=cfg.batch_window,
+                max_batch_size=cfg.max_batch_size,
+            )
 
     def store_documents(self, documents: list[Document]) -> list[str]:
-        return self.db.add_documents(documents)
+        """
+        Stores the documents under their `document_id`, as `bulk_store_documents`
+        does, skipping those already stored, so storing a batch twice changes
+        nothing. Returns the ids of all of them.
+        """
+        by_id = {document_id(doc): doc for doc in documents}
+        if not by_id:
+            return []
 
-    def get_relevant_documents(self, query: str) -> list[dict]:
-        return self.retriever.get_relevant_documents(query)
+        existing = set(self.collection.get(ids=list(by_id), include=[])["ids"])
+        new = [(id, doc) for id, doc in by_id.items() if id not in existing]
+        if new:
+            texts = [doc.page_content for _, doc in new]
+            self.collection.add(
+                ids=[id for id, _ in new],
+                embeddings=self.embeddings.embed_documents(texts),
+                documents=texts,
+                metadatas=[doc.metadata or None for _, doc in new],
+            )
 
+        return [document_id(doc) for doc in documents]
 
-class MetadataStore:
-    conn: sqlite3.Connection
+    def bulk_store_documents(
+        self,
+        documents: Iterable[Document],
+        batch_size: int = 256,
+        max_concurrency: int = 4,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """
+        Embeds `documents` in batches of `batch_size`, with up to `max_concurrency`
+        embedding requests in flight, and inserts each batch into the index as soon as
+        it is embedded. Documents are keyed by a hash of their content, so chunks
+        that are already stored are skipped and an interrupted backfill can simply
+        be rerun. `progress` gets the stored and skipped counts after every batch.
+        Returns the number of newly stored documents.
+        """
+        collection = self.collection
+        embeddings = self.embeddings
+        stored = skipped = 0
+        seen: set[str] = set()
+        in_flight: deque[tuple[list[Document], list[str], Future]] = deque()
 
-    def __init__(self, dbname="./sqlite3/metadata.db"):
-        self.conn = sqlite3.connect(dbname)
-        self.conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS channel_meta 
-            (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            channel_id TEXT NOT NULL,
-            last_saved_msg_id TEXT NOT NULL);
-            """
-        )
+        def insert():
+            nonlocal stored
+            batch, ids, embedded = in_flight.popleft()
+            collection.add(
+                ids=ids,
+                embeddings=embedded.result(),
+                documents=[doc.page_content for doc in batch],
+                metadatas=[doc.metadata or None for doc in batch],
+            )
+            stored += len(batch)
+            if progress:
+                progress(stored, skipped)
 
-    def close(self):
-        self.conn.close()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            for batch in _batches(documents, batch_size):
+                by_id = {document_id(doc): doc for doc in batch}
+                existing = set(collection.get(ids=list(by_id), include=[])["ids"])
+                new_ids = [id for id in by_id if id not in existing and id not in seen]
+                skipped += len(batch) - len(new_ids)
+                if not new_ids:
+                    continue
 
-    def store_last_saved_msg_id(self, channel_id: str, last_saved_msg_id: str):
-        cursor = self.conn.cursor()
+                seen.update(new_ids)
+                new_batch = [by_id[id] for id in new_ids]
+                texts = [doc.page_content for doc in new_batch]
+                in_flight.append(
+                    (new_batch, new_ids, pool.submit(embeddings.embed_documents, texts))
+                )
+                if len(in_flight) >= max_concurrency:
+                    insert()
 
-        cursor.execute("SELECT * FROM channel_meta WHERE channel_id = ?", [channel_id])
-        existing_record = cursor.fetchone()
+            while in_flight:
+                insert()
 
-        if existing_record:
-            cursor.execute(
-                "UPDATE channel_meta SET last_saved_msg_id = ? WHERE channel_id = ?",
-                [last_saved_msg_id, channel_id],
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO channel_meta (channel_id, last_saved_msg_id) VALUES (?, ?)",
-                [channel_id, last_saved_msg_id],
+        log.info(f"Stored {stored} documents, skipped {skipped} already stored")
+        return stored
+
+    def warm_up(self):
+        """
+        Loads the index from disk with one throwaway query, and pages in the
+        embedding cache, so that the first search does not pay for either.
+        """
+        with VECTORDB_SECONDS.time(op="warm_up"):
+            if isinstance(self.embeddings, CachedEmbeddings):
+                len(self.embeddings)
+
+            if self.collection.count() == 0:
+                return
+
+            if isinstance(self.collection, NumpyIndex):
+                dim = self.collection.dim
+            else:
+                sample = self.collection.get(limit=1, include=["embeddings"])
+                dim = len(sample["embeddings"][0])
+            self.collection.query(
+                query_embeddings=[[1.0] * dim], n_results=1, include=["distances"]
             )
 
-        self.conn.commit()
+    def get_relevant_documents(
+        self, query: str, filter: Optional[SearchFilter] = None
+    ) -> list[Document]:
+        with VECTORDB_SECONDS.time(op="embed"):
+            query_embedding = self.embeddings.embed_query(query)
+        return self._search([query_embedding], filter)[0]
+
+    async def aget_relevant_documents(
+        self, query: str, filter: Optional[SearchFilter] = None
+    ) -> list[Document]:
+        if self.batcher:
+            return await self.batcher((query, filter))
 
-    def last_saved_msg_id(self, channel_id: str) -> Optional[str]:
-        q = self.conn.execute(
-            f"SELECT last_saved_msg_id FROM channel_meta WHERE channel_id='{channel_id}'"
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self.get_relevant_documents, query, filter)
         )
 
-        res = q.fetchone()
-        return res[0] if res else None
+    def get_relevant_documents_batch(
+        self, queries: list[str], filter: Optional[SearchFilter] = None
+    ) -> list[list[Document]]:
+        """
+        Searches for several queries with one index query. Each query is embedded
+        with `embed_query`, as by `get_relevant_documents`: asymmetric models, like
+        the instruct and E5 ones, embed queries differently from documents.
+        """
+        with VECTORDB_SECONDS.time(op="embed"):
+            query_embeddings = [self.embeddings.embed_query(query) for query in queries]
+        return self._search(query_embeddings, filter)
+
+    def _search(
+        self, query_embeddings: list[list[float]], filter: Optional[SearchFilter]
+    ) -> list[list[Document]]:
+        with VECTORDB_SECONDS.time(op="query"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=max(self.cfg.fetch_k, self.cfg.search_k),
+                where=filter.where() if filter else None,
+                include=["documents", "metadatas", "embeddings"],
+            )
+
+        start = time.perf_counter()
+        now = time.time()
+        found: list[list[Document]] = []
+        for query_embedding, texts, metadatas, embeddings in zip(
+            query_embeddings,
+            results["documents"],
+            results["metadatas"],
+            results["embeddings"],
+        ):
+            candidates = [
+                (text, metadata or {}, embedding)
+                for text, metadata, embedding in zip(texts, metadatas, embeddings)
+            ]
+            picked = rerank(
+                np.asarray(query_embedding),
+                np.array([embedding for _, _, embedding in candidates]),
+                [metadata.get("last_ts") for _, metadata, _ in candidates],
+                self.cfg,
+                now=now,
+            )
+            found.append(
+                [
+                    Document(page_content=candidates[i][0], metadata=candidates[i][1])
+                    for i in picked
+                ]
+            )
+
+        VECTORDB_SECONDS.observe(time.perf_counter() - start, op="rerank")
+        for docs in found:
+            RETRIEVED_DOCUMENTS.observe(len(docs))
+
+        return found
+
+    async def _aget_relevant_documents_batch(
+        self, items: list[tuple[str, Optional[SearchFilter]]]
+    ) -> list[list[Document]]:
+        # One index query serves all the queries that share a filter.
+        by_filter: dict[Optional[SearchFilter], list[int]] = {}
+        for i, (_, filter) in enumerate(items):
+            by_filter.setdefault(filter, []).append(i)
+
+        loop = asyncio.get_running_loop()
+        results: list[list[Document]] = [[] for _ in items]
+        for filter, indices in by_filter.items():
+            with VECTORDB_SECONDS.time(op="embed"):
+                query_embeddings = await asyncio.gather(
+                    *[
+                        loop.run_in_executor(
+                            None, self.embeddings.embed_query, items[i][0]
+                        )
+                        for i in indices
+                    ]
+                )
+            found = await loop.run_in_executor(
+                None, self._search, query_embeddings, filter
+            )
+            for i, docs in zip(indices, found):
+                results[i] = docs
+
+        return results
@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from langchain.schema import Document
+from langchain.text_splitter import CharacterTextSplitter
+
+from ai.db import (
+    SearchFilter,
+    VectorDB,
+    VectorDBConfig,
+    iter_documents,
+    rerank,
+)
+from ai.fake import FakeEmbeddings
+
+
+class TestVectorDB(unittest.TestCase):
+    index = "chroma"
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.embeddings = FakeEmbeddings()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def vectordb(self, **kwargs) -> VectorDB:
+        cfg = VectorDBConfig(
+            persistent_dir=self.dir.name,
+            embedding_model="fake",
+            index=self.index,
+            **{"search_k": 2, "embedding_cache": False, **kwargs},
+        )
+        vectordb = VectorDB(cfg, embeddings=self.embeddings)
+        vectordb.store_documents(
+            [Document(page_content=f"повідомлення {i}") for i in range(10)]
+        )
+        return vectordb
+
+    def test_concurrent_searches_are_batched(self):
+        vectordb = self.vectordb(batch_window=0.02)
+        queries = [f"повідомлення {i}" for i in range(8)]
+        calls = self.embeddings.calls
+
+        async def search():
+            return await asyncio.gather(
+                *[vectordb.aget_relevant_documents(query) for query in queries]
+            )
+
+        # Queries go through the query API, which asymmetric models embed
+        # differently from documents.
+        embed_documents = mock.Mock(side_effect=AssertionError("not a query"))
+        with mock.patch.object(
+            self.embeddings, "embed_documents", embed_documents
+        ), mock.patch.object(vectordb, "_search", wraps=vectordb._search) as search_:
+            batched = asyncio.run(search())
+
+        self.assertEqual(self.embeddings.calls, calls + len(queries))
+        self.assertEqual(vectordb.batcher.batches, 1)
+        self.assertEqual(search_.call_count, 1)  # One index query.
+        for query, docs in zip(queries, batched):
+            self.assertEqual(docs[0].page_content, query)
+            expected = vectordb.get_relevant_documents(query)
+            self.assertEqual(
+                [doc.page_content for doc in docs],
+                [doc.page_content for doc in expected],
+            )
+
+    def test_bulk_store_dedupes_and_resumes(self):
+        vectordb = self.vectordb()
+        documents = [Document(page_content=f"чанк {i % 500}") for i in range(1000)]
+
+        class Interrupted(Exception):
+            pass
+
+        embed_documents = self.embeddings.embed_documents
+
+        def flaky_embed_documents(texts):
+            if self.embeddings.calls >= 4:
+                raise Interrupted()
+            return embed_documents(texts)
+
+        self.embeddings.embed_documents = flaky_embed_documents
+        with self.assertRaises(Interrupted):
+            vectordb.bulk_store_documents(documents, batch_size=64, max_concurrency=2)
+        stored_before = vectordb.collection.count() - 10
+
+        self.embeddings.embed_documents = embed_documents
+        progress = []
+        stored = vectordb.bulk_store_documents(
+            documents,
+            batch_size=64,
+            max_concurrency=2,
+            progress=lambda stored, skipped: progress.append(stored),
+        )
+
+        self.assertGreater(stored_before, 10)
+        self.assertEqual(stored, 500 - stored_before)
+        self.assertEqual(vectordb.collection.count(), 510)
+        self.assertEqual(progress[-1], stored)
+        self.assertEqual(vectordb.bulk_store_documents(documents), 0)
+
+    def test_store_shares_ids_with_bulk_store(self):
+        vectordb = self.vectordb()
+        documents = [Document(page_content=f"документ {i}") for i in range(20)]
+
+        ids = vectordb.store_documents(documents[:5] + documents[:5])
+        self.assertEqual(ids[:5], ids[5:])
+        self.assertEqual(vectordb.collection.count(), 15)
+        self.assertEqual(vectordb.store_documents(documents[:5]), ids[:5])
+        self.assertEqual(vectordb.collection.count(), 15)
+
+        self.assertEqual(vectordb.bulk_store_documents(documents), 15)
+        self.assertEqual(vectordb.collection.count(), 30)
+
+    def test_filters(self):
+        vectordb = self.vectordb(search_k=10)
+        for channel_id, first in ((1, 0), (2, 100)):
+            messages = [TestIterDocuments.message(i) for i in range(first, first + 60)]
+            vectordb.store_documents(
+                list(
+                    iter_documents(
+                        messages, chunk_size=200, metadata={"channel_id": channel_id}
+                    )
+                )
+            )
+
+        def search(**kwargs) -> list[Document]:
+            docs = vectordb.get_relevant_documents("слово", SearchFilter(**kwargs))
+            self.assertTrue(docs)
+            return docs
+
+        for doc in search(channel_id=2):
+            self.assertGreaterEqual(doc.metadata["first_msg_id"], 100)
+        for doc in search(authors=("Андрій",)):
+            self.assertIn("Андрій", doc.metadata["authors"].split(","))
+
+        since = datetime(2023, 5, 8, 11, 30, tzinfo=timezone.utc)
+        for doc in search(since=since, channel_id=1):
+            self.assertGreaterEqual(doc.metadata["last_ts"], since.timestamp())
+            self.assertEqual(doc.metadata["channel_id"], 1)
+
+    def test_rare_author(self):
+        """Authors are filtered by the index, not among the nearest candidates."""
+        vectordb = self.vectordb()
+        rare = "Петро, молодший"
+        messages = [
+            SimpleNamespace(
+                id=i,
+                time="2023-05-08 11:00:00+00:00",
+                name=rare if i % 41 == 0 else "Андрій",
+                context_text=f"повідомлення {i}",
+            )
+            for i in range(205)
+        ]
+        # One message per chunk.
+        vectordb.store_documents(list(iter_documents(messages, chunk_size=10)))
+
+        docs = vectordb.get_relevant_documents(
+            "повідомлення 3", SearchFilter(authors=(rare, "Нікого"))
+        )
+        self.assertEqual(len(docs), 2)
+        for doc in docs:
+            self.assertEqual(doc.metadata["authors"], rare)
+
+    def test_warm_up(self):
+        VectorDB(
+            VectorDBConfig(persistent_dir=self.dir.name, index=self.index),
+            embeddings=self.embeddings,
+        ).warm_up()  # Empty.
+
+        vectordb = self.vectordb(embedding_cache=True)
+        vectordb.warm_up()
+        self.assertEqual(len(vectordb.get_relevant_documents("повідомлення")), 2)
+
+
+class TestNumpyVectorDB(TestVectorDB):
+    index = "numpy"
+
+
+class TestRerank(unittest.TestCase):
+    cfg = VectorDBConfig(search_k=2, recency_weight=0.5, recency_half_life=3600)
+
+    def test_prefers_recent(self):
+        embeddings = np.array([[1.0, 0.0], [1.0, 0.1], [0.0, 1.0]])
+        now = 10 * 3600
+
+        self.assertEqual(
+            rerank(np.array([1.0, 0.0]), embeddings, [0, now, now], self.cfg, now)[0],
+            1,
+        )
+
+    def test_drops_duplicates(self):
+        embeddings = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+
+        self.assertEqual(
+            rerank(np.array([1.0, 0.0]), embeddings, [None] * 3, self.cfg), [0, 2]
+        )
+        self.assertEqual(
+            rerank(np.array([1.0, 0.0]), embeddings[:2], [None] * 2, self.cfg), [0]
+        )
+
+
+class TestIterDocuments(unittest.TestCase):
+    @staticmethod
+    def message(i: int) -> SimpleNamespace:
+        return SimpleNamespace(
+            id=i,
+            time=f"2023-05-08 11:{i % 60:02}:00+00:00",
+            name=["Андрій", "Микола"][i % 2],
+            context_text=f"{['Андрій', 'Микола'][i % 2]} написав: '{'слово ' * (i % 23)}'",
+        )
+
+    def test_matches_character_text_splitter(self):
+        texts = [self.message(i).context_text for i in range(500)]
+        splitter = CharacterTextSplitter(
+            separator="\n\n", chunk_size=1000, chunk_overlap=200
+        )
+
+        self.assertEqual(
+            [doc.page_content for doc in iter_documents(texts)],
+            splitter.split_text("\n\n".join(texts)),
+        )
+
+    def test_metadata(self):
+        docs = list(iter_documents(self.message(i) for i in range(1, 100)))
+
+        self.assertGreater(len(docs), 1)
+        self.assertEqual(docs[0].metadata["first_msg_id"], 1)
+        self.assertEqual(docs[0].metadata["first_time"], "2023-05-08 11:01:00+00:00")
+        self.assertEqual(docs[0].metadata["authors"], "Микола,Андрій")
+        self.assertEqual(docs[-1].metadata["last_msg_id"], 99)
+        # Consecutive chunks overlap by whole messages.
+        self.assertLessEqual(
+            docs[1].metadata["first_msg_id"], docs[0].metadata["last_msg_id"]
+        )
+
+    def test_is_lazy(self):
+        messages = (self.message(i) for i in itertools.count())
+        docs = list(itertools.islice(iter_documents(messages), 3))
+        self.assertEqual(len(docs), 3)
@@ -0,0 +1,194 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from threading import Lock
+from typing import Iterable
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from ai.metrics import CACHE_LOOKUPS
+
+log = logging.getLogger(__name__)
+
+
+def content_hash(namespace: str, text: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{text}".encode()).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent SQLite cache keyed by a hash of the
+    model name and the text, so re-ingesting the same chunks or embedding the same
+    query twice does not pay for another round-trip. Keeps at most `max_entries`
+    vectors, evicting the least recently used. Hits only write their `last_used`
+    time in batches, before an eviction or every `FLUSH_SIZE` hits, so a lookup
+    does not pay for a transaction. Lookups are counted in `CACHE_LOOKUPS` as the
+    "embeddings" cache.
+    """
+
+    BATCH_SIZE = 500  # Stays below SQLite's limit on bound parameters.
+    FLUSH_SIZE = 1000
+
+    embeddings: Embeddings
+    namespace: str
+    max_entries: int
+
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: str,
+        namespace: str = "",
+        max_entries: int = 100_000,
+    ):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # Chroma and the async retriever call us from executor threads.
+        self._lock = Lock()
+        self._touched: dict[str, float] = {}  # Hits not written yet, by key.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings
+            (key TEXT PRIMARY KEY NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL);
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.conn.commit()
+            self.conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [content_hash(self.namespace, text) for text in texts]
+        found = self._lookup(keys)
+
+        missing: dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        self._count(hits=len(texts) - len(missing), misses=len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            found.update(self._store(dict(zip(missing.keys(), vectors))))
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = content_hash(self.namespace, text)
+        found = self._lookup([key])
+        if key in found:
+            self._count(hits=1)
+            return found[key]
+
+        self._count(misses=1)
+        vector = self.embeddings.embed_query(text)
+
+        return self._store({key: vector})[key]
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def _count(self, hits: int = 0, misses: int = 0):
+        self.hits += hits
+        self.misses += misses
+        if hits:
+            CACHE_LOOKUPS.inc(hits, cache="embeddings", result="hit")
+        if misses:
+            CACHE_LOOKUPS.inc(misses, cache="embeddings", result="miss")
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        now = time.time()
+
+        with self._lock:
+            for batch in _batches(list(set(keys)), self.BATCH_SIZE):
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    self._touched[key] = now
+
+            if len(self._touched) >= self.FLUSH_SIZE:
+                self._flush()
+                self.conn.commit()
+
+        return found
+
+    def _store(self, vectors: dict[str, list[float]]) -> dict[str, list[float]]:
+        """Returns the vectors rounded to float32, exactly as a later hit would."""
+        now = time.time()
+        blobs = {
+            key: np.asarray(vector, dtype=np.float32).tobytes()
+            for key, vector in vectors.items()
+        }
+
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, blob, now) for key, blob in blobs.items()],
+            )
+            self._flush()
+            self._evict()
+            self.conn.commit()
+
+        return {
+            key: np.frombuffer(blob, dtype=np.float32).tolist()
+            for key, blob in blobs.items()
+        }
+
+    def _flush(self):
+        """Writes the `last_used` time of the hits since the last flush."""
+        if not self._touched:
+            return
+
+        self.conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()],
+        )
+        self._touched = {}
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_entries:
+            return
+
+        log.debug(f"Evicting {count - self.max_entries} cached embeddings")
+        self.conn.execute(
+            """
+            DELETE FROM embeddings WHERE key IN
+            (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)
+            """,
+            [count - self.max_entries],
+        )
+
+
+def _batches(items: list, size: int) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
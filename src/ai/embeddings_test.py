@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from ai.embeddings import CachedEmbeddings
+from ai.fake import FakeEmbeddings
+from ai.metrics import CACHE_LOOKUPS
+
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cache.sqlite3")
+        self.fake = FakeEmbeddings(size=8)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_batch_lookup(self):
+        hits = CACHE_LOOKUPS.value(cache="embeddings", result="hit")
+        cache = CachedEmbeddings(self.fake, self.path)
+        first = cache.embed_documents(["a", "b", "a"])
+        second = cache.embed_documents(["b", "c", "a"])
+
+        self.assertEqual(self.fake.texts, 3)  # a, b, c once each.
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(second[0], first[1])
+        self.assertEqual(cache.embed_query("c"), second[1])
+        self.assertEqual(cache.stats(), {"hits": 4, "misses": 3, "size": 3})
+        self.assertEqual(
+            CACHE_LOOKUPS.value(cache="embeddings", result="hit"), hits + 4
+        )
+
+    def test_persistence(self):
+        vector = CachedEmbeddings(self.fake, self.path).embed_query("a")
+        cache = CachedEmbeddings(self.fake, self.path)
+
+        self.assertEqual(cache.embed_query("a"), vector)
+        self.assertEqual(self.fake.calls, 1)
+
+    def test_namespaces_do_not_collide(self):
+        CachedEmbeddings(self.fake, self.path, namespace="x").embed_query("a")
+        CachedEmbeddings(self.fake, self.path, namespace="y").embed_query("a")
+
+        self.assertEqual(self.fake.calls, 2)
+
+    def test_hits_are_not_written_one_by_one(self):
+        cache = CachedEmbeddings(self.fake, self.path)
+        cache.embed_documents(["a", "b"])
+        changes = cache.conn.total_changes
+        for _ in range(10):
+            cache.embed_query("a")
+
+        self.assertEqual(cache.conn.total_changes, changes)
+        cache.close()
+
+    def test_eviction(self):
+        cache = CachedEmbeddings(self.fake, self.path, max_entries=2)
+        cache.embed_documents(["a", "b"])
+        cache.embed_query("a")
+        cache.embed_query("c")
+
+        self.assertEqual(len(cache), 2)
+        cache.embed_query("a")
+        self.assertEqual(cache.misses, 3)
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, List, Mapping, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+from langchain.schema.output import GenerationChunk
+import numpy as np
+
+
+class FakeLLM(LLM):
+    """Deterministic offline LLM for tests and benchmarks.
+
+    Always answers with `response` after sleeping for `latency` seconds, which
+    stands in for an OpenAI round-trip, plus `token_latency` per word. The async path
+    sleeps on the event loop and can stream the response word by word.
+    """
+
+    response: str = "Йосип відповідає."
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    in_flight: int = 0
+    max_in_flight: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"response": self.response, "latency": self.latency}
+
+    def _enter(self):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _exit(self):
+        self.in_flight -= 1
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self._enter()
+        try:
+            if self.latency or self.token_latency:
+                time.sleep(self.latency + len(self._tokens()) * self.token_latency)
+            return self.response
+        finally:
+            self._exit()
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self._enter()
+        try:
+            if self.latency or self.token_latency:
+                await asyncio.sleep(
+                    self.latency + len(self._tokens()) * self.token_latency
+                )
+            return self.response
+        finally:
+            self._exit()
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        self._enter()
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            for token in self._tokens():
+                if self.token_latency:
+                    await asyncio.sleep(self.token_latency)
+                yield GenerationChunk(text=token)
+        finally:
+            self._exit()
+
+    def _tokens(self) -> list[str]:
+        words = self.response.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic offline embedder for tests and benchmarks: equal texts get equal
+    unit vectors. Every call sleeps for `latency` seconds, like one API round-trip,
+    plus `text_latency` seconds per embedded text.
+    """
+
+    size: int
+    latency: float
+    text_latency: float
+
+    calls: int
+    texts: int
+
+    def __init__(self, size: int = 64, latency: float = 0.0, text_latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.text_latency = text_latency
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._round_trip(len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self._round_trip(1)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await self._around_trip(len(texts))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await self._around_trip(1)
+        return self._embed(text)
+
+    def _round_trip(self, texts: int):
+        self.calls += 1
+        self.texts += texts
+        if self.latency or self.text_latency:
+            time.sleep(self.latency + texts * self.text_latency)
+
+    async def _around_trip(self, texts: int):
+        self.calls += 1
+        self.texts += texts
+        if self.latency or self.text_latency:
+            await asyncio.sleep(self.latency + texts * self.text_latency)
+
+    def _embed(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(self.size)
+        return (vec / np.linalg.norm(vec)).tolist()
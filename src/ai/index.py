@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+from threading import Lock
+from typing import Any, Optional
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class NumpyIndex:
+    """
+    An append-only, in-process vector index with the subset of Chroma's collection
+    API that `VectorDB` uses. Under `<dir>/<name>.*` it keeps:
+
+    - `.json`: the embedding size,
+    - `.f32`: the normalised embeddings, a float32 matrix read through `np.memmap`,
+    - `.jsonl`: one `{"id", "document", "metadata"}` record per embedding,
+    - `.off`: the int64 offsets of the records in `.jsonl`.
+
+    Opening it reads none of them, so startup does not grow with the collection.
+    Queries are exact: one matrix product over all the embeddings, then
+    `argpartition` for the top k. Records and metadata are read only for the
+    results, except for filtered queries, which load every metadata once.
+    """
+
+    path: str
+    dim: Optional[int]
+
+    def __init__(self, persistent_dir: str, name: str):
+        os.makedirs(persistent_dir, exist_ok=True)
+        self.path = os.path.join(persistent_dir, name)
+        self._lock = Lock()
+        self._ids: Optional[set[str]] = None
+        self._metadatas: Optional[list[dict]] = None
+
+        self.dim = None
+        if os.path.exists(self.path + ".json"):
+            with open(self.path + ".json") as f:
+                self.dim = json.load(f)["dim"]
+        self._open()
+
+    def _open(self):
+        """Maps the files, dropping the tail of an interrupted `add`."""
+        rows = 0
+        if self.dim is not None:
+            rows = min(
+                _size(self.path + ".f32") // (4 * self.dim),
+                _size(self.path + ".off") // 8,
+            )
+        self._rows = rows
+
+        if rows == 0:
+            self._vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+            self._offsets = np.empty(0, dtype=np.int64)
+            return
+
+        self._vectors = np.memmap(
+            self.path + ".f32", dtype=np.float32, mode="r", shape=(rows, self.dim)
+        )
+        self._offsets = np.memmap(
+            self.path + ".off", dtype=np.int64, mode="r", shape=(rows,)
+        )
+
+    def count(self) -> int:
+        return self._rows
+
+    def add(
+        self,
+        ids: list[str],
+        embeddings: list[list[float]],
+        documents: list[str],
+        metadatas: Optional[list[Optional[dict]]] = None,
+    ):
+        if not ids:
+            return
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        metadatas = metadatas or [None] * len(ids)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.path + ".json", "w") as f:
+                    json.dump({"dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embeddings of size {vectors.shape[1]}, expected {self.dim}"
+                )
+
+            records = [
+                json.dumps(
+                    {"id": id, "document": document, "metadata": metadata or {}},
+                    ensure_ascii=False,
+                ).encode()
+                + b"\n"
+                for id, document, metadata in zip(ids, documents, metadatas)
+            ]
+
+            # Records first, embeddings last: only rows with all three are mapped.
+            start = self._records_end()
+            _write_at(self.path + ".jsonl", b"".join(records), start)
+            offsets = start + np.cumsum([0] + [len(r) for r in records[:-1]])
+            _write_at(
+                self.path + ".off", offsets.astype(np.int64).tobytes(), self._rows * 8
+            )
+            _write_at(self.path + ".f32", vectors.tobytes(), self._rows * 4 * self.dim)
+
+            if self._ids is not None:
+                self._ids.update(ids)
+            if self._metadatas is not None:
+                self._metadatas.extend(metadata or {} for metadata in metadatas)
+            self._open()
+
+    def get(self, ids: list[str], include: Optional[list[str]] = None) -> dict:
+        """The ids among `ids` that are stored."""
+        if self._ids is None:
+            self._ids = {record["id"] for record in self._records(range(self._rows))}
+
+        return {"ids": [id for id in ids if id in self._ids]}
+
+    def query(
+        self,
+        query_embeddings: list[list[float]],
+        n_results: int = 10,
+        where: Optional[dict] = None,
+        include: Optional[list[str]] = None,
+    ) -> dict[str, list[list[Any]]]:
+        include = include or ["documents", "metadatas"]
+        vectors, rows = self._vectors, self._rows
+
+        mask = None
+        if where:
+            if self._metadatas is None:
+                self._metadatas = [
+                    record["metadata"] for record in self._records(range(rows))
+                ]
+            mask = np.array(
+                [_matches(where, metadata) for metadata in self._metadatas[:rows]],
+                dtype=bool,
+            )
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = queries @ vectors.T if rows else np.empty((len(queries), 0))
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        k = min(n_results, rows if mask is None else int(mask.sum()))
+
+        results: dict[str, list[list[Any]]] = {"ids": []}
+        for key in include:
+            results[key] = []
+
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k - 1)[:k] if k else np.empty(0, int)
+            top = top[np.argsort(-row_scores[top], kind="stable")]
+            records = self._records(top)
+
+            results["ids"].append([record["id"] for record in records])
+            if "documents" in include:
+                results["documents"].append([r["document"] for r in records])
+            if "metadatas" in include:
+                results["metadatas"].append([r["metadata"] or None for r in records])
+            if "embeddings" in include:
+                results["embeddings"].append(vectors[top].tolist())
+            if "distances" in include:
+                # Chroma's squared L2 distance between unit vectors.
+                results["distances"].append((2 - 2 * row_scores[top]).tolist())
+
+        return results
+
+    def _records_end(self) -> int:
+        if self._rows == 0:
+            return 0
+
+        with open(self.path + ".jsonl", "rb") as f:
+            f.seek(int(self._offsets[-1]))
+            f.readline()
+            return f.tell()
+
+    def _records(self, rows) -> list[dict]:
+        records: list[dict] = []
+        if len(rows) == 0:
+            return records
+
+        with open(self.path + ".jsonl", "rb") as f:
+            for row in rows:
+                f.seek(int(self._offsets[row]))
+                records.append(json.loads(f.readline()))
+
+        return records
+
+
+def _size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _write_at(path: str, data: bytes, at: int):
+    """Writes `data` at offset `at`, discarding whatever followed it."""
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.truncate(at)
+        f.seek(at)
+        f.write(data)
+
+
+OPERATORS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+}
+
+
+def _matches(where: dict, metadata: dict) -> bool:
+    """Evaluates a Chroma `where` clause."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(clause, metadata) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(clause, metadata) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            for op, value in condition.items():
+                if not OPERATORS[op](metadata.get(key), value):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
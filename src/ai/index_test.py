@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from ai.index import NumpyIndex
+
+
+class TestNumpyIndex(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.vectors = np.random.default_rng(0).normal(size=(100, 8))
+        self.index = self.new_index()
+        for start in range(0, 100, 30):
+            end = start + 30
+            self.index.add(
+                ids=[str(i) for i in range(start, min(end, 100))],
+                embeddings=self.vectors[start:end].tolist(),
+                documents=[f"документ {i}" for i in range(start, min(end, 100))],
+                metadatas=[{"n": i} for i in range(start, min(end, 100))],
+            )
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def new_index(self) -> NumpyIndex:
+        return NumpyIndex(self.dir.name, "test")
+
+    def expected(self, query: np.ndarray, k: int, rows=range(100)) -> list[str]:
+        rows = list(rows)
+        vectors = self.vectors[rows]
+        scores = vectors @ query / np.linalg.norm(vectors, axis=1)
+        return [str(rows[i]) for i in np.argsort(-scores)[:k]]
+
+    def test_top_k_is_exact(self):
+        queries = self.vectors[:5] + 0.1
+        results = self.index.query(
+            queries.tolist(), n_results=7, include=["documents", "metadatas"]
+        )
+
+        for query, ids, documents, metadatas in zip(
+            queries, results["ids"], results["documents"], results["metadatas"]
+        ):
+            self.assertEqual(ids, self.expected(query, 7))
+            self.assertEqual(documents, [f"документ {id}" for id in ids])
+            self.assertEqual([m["n"] for m in metadatas], [int(id) for id in ids])
+
+    def test_where(self):
+        query = self.vectors[0]
+        where = {"$and": [{"n": {"$gte": 20}}, {"n": {"$lt": 25}}]}
+        results = self.index.query([query.tolist()], n_results=10, where=where)
+
+        self.assertEqual(results["ids"][0], self.expected(query, 10, range(20, 25)))
+
+    def test_reopen_and_append(self):
+        self.assertEqual(self.index.get(["1", "100"])["ids"], ["1"])
+
+        index = self.new_index()
+        self.assertEqual(index.count(), 100)
+        index.add(ids=["100"], embeddings=[[1.0] * 8], documents=["новий"])
+
+        index = self.new_index()
+        self.assertEqual(index.count(), 101)
+        self.assertEqual(index.get(["1", "100"])["ids"], ["1", "100"])
+        results = index.query([[1.0] * 8], n_results=1)
+        self.assertEqual(results["documents"], [["новий"]])
+
+    def test_empty_add(self):
+        self.index.add(ids=[], embeddings=[], documents=[])
+        self.assertEqual(self.index.count(), 100)
+
+        empty = NumpyIndex(self.dir.name, "empty")
+        empty.add(ids=[], embeddings=[], documents=[])
+        self.assertEqual(empty.count(), 0)
+
+    def test_interrupted_add_is_dropped(self):
+        # An add that wrote its records but not its embeddings.
+        with open(self.index.path + ".off", "ab") as f:
+            f.write(np.array([1 << 20], dtype=np.int64).tobytes())
+
+        index = self.new_index()
+        self.assertEqual(index.count(), 100)
+        index.add(ids=["100"], embeddings=[[1.0] * 8], documents=["новий"])
+
+        index = self.new_index()
+        self.assertEqual(index.count(), 101)
+        self.assertEqual(
+            index.query([[1.0] * 8], n_results=1)["documents"], [["новий"]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
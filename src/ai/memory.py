@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from threading import Lock
+import logging
+
+from langchain.memory import ConversationBufferWindowMemory
+
+from ai import DEFAULT_CONVERSATION_ID
+
+log = logging.getLogger(__name__)
+
+
+class ConversationMemoryStore:
+    """
+    Keeps a separate `ConversationBufferWindowMemory` per conversation (a chat or
+    channel id). Least recently used conversations are evicted once there are more
+    than `max_conversations` of them, and every buffer is trimmed to its window,
+    so the total footprint is bounded by `max_conversations * memory_interactions`
+    interactions.
+    """
+
+    memory_interactions: int
+    max_conversations: int
+
+    def __init__(self, memory_interactions: int = 5, max_conversations: int = 1000):
+        self.memory_interactions = memory_interactions
+        self.max_conversations = max_conversations
+        self._memories: OrderedDict[str, ConversationBufferWindowMemory] = OrderedDict()
+        self._lock = Lock()  # Only guards the LRU bookkeeping.
+
+    def __len__(self) -> int:
+        return len(self._memories)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._memories
+
+    def get(self, conversation_id: str) -> ConversationBufferWindowMemory:
+        with self._lock:
+            memory = self._memories.get(conversation_id)
+            if memory is not None:
+                self._memories.move_to_end(conversation_id)
+                return memory
+
+            memory = self._new_memory()
+            self._memories[conversation_id] = memory
+
+            while len(self._memories) > self.max_conversations:
+                evicted, _ = self._memories.popitem(last=False)
+                log.debug(f"Evicted conversation memory: {evicted}")
+
+            return memory
+
+    def load(self, conversation_id: str) -> str:
+        memory = self.get(conversation_id)
+        return memory.load_memory_variables({})[memory.memory_key]
+
+    def save(self, conversation_id: str, human_message: str, answer: str):
+        memory = self.get(conversation_id)
+        memory.save_context({memory.input_key: human_message}, {"text": answer})
+
+        # The window memory only limits what it reads, so drop older messages.
+        messages = memory.chat_memory.messages
+        if len(messages) > 2 * memory.k:
+            del messages[: len(messages) - 2 * memory.k]
+
+    def clear(self, conversation_id: str):
+        with self._lock:
+            self._memories.pop(conversation_id, None)
+
+    def _new_memory(self) -> ConversationBufferWindowMemory:
+        return ConversationBufferWindowMemory(
+            k=self.memory_interactions,
+            input_key="human_message",
+            memory_key="chat_history",
+            ai_prefix="(ШІ)",
+            human_prefix="(Людина)",
+        )
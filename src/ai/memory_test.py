@@ -0,0 +1,27 @@
+import unittest
+
+from ai.memory import ConversationMemoryStore
+
+
+class TestConversationMemoryStore(unittest.TestCase):
+    def test_lru_eviction(self):
+        store = ConversationMemoryStore(max_conversations=2)
+        store.save("a", "hi from a", "answer")
+        store.save("b", "hi from b", "answer")
+        store.load("a")  # Makes "b" the least recently used.
+        store.save("c", "hi from c", "answer")
+
+        self.assertEqual(len(store), 2)
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertIn("c", store)
+
+    def test_buffer_is_trimmed_to_window(self):
+        store = ConversationMemoryStore(memory_interactions=2)
+        for i in range(10):
+            store.save("a", f"message {i}", f"answer {i}")
+
+        self.assertEqual(len(store.get("a").chat_memory.messages), 4)
+        history = store.load("a")
+        self.assertIn("message 9", history)
+        self.assertNotIn("message 7", history)
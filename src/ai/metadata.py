@@ -0,0 +1,184 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+
+UPSERT_LAST_SAVED_MSG_ID = """
+INSERT INTO channel_meta (channel_id, last_saved_msg_id) VALUES (?, ?)
+ON CONFLICT (channel_id) DO UPDATE SET last_saved_msg_id = excluded.last_saved_msg_id
+"""
+
+
+class MetadataStore:
+    """
+    Channel watermarks, per-message ingestion state and resolved user names in
+    SQLite. Every thread gets its own connection, so the store can be shared by the
+    event loop and executor threads; WAL mode lets readers proceed while one of
+    them writes.
+    """
+
+    dbname: str
+
+    def __init__(self, dbname="./sqlite3/metadata.db"):
+        self.dbname = dbname
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: list[sqlite3.Connection] = []
+
+        with self.conn as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS channel_meta
+                (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                channel_id TEXT NOT NULL,
+                last_saved_msg_id TEXT NOT NULL);
+                """
+            )
+            # Older stores may hold several rows per channel; the last one won.
+            conn.execute(
+                """
+                DELETE FROM channel_meta WHERE id NOT IN
+                (SELECT MAX(id) FROM channel_meta GROUP BY channel_id)
+                """
+            )
+            conn.execute(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS channel_meta_channel_id
+                ON channel_meta (channel_id)
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS message_state
+                (channel_id TEXT NOT NULL,
+                msg_id INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (channel_id, msg_id));
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_names
+                (user_id INTEGER PRIMARY KEY NOT NULL,
+                name TEXT NOT NULL,
+                updated_at REAL NOT NULL);
+                """
+            )
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The connection of the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only ever used by this thread, but closed by whichever calls `close`.
+            conn = sqlite3.connect(self.dbname, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+    def store_last_saved_msg_id(self, channel_id: str, last_saved_msg_id: str):
+        self.store_many({channel_id: last_saved_msg_id})
+
+    def store_many(self, last_saved_msg_ids: dict[str, str]):
+        """Upserts the watermarks of several channels in one transaction."""
+        with self.conn as conn:
+            conn.executemany(UPSERT_LAST_SAVED_MSG_ID, list(last_saved_msg_ids.items()))
+
+    def last_saved_msg_id(self, channel_id: str) -> Optional[str]:
+        q = self.conn.execute(
+            "SELECT last_saved_msg_id FROM channel_meta WHERE channel_id = ?",
+            [channel_id],
+        )
+
+        res = q.fetchone()
+        return res[0] if res else None
+
+    def store_message_states(
+        self,
+        channel_id: str,
+        msg_ids: Iterable[int],
+        state: str,
+        last_saved_msg_id: Optional[str] = None,
+    ):
+        """
+        Records the ingestion `state` of messages in one transaction, together with
+        the channel watermark if one is given.
+        """
+        now = time.time()
+        with self.conn as conn:
+            conn.executemany(
+                """
+                INSERT INTO message_state (channel_id, msg_id, state, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (channel_id, msg_id)
+                DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+                """,
+                [(channel_id, msg_id, state, now) for msg_id in msg_ids],
+            )
+            if last_saved_msg_id is not None:
+                conn.execute(UPSERT_LAST_SAVED_MSG_ID, [channel_id, last_saved_msg_id])
+
+    def message_states(self, channel_id: str, msg_ids: list[int]) -> dict[int, str]:
+        """The recorded states of those of `msg_ids` that have one."""
+        states: dict[int, str] = {}
+        for batch in _batches(msg_ids, 500):
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"""
+                SELECT msg_id, state FROM message_state
+                WHERE channel_id = ? AND msg_id IN ({placeholders})
+                """,
+                [channel_id, *batch],
+            )
+            states.update(rows)
+
+        return states
+
+    def store_user_names(self, names: dict[int, str]):
+        now = time.time()
+        with self.conn as conn:
+            conn.executemany(
+                """
+                INSERT INTO user_names (user_id, name, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (user_id)
+                DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at
+                """,
+                [(user_id, name, now) for user_id, name in names.items()],
+            )
+
+    def user_names(self, user_ids: list[int]) -> dict[int, tuple[str, float]]:
+        """The stored names of `user_ids` and when each of them was resolved."""
+        names: dict[int, tuple[str, float]] = {}
+        for batch in _batches(user_ids, 500):
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"""
+                SELECT user_id, name, updated_at FROM user_names
+                WHERE user_id IN ({placeholders})
+                """,
+                batch,
+            )
+            names.update((user_id, (name, at)) for user_id, name, at in rows)
+
+        return names
+
+
+def _batches(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from ai.metadata import MetadataStore
+
+
+class TestMetadataStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dbname = os.path.join(self.dir.name, "metadata.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_upsert(self):
+        store = MetadataStore(self.dbname)
+        store.store_last_saved_msg_id("1", "10")
+        store.store_last_saved_msg_id("1", "20")
+        store.store_many({"1": "30", "2": "5"})
+
+        self.assertEqual(store.last_saved_msg_id("1"), "30")
+        self.assertEqual(store.last_saved_msg_id("2"), "5")
+        self.assertIsNone(store.last_saved_msg_id("' OR '1'='1"))
+        (rows,) = store.conn.execute("SELECT COUNT(*) FROM channel_meta").fetchone()
+        self.assertEqual(rows, 2)
+        store.close()
+
+    def test_migrates_duplicate_watermarks(self):
+        conn = sqlite3.connect(self.dbname)
+        conn.execute(
+            """
+            CREATE TABLE channel_meta
+            (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            channel_id TEXT NOT NULL,
+            last_saved_msg_id TEXT NOT NULL);
+            """
+        )
+        conn.executemany(
+            "INSERT INTO channel_meta (channel_id, last_saved_msg_id) VALUES (?, ?)",
+            [("1", "10"), ("1", "20"), ("2", "5")],
+        )
+        conn.commit()
+        conn.close()
+
+        store = MetadataStore(self.dbname)
+        self.assertEqual(store.last_saved_msg_id("1"), "20")
+        store.store_last_saved_msg_id("1", "30")
+        self.assertEqual(store.last_saved_msg_id("1"), "30")
+        store.close()
+
+    def test_message_states(self):
+        store = MetadataStore(self.dbname)
+        store.store_message_states("1", range(1, 1001), "ingested", "1000")
+        store.store_message_states("1", [5], "failed")
+
+        states = store.message_states("1", [4, 5, 2000])
+        self.assertEqual(states, {4: "ingested", 5: "failed"})
+        self.assertEqual(len(store.message_states("1", list(range(1, 1001)))), 1000)
+        self.assertEqual(store.last_saved_msg_id("1"), "1000")
+        store.close()
+
+    def test_threads(self):
+        store = MetadataStore(self.dbname)
+
+        def write(channel_id: int):
+            for msg_id in range(1, 51):
+                store.store_last_saved_msg_id(str(channel_id), str(msg_id))
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for channel_id in range(8):
+            self.assertEqual(store.last_saved_msg_id(str(channel_id)), "50")
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+
+# Prometheus' default buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    """
+    A metric family in the Prometheus text format. Updates take a lock and a dict
+    lookup, so they are cheap enough for the hot path.
+    """
+
+    kind: str
+    name: str
+    help: str
+    labels: tuple[str, ...]
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _labels(self, key: tuple[str, ...], **extra: str) -> str:
+        pairs = [*zip(self.labels, key), *extra.items()]
+        if not pairs:
+            return ""
+
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._labels(key)} {value:g}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    buckets: tuple[float, ...]
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: the count of each bucket (not cumulative), the sum.
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[i] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+        return sum(counts)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    labels = self._labels(key, le=f"{bound:g}")
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += counts[-1]
+                labels = self._labels(key, le="+Inf")
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {total[0]:g}")
+                lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    metrics: dict[str, Metric]
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.metrics.get(name) or self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self.metrics.get(name) or self.register(Gauge(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self.metrics.get(name) or self.register(
+            Histogram(name, help, labels, buckets)
+        )
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "buddy_stage_seconds", "Time spent per answering stage.", ("stage",)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "buddy_llm_tokens_total",
+    "LLM tokens per stage, prompt or completion.",
+    ("stage", "kind"),
+)
+VECTORDB_SECONDS = REGISTRY.histogram(
+    "vectordb_seconds", "Time spent per vector db operation.", ("op",)
+)
+RETRIEVED_DOCUMENTS = REGISTRY.histogram(
+    "vectordb_retrieved_documents",
+    "Documents returned per search.",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+)
+LLM_COST = REGISTRY.counter(
+    "buddy_llm_cost_usd_total",
+    "Estimated LLM spend in US dollars per stage, from the tokens and MODEL_PRICES.",
+    ("stage", "model"),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "buddy_cache_lookups_total",
+    "Lookups of the response and embedding caches, by hit or miss.",
+    ("cache", "result"),
+)
+CONTEXTS = REGISTRY.counter(
+    "buddy_contexts_total",
+    "Contexts built from the found documents, used directly or summarised.",
+    ("mode",),
+)
+SUMMARY_TOKENS = REGISTRY.counter(
+    "buddy_summary_tokens_total", "Tokens of the documents handed to the summary."
+)
+
+
+async def serve_metrics(
+    port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY
+) -> asyncio.AbstractServer:
+    """
+    Answers every HTTP request on `port` with `registry`, for the processes without
+    a web server, like the bot. The API serves it at /metrics instead.
+    """
+
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(respond, host, port)
+
+
+# US dollars per 1000 prompt and completion tokens. Versioned model names, like
+# "gpt-3.5-turbo-0613", are priced by their longest listed prefix; models that are
+# not listed, like local ones, are not counted in `LLM_COST`.
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-3.5-turbo-instruct": (0.0015, 0.002),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "text-davinci-003": (0.02, 0.02),
+}
+
+
+def llm_cost(
+    model_name: str, prompt_tokens: int, completion_tokens: int
+) -> Optional[float]:
+    """The price of a call in US dollars, or None for a model without a price."""
+    prefixes = [name for name in MODEL_PRICES if model_name.startswith(name)]
+    if not prefixes:
+        return None
+
+    prompt_price, completion_price = MODEL_PRICES[max(prefixes, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+# The stage of `BuddyAI` the current task is in, to label the LLM tokens with.
+# Set by `ai.agent`, read by `ai.callbacks.TokenMetrics`.
+current_stage: ContextVar[str] = ContextVar("current_stage", default="")
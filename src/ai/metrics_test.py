@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+
+from ai.agent import BuddyAI
+from ai.fake import FakeLLM
+from ai.metrics import (
+    LLM_COST,
+    LLM_TOKENS,
+    STAGE_SECONDS,
+    Registry,
+    llm_cost,
+    serve_metrics,
+)
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests.", ("path",))
+        latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+        requests.inc(path="/a")
+        requests.inc(2, path='/"b"')
+        for value in (0.05, 0.5, 5):
+            latency.observe(value)
+
+        self.assertIs(registry.counter("requests_total", "Requests."), requests)
+        self.assertEqual(
+            registry.render().splitlines(),
+            [
+                "# HELP requests_total Requests.",
+                "# TYPE requests_total counter",
+                'requests_total{path="/\\"b\\""} 2',
+                'requests_total{path="/a"} 1',
+                "# HELP latency_seconds Latency.",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{le="0.1"} 1',
+                'latency_seconds_bucket{le="1"} 2',
+                'latency_seconds_bucket{le="+Inf"} 3',
+                "latency_seconds_sum 5.55",
+                "latency_seconds_count 3",
+            ],
+        )
+
+    def test_serve_metrics(self):
+        registry = Registry()
+        registry.gauge("depth", "Depth.").set(3)
+
+        async def scrape() -> bytes:
+            server = await serve_metrics(0, host="127.0.0.1", registry=registry)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: bot\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+            return response
+
+        response = asyncio.run(scrape())
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(response.endswith(b"# TYPE depth gauge\ndepth 3\n"))
+
+    def test_llm_cost(self):
+        self.assertAlmostEqual(llm_cost("gpt-4", 1000, 500), 0.06)
+        self.assertEqual(
+            llm_cost("gpt-3.5-turbo-16k-0613", 1000, 1000),
+            llm_cost("gpt-3.5-turbo-16k", 1000, 1000),
+        )
+        self.assertIsNone(llm_cost("fake", 1000, 1000))
+
+
+class TestBuddyAIMetrics(unittest.TestCase):
+    def test_stages_and_tokens_are_recorded(self):
+        answers = STAGE_SECONDS.count(stage="answer")
+        prompt_tokens = LLM_TOKENS.value(stage="answer", kind="prompt")
+        completion_tokens = LLM_TOKENS.value(stage="answer", kind="completion")
+
+        buddy_ai = BuddyAI(llm=FakeLLM(response="раз два три"))
+        asyncio.run(buddy_ai.acall("привіт"))
+
+        async def stream():
+            return [piece async for piece in buddy_ai.astream("привіт")]
+
+        asyncio.run(stream())
+
+        self.assertEqual(STAGE_SECONDS.count(stage="answer"), answers + 2)
+        self.assertGreater(
+            LLM_TOKENS.value(stage="answer", kind="prompt"), prompt_tokens + 100
+        )
+        self.assertGreater(
+            LLM_TOKENS.value(stage="answer", kind="completion"), completion_tokens
+        )
+
+    def test_cost_is_recorded_by_the_llm_model(self):
+        class PricedFakeLLM(FakeLLM):
+            model_name: str = "gpt-4"
+
+        cost = LLM_COST.value(stage="answer", model="gpt-4")
+        BuddyAI(llm=PricedFakeLLM())("привіт")
+        self.assertGreater(LLM_COST.value(stage="answer", model="gpt-4"), cost)
+
+        # The fake LLM runs no priced model, whatever `BuddyAI.model_name` says.
+        costs = LLM_COST.render()
+        BuddyAI(llm=FakeLLM())("привіт")
+        self.assertEqual(LLM_COST.render(), costs)
+
+    def test_token_metrics_are_attached_once(self):
+        llm = FakeLLM()
+        BuddyAI(llm=llm)
+        BuddyAI(llm=llm)
+        self.assertEqual(len(llm.callbacks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
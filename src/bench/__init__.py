@@ -0,0 +1,23 @@
+def synthetic_history(messages: int) -> list[str]:
+    """Formatted message texts, like `Message.context_text` of a dumped channel."""
+    return [
+        f"Користувач {i % 7} написав: 'повідомлення номер {i} про пиво і погоду'"
+        for i in range(messages)
+    ]
+
+
+def latency_stats(samples: list[float]) -> dict[str, float]:
+    """Mean and tail latencies of `samples` seconds, in milliseconds."""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
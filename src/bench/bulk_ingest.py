@@ -0,0 +1,69 @@
+"""
+Ingestion throughput of a synthetic history, `store_documents` versus
+`bulk_store_documents`, with a local fake embedding function.
+
+    python -m bench.bulk_ingest
+"""
+import argparse
+import tempfile
+import time
+
+from ai.db import VectorDB, VectorDBConfig, create_documents
+from ai.fake import FakeEmbeddings
+from bench import synthetic_history
+
+
+def new_vectordb(persistent_dir: str, args) -> VectorDB:
+    return VectorDB(
+        VectorDBConfig(
+            persistent_dir=persistent_dir,
+            collection_name="bench",
+            embedding_model="fake",
+            embedding_cache=False,
+        ),
+        embeddings=FakeEmbeddings(latency=args.latency, text_latency=args.text_latency),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="Seconds per embedding request."
+    )
+    parser.add_argument(
+        "--text-latency", type=float, default=0.002, help="Seconds per embedded text."
+    )
+    args = parser.parse_args()
+
+    documents = create_documents(synthetic_history(args.messages))
+    print(f"messages: {args.messages}, documents: {len(documents)}")
+
+    with tempfile.TemporaryDirectory() as persistent_dir:
+        vectordb = new_vectordb(persistent_dir, args)
+        t = time.perf_counter()
+        vectordb.store_documents(documents)
+        elapsed = time.perf_counter() - t
+        print(f"store_documents:      {len(documents) / elapsed:8.0f} docs/s")
+
+    with tempfile.TemporaryDirectory() as persistent_dir:
+        vectordb = new_vectordb(persistent_dir, args)
+        t = time.perf_counter()
+        stored = vectordb.bulk_store_documents(
+            documents,
+            batch_size=args.batch_size,
+            max_concurrency=args.max_concurrency,
+        )
+        elapsed = time.perf_counter() - t
+        print(f"bulk_store_documents: {stored / elapsed:8.0f} docs/s")
+
+        t = time.perf_counter()
+        vectordb.bulk_store_documents(documents, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - t
+        print(f"resumed, all stored:  {len(documents) / elapsed:8.0f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Re-ingest time of a synthetic history with a cold and a warm embedding cache.
+
+    python -m bench.embedding_cache
+"""
+import argparse
+import tempfile
+import time
+
+from ai.db import VectorDB, VectorDBConfig, create_documents
+from ai.fake import FakeEmbeddings
+from bench import synthetic_history
+
+
+def ingest(persistent_dir: str, documents, text_latency: float) -> tuple[float, int]:
+    embeddings = FakeEmbeddings(latency=0.2, text_latency=text_latency)
+    vectordb = VectorDB(
+        VectorDBConfig(
+            persistent_dir=persistent_dir,
+            collection_name="bench",
+            embedding_model="fake",
+        ),
+        embeddings=embeddings,
+    )
+
+    t = time.perf_counter()
+    vectordb.store_documents(documents)
+    return time.perf_counter() - t, embeddings.texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument(
+        "--text-latency", type=float, default=0.002, help="Seconds per embedded text."
+    )
+    args = parser.parse_args()
+
+    documents = create_documents(synthetic_history(args.messages))
+
+    with tempfile.TemporaryDirectory() as cold_dir, tempfile.TemporaryDirectory() as warm_dir:
+        ingest(warm_dir, documents, args.text_latency)  # Fills the cache.
+
+        cold, cold_texts = ingest(cold_dir, documents, args.text_latency)
+        warm, warm_texts = ingest(warm_dir, documents, args.text_latency)
+
+    print(f"documents:  {len(documents)}")
+    print(f"cold cache: {cold:.3f}s, {cold_texts} texts embedded")
+    print(f"warm cache: {warm:.3f}s, {warm_texts} texts embedded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Formatting throughput: `MessageFormatter` against the same templates rendered by
+langchain's `PromptTemplate`, as it used to, and `reformat_history` of a saved
+history in one process against a process pool.
+
+    python -m bench.formatter --messages 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from langchain import PromptTemplate
+
+from bench.messages_memory import write_archive
+from telegram.channel import (
+    Message,
+    MessageFormatter,
+    iter_messages_file,
+    reformat_history,
+)
+
+message_tmpl = PromptTemplate.from_template(MessageFormatter.message_tmpl)
+reply_tmpl = PromptTemplate.from_template(MessageFormatter.reply_tmpl)
+
+
+def prompt_template_format(msg: Message):
+    reply = ""
+    if msg.reply_to:
+        reply = " " + reply_tmpl.format(
+            name="сам" if msg.reply_to.user_id == msg.user_id else msg.reply_to.name,
+            text=MessageFormatter.text(msg.reply_to.text),
+            attachment=MessageFormatter.attachment(msg.reply_to),
+        )
+
+    msg.context_text = message_tmpl.format(
+        name=msg.name,
+        text=MessageFormatter.text(msg.text),
+        attachment=MessageFormatter.attachment(msg),
+        reply=reply,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dir:
+        src = os.path.join(dir, "history.jsonl")
+        dst = os.path.join(dir, "reformatted.jsonl")
+        write_archive(src, args.messages)
+        messages = list(iter_messages_file(src))
+        print(f"messages: {args.messages}")
+
+        t = time.perf_counter()
+        for msg in messages:
+            prompt_template_format(msg)
+        legacy = time.perf_counter() - t
+        expected = [msg.context_text for msg in messages]
+
+        t = time.perf_counter()
+        MessageFormatter.format_batch(messages)
+        compiled = time.perf_counter() - t
+        assert [msg.context_text for msg in messages] == expected
+
+        print(f"  PromptTemplate: {args.messages / legacy:10.0f} messages/s")
+        print(f"  MessageFormatter: {args.messages / compiled:10.0f} messages/s")
+
+        for processes in sorted({1, args.processes}):
+            t = time.perf_counter()
+            reformat_history(src, dst, processes=processes)
+            elapsed = time.perf_counter() - t
+            print(
+                f"  reformat_history, {processes} processes: "
+                f"{args.messages / elapsed:10.0f} messages/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
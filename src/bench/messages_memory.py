@@ -0,0 +1,116 @@
+"""
+Memory of a loaded chat history: a list of `Message` objects, as `Messages` used
+to hold, against the columnar `Messages`, both read from the same JSON Lines
+archive. Also the peak memory of `batch_messages` against building all the
+batches as lists.
+
+    python -m bench.messages_memory --messages 200000
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from bench import synthetic_history
+from telegram.channel import Messages, iter_messages_file
+
+
+def write_archive(path: str, messages: int):
+    names = ["Андрій", "Микола", "Володя", "Йосип", "Оксана", "Марія", "Петро"]
+    with open(path, "w") as f:
+        for i, context_text in enumerate(synthetic_history(messages)):
+            user = i % len(names)
+            reply = None
+            if i % 5 == 0 and i >= 3:
+                reply = {
+                    "user_id": (i - 3) % len(names),
+                    "name": names[(i - 3) % len(names)],
+                    "text": f"повідомлення номер {i - 3}",
+                    "media": None,
+                }
+            record = {
+                "user_id": user,
+                "name": names[user],
+                "text": f"повідомлення номер {i}",
+                "time": "2023-05-08 11:32:09+00:00",
+                "media": {"type": "image/jpeg"} if i % 10 == 0 else None,
+                "reply_to": reply,
+                "context_text": context_text,
+                "id": i + 1,
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def measure(build: Callable[[], object]) -> tuple[object, int, float]:
+    """
+    Builds the object twice: once timed, once traced, as tracing slows down the
+    allocations. Returns it, the memory it holds and the seconds spent.
+    """
+    t = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - t
+
+    gc.collect()
+    tracemalloc.start()
+    built = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built, size, elapsed
+
+
+def peak(run: Callable[[], None]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def list_batches(messages, msg_separator="\n", window_size=4) -> list[str]:
+    """The former `batch_messages`."""
+    all_msgs: list[str] = [msg.context_text for msg in messages]
+    batches: list[str] = []
+    for i in range(0, len(all_msgs) - window_size + 1, window_size):
+        batches.append(msg_separator.join(all_msgs[i : i + window_size]))
+
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200_000)
+    args = parser.parse_args()
+
+    mb = 1024 * 1024
+    with tempfile.TemporaryDirectory() as dir:
+        path = os.path.join(dir, "history.jsonl")
+        write_archive(path, args.messages)
+        print(
+            f"messages: {args.messages}, archive: {os.path.getsize(path) / mb:.1f} MB"
+        )
+
+        listed, list_size, list_time = measure(lambda: list(iter_messages_file(path)))
+        print(f"  list: {list_size / mb:7.1f} MB, loaded in {list_time:5.2f} s")
+        batches_peak = peak(lambda: list_batches(listed))
+        del listed
+
+        columns, columns_size, columns_time = measure(lambda: Messages.from_file(path))
+        print(
+            f"  columnar: {columns_size / mb:7.1f} MB, loaded in {columns_time:5.2f} s"
+        )
+        generator_peak = peak(lambda: all(columns.batch_messages()))
+
+    print(
+        f"  batch_messages peak: list {batches_peak / mb:.1f} MB, "
+        f"generator {generator_peak / mb:.3f} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Telegram round-trips needed to dump a channel, per-message versus batched reply
+resolution.
+
+    python -m bench.reply_batching
+"""
+import argparse
+import asyncio
+import time
+
+from telegram.channel import Channel
+from telegram.fake import FakeTelegramClient, synthetic_messages
+
+
+def dump(tmsgs, latency: float, **kwargs) -> tuple[int, float]:
+    client = FakeTelegramClient({1: tmsgs}, latency=latency)
+    chan = Channel(client, 1, **kwargs)
+
+    t = time.perf_counter()
+    asyncio.run(chan.history())
+    return client.requests, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--reply-every", type=int, default=3)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per API round-trip."
+    )
+    args = parser.parse_args()
+
+    # Replies to nearby messages, and replies to messages outside of the dump.
+    scenarios = {
+        "recent replies": dict(reply_distance=5),
+        "old replies": dict(reply_distance=args.messages),
+    }
+    modes = {
+        "per message": dict(window_size=1, recent_cache_size=0),
+        "batched": dict(),
+    }
+
+    print(f"messages: {args.messages}, a reply every {args.reply_every}")
+    for scenario, history_kwargs in scenarios.items():
+        tmsgs = synthetic_messages(
+            args.messages,
+            first_id=args.messages + 1,
+            reply_every=args.reply_every,
+            **history_kwargs,
+        )
+        for mode, channel_kwargs in modes.items():
+            requests, elapsed = dump(tmsgs, args.latency, **channel_kwargs)
+            print(f"{scenario:15} {mode:12} {requests:6} round-trips {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cold start of the HTTP API: each run starts a fresh process, imports `server`, runs
+its startup and times, from the moment the process was started, the first liveness
+answer, the end of the warm-up and the first answer, with the fake LLM. Prints the
+medians over the runs as JSON.
+
+    python -m bench.startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import time
+
+
+def cold_start(started_at: float, results):
+    """Runs in a fresh process; `started_at` is the parent's `time.time()`."""
+    os.environ["LLM_BACKEND"] = "fake"
+    t = time.time()
+    import httpx
+
+    import server
+
+    timings = {"import_server_s": time.time() - t}
+
+    async def run():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            await server.startup_event()
+            (await client.get("/health/live")).raise_for_status()
+            timings["live_s"] = time.time() - started_at
+
+            # Arrives during the warm-up, and waits for it.
+            message = {"content": "привіт"}
+            path = "/api/v1/llm/message-ai-buddy"
+            (await client.post(path, json=message)).raise_for_status()
+            timings["first_answer_s"] = time.time() - started_at
+            (await client.get("/health/ready")).raise_for_status()
+            timings["warm_up_s"] = server.app.warm_up_seconds
+
+            t = time.time()
+            (await client.post(path, json=message)).raise_for_status()
+            timings["second_answer_s"] = time.time() - t
+
+    asyncio.run(run())
+    results.put(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Writes the JSON here instead of stdout.")
+    args = parser.parse_args()
+
+    spawn = multiprocessing.get_context("spawn")
+    runs: list[dict[str, float]] = []
+    for _ in range(args.runs):
+        results = spawn.Queue()
+        process = spawn.Process(target=cold_start, args=(time.time(), results))
+        process.start()
+        runs.append(results.get())
+        process.join()
+
+    output = json.dumps(
+        {
+            "runs": args.runs,
+            **{key: statistics.median(run[key] for run in runs) for key in runs[0]},
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
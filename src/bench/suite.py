@@ -0,0 +1,190 @@
+"""
+Offline end-to-end benchmarks: channel dump, ingestion, retrieval and the HTTP API,
+over a fake Telegram client, embedder and LLM with configurable latencies. Prints
+the results as JSON, so runs on different commits can be diffed.
+
+    python -m bench.suite --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Optional
+
+import httpx
+
+from ai.agent import BuddyAI
+from ai.db import MetadataStore, VectorDB, VectorDBConfig
+from ai.fake import FakeEmbeddings, FakeLLM
+from bench import latency_stats
+from telegram.channel import Channel
+from telegram.fake import FakeTelegramClient, synthetic_messages
+from telegram.ingest import ingest_history
+import server
+
+CHANNEL_ID = 1
+
+
+def new_client(args) -> FakeTelegramClient:
+    history = synthetic_messages(args.messages, channel_id=CHANNEL_ID)
+    return FakeTelegramClient({CHANNEL_ID: history}, latency=args.telegram_latency)
+
+
+def bench_dump(args) -> dict:
+    client = new_client(args)
+    chan = Channel(client, CHANNEL_ID)
+
+    t = time.perf_counter()
+    messages = asyncio.run(chan.history())
+    elapsed = time.perf_counter() - t
+
+    return {
+        "messages": len(messages.data),
+        "seconds": elapsed,
+        "messages_per_s": len(messages.data) / elapsed,
+        "round_trips": client.requests,
+    }
+
+
+def bench_ingest(args, vectordb: VectorDB, metadata: MetadataStore) -> dict:
+    client = new_client(args)
+
+    t = time.perf_counter()
+    ingested = asyncio.run(ingest_history(client, CHANNEL_ID, vectordb, metadata))
+    elapsed = time.perf_counter() - t
+
+    documents = vectordb.collection.count()
+    return {
+        "messages": ingested,
+        "documents": documents,
+        "seconds": elapsed,
+        "messages_per_s": ingested / elapsed,
+        "documents_per_s": documents / elapsed,
+    }
+
+
+def bench_retrieval(args, vectordb: VectorDB) -> dict:
+    latencies = []
+    for i in range(args.queries):
+        t = time.perf_counter()
+        vectordb.get_relevant_documents(f"повідомлення номер {i * 7 % args.messages}")
+        latencies.append(time.perf_counter() - t)
+
+    return latency_stats(latencies)
+
+
+async def load_server(concurrency: int, requests: int) -> dict:
+    transport = httpx.ASGITransport(app=server.app)
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker(client: httpx.AsyncClient, n: int):
+        nonlocal errors
+        for i in range(n):
+            t = time.perf_counter()
+            resp = await client.post(
+                "/api/v1/llm/message-ai-buddy",
+                json={"content": f"привіт {i}", "chat_id": str(i % 10)},
+            )
+            latencies.append(time.perf_counter() - t)
+            errors += resp.status_code != 200
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        per_worker = max(1, requests // concurrency)
+        t = time.perf_counter()
+        await asyncio.gather(*[worker(client, per_worker) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - t
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": len(latencies) / elapsed,
+        **latency_stats(latencies),
+    }
+
+
+def bench_server(args, vectordb: VectorDB) -> list[dict]:
+    server.app.buddy_ai = BuddyAI(
+        vectordb=vectordb, llm=FakeLLM(latency=args.llm_latency)
+    )
+    return [
+        asyncio.run(load_server(concurrency, args.requests))
+        for concurrency in args.concurrency
+    ]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--index", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument(
+        "--telegram-latency",
+        type=float,
+        default=0.0,
+        help="Seconds per Telegram round-trip.",
+    )
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=0.0,
+        help="Seconds per embedding request.",
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.05, help="Seconds per LLM call."
+    )
+    parser.add_argument("--output", help="Writes the JSON here instead of stdout.")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "args": vars(args),
+    }
+    with tempfile.TemporaryDirectory() as dir:
+        vectordb = VectorDB(
+            VectorDBConfig(
+                persistent_dir=dir,
+                collection_name="bench",
+                embedding_model="fake",
+                embedding_cache=False,
+                index=args.index,
+            ),
+            embeddings=FakeEmbeddings(latency=args.embedding_latency),
+        )
+        metadata = MetadataStore(os.path.join(dir, "metadata.db"))
+
+        results["dump"] = bench_dump(args)
+        results["ingest"] = bench_ingest(args, vectordb, metadata)
+        results["retrieval"] = bench_retrieval(args, vectordb)
+        results["server"] = bench_server(args, vectordb)
+        metadata.close()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Query latency and cold start of the Chroma and NumPy indexes of `VectorDB` over the
+same synthetic chunks, with a local fake embedding function.
+
+    python -m bench.vector_index
+"""
+import argparse
+import multiprocessing
+import statistics
+import tempfile
+import time
+
+from langchain.schema import Document
+
+from ai.db import VectorDB, VectorDBConfig
+from ai.fake import FakeEmbeddings
+from bench import synthetic_history
+
+
+def new_vectordb(persistent_dir: str, index: str, dim: int) -> VectorDB:
+    return VectorDB(
+        VectorDBConfig(
+            persistent_dir=persistent_dir,
+            collection_name="bench",
+            embedding_model="fake",
+            embedding_cache=False,
+            index=index,
+        ),
+        embeddings=FakeEmbeddings(size=dim),
+    )
+
+
+def cold_start(persistent_dir: str, index: str, dim: int, results):
+    """Runs in a fresh process: opens the stored index and answers one query."""
+    t = time.perf_counter()
+    vectordb = new_vectordb(persistent_dir, index, dim)
+    opened = time.perf_counter() - t
+    vectordb.get_relevant_documents("пиво")
+    results.put((opened, time.perf_counter() - t))
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--indexes", nargs="+", default=["chroma", "numpy"])
+    args = parser.parse_args()
+
+    texts = synthetic_history(args.documents)
+    documents = [
+        Document(page_content=text, metadata={"n": i}) for i, text in enumerate(texts)
+    ]
+    queries = [f"повідомлення номер {i} про погоду" for i in range(args.queries)]
+    print(f"documents: {args.documents}, dim: {args.dim}, queries: {args.queries}")
+
+    spawn = multiprocessing.get_context("spawn")
+    for index in args.indexes:
+        with tempfile.TemporaryDirectory() as persistent_dir:
+            vectordb = new_vectordb(persistent_dir, index, args.dim)
+            t = time.perf_counter()
+            vectordb.bulk_store_documents(documents, batch_size=1000)
+            stored = time.perf_counter() - t
+
+            embeddings = vectordb.embeddings.embed_documents(queries)
+            raw: list[float] = []
+            for embedding in embeddings:
+                t = time.perf_counter()
+                vectordb.collection.query(
+                    query_embeddings=[embedding],
+                    n_results=vectordb.cfg.fetch_k,
+                    include=["documents", "metadatas", "embeddings"],
+                )
+                raw.append(time.perf_counter() - t)
+
+            full: list[float] = []
+            for query in queries:
+                t = time.perf_counter()
+                vectordb.get_relevant_documents(query)
+                full.append(time.perf_counter() - t)
+            del vectordb
+
+            results = spawn.Queue()
+            process = spawn.Process(
+                target=cold_start, args=(persistent_dir, index, args.dim, results)
+            )
+            process.start()
+            opened, first_query = results.get()
+            process.join()
+
+        print(
+            f"{index:>6}: store {stored:6.2f} s, "
+            f"query p50 {percentile(raw, 0.5) * 1000:6.2f} ms "
+            f"p95 {percentile(raw, 0.95) * 1000:6.2f} ms, "
+            f"search p50 {statistics.median(full) * 1000:6.2f} ms, "
+            f"open {opened * 1000:7.1f} ms, "
+            f"first search {first_query * 1000:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
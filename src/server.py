@@ -1,29 +1,126 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING, Optional
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from ai.agent import BuddyAI, Response
+from ai import DEFAULT_CONVERSATION_ID
+from ai.metrics import REGISTRY
+
+# `ai.agent` pulls in langchain and the LLM clients, which takes seconds; it is
+# imported by the warm-up, after the server already answers health checks.
+if TYPE_CHECKING:
+    from ai.agent import BuddyAI
+
+log = logging.getLogger(__name__)
 
 
 load_dotenv()
 
 app = FastAPI()
+app.buddy_ai = None
+app.warm_up = None  # The task building `app.buddy_ai`.
+app.warm_up_seconds = None
+
+
+def new_buddy_ai() -> "BuddyAI":
+    from ai.agent import BuddyAI
+
+    buddy_ai = BuddyAI(llm_backend=os.getenv("LLM_BACKEND", "openai"))
+    buddy_ai.warm_up()
+    return buddy_ai
+
+
+async def warm_up():
+    start = time.perf_counter()
+    app.buddy_ai = await asyncio.to_thread(new_buddy_ai)
+    app.warm_up_seconds = time.perf_counter() - start
+    log.info(f"Warmed up in {app.warm_up_seconds:.2f} seconds")
 
 
 @app.on_event("startup")
 async def startup_event():
-    app.buddy_ai = BuddyAI()
+    app.warm_up = asyncio.ensure_future(warm_up())
+
+
+async def buddy_ai() -> "BuddyAI":
+    """`app.buddy_ai`, once warmed up: early requests wait instead of failing."""
+    if app.buddy_ai is None:
+        if app.warm_up is None:
+            raise RuntimeError("Not warming up: the startup event has not run")
+        if app.warm_up.cancelled():
+            raise RuntimeError("The warm-up was cancelled")
+        await asyncio.shield(app.warm_up)
+    return app.buddy_ai
 
 
 class Message(BaseModel):
     content: str
+    chat_id: str = DEFAULT_CONVERSATION_ID
+    timings: bool = False  # Adds the seconds spent per stage to the response.
 
 
 @app.post("/api/v1/llm/message-ai-buddy")
 async def message_answering(message: Message):
-    resp: Response = app.buddy_ai(message.content)
-    return {
+    resp = await (await buddy_ai()).acall(
+        message.content, conversation_id=message.chat_id
+    )
+    body = {
         "answer": resp.answer,
         "chat_history": resp.chat_history,
         "context": resp.context,
     }
+    if message.timings:
+        body["timings"] = resp.timings
+    return body
+
+
+@app.post("/api/v1/llm/message-ai-buddy/stream")
+async def message_streaming(message: Message):
+    """Streams the answer as server-sent events, ending with an `end` event."""
+    answer = (await buddy_ai()).astream(
+        message.content, conversation_id=message.chat_id
+    )
+
+    async def events():
+        async for piece in answer:
+            yield f"data: {json.dumps({'answer': piece}, ensure_ascii=False)}\n\n"
+
+        yield "event: end\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health/live")
+async def liveness():
+    """The process serves requests; it may still be warming up."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """200 once warmed up, 503 while warming up or if the warm-up failed."""
+    if app.buddy_ai is not None:
+        return {"status": "ready", "warm_up_seconds": app.warm_up_seconds}
+
+    body: dict[str, Optional[str]] = {"status": "warming_up"}
+    if app.warm_up is None:
+        body = {"status": "not_started"}
+    elif app.warm_up.cancelled():
+        body = {"status": "failed", "error": "The warm-up was cancelled"}
+    elif app.warm_up.done():
+        body = {"status": "failed", "error": repr(app.warm_up.exception())}
+    return JSONResponse(body, status_code=503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of `ai.metrics.REGISTRY`."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from ai.agent import BuddyAI
+from ai.fake import FakeLLM
+import server
+
+
+class TestMessageAnswering(unittest.TestCase):
+    latency = 0.2
+    concurrency = 10
+
+    def setUp(self):
+        self.llm = FakeLLM(latency=self.latency)
+        server.app.buddy_ai = BuddyAI(llm=self.llm)
+
+    def test_concurrent_requests_overlap(self):
+        """A load test: requests awaiting the LLM must not stall each other."""
+
+        async def load():
+            return await asyncio.gather(
+                *[
+                    server.message_answering(server.Message(content=f"привіт {i}"))
+                    for i in range(self.concurrency)
+                ]
+            )
+
+        responses = asyncio.run(load())
+
+        self.assertEqual(len(responses), self.concurrency)
+        for resp in responses:
+            self.assertEqual(resp["answer"], self.llm.response)
+
+        # Every request was awaiting the LLM at the same time.
+        self.assertEqual(self.llm.max_in_flight, self.concurrency)
+
+    def test_streaming(self):
+        self.llm.response = "раз два три"
+
+        async def stream():
+            resp = await server.message_streaming(server.Message(content="привіт"))
+            return [chunk async for chunk in resp.body_iterator]
+
+        chunks = asyncio.run(stream())
+
+        self.assertEqual(
+            chunks,
+            [
+                'data: {"answer": "раз "}\n\n',
+                'data: {"answer": "два "}\n\n',
+                'data: {"answer": "три"}\n\n',
+                "event: end\ndata: {}\n\n",
+            ],
+        )
+
+    def test_timings_and_metrics(self):
+        resp = asyncio.run(
+            server.message_answering(server.Message(content="привіт", timings=True))
+        )
+        self.assertIn("answer", resp["timings"])
+
+        metrics = asyncio.run(server.metrics()).body.decode()
+        self.assertIn('buddy_stage_seconds_count{stage="answer"}', metrics)
+        self.assertIn('buddy_llm_tokens_total{stage="answer",kind="prompt"}', metrics)
+
+
+class TestStartup(unittest.TestCase):
+    def tearDown(self):
+        server.app.buddy_ai = None
+
+    def test_import_is_light(self):
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, server; print(sorted({m.split('.')[0] for m in sys.modules}))",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        for heavy in ("langchain", "chromadb", "openai"):
+            self.assertNotIn(f"'{heavy}'", loaded)
+
+    @mock.patch.dict(os.environ, {"LLM_BACKEND": "fake"})
+    def test_requests_wait_for_warm_up(self):
+        async def start():
+            server.app.buddy_ai = None
+            await server.startup_event()
+            warming_up = await server.readiness()
+            resp = await server.message_answering(server.Message(content="привіт"))
+            return warming_up, resp, await server.readiness()
+
+        warming_up, resp, ready = asyncio.run(start())
+
+        self.assertEqual(warming_up.status_code, 503)
+        self.assertEqual(resp["answer"], FakeLLM().response)
+        self.assertEqual(ready["status"], "ready")
+        self.assertEqual(asyncio.run(server.liveness()), {"status": "alive"})
+
+    def test_failed_warm_up(self):
+        async def start():
+            server.app.buddy_ai = None
+            await server.startup_event()
+            with self.assertRaises(RuntimeError):
+                await server.message_answering(server.Message(content="привіт"))
+            return await server.readiness()
+
+        with mock.patch.object(
+            server, "new_buddy_ai", side_effect=RuntimeError("no key")
+        ):
+            failed = asyncio.run(start())
+
+        self.assertEqual(failed.status_code, 503)
+        self.assertIn(b"no key", failed.body)
+
+    def test_cancelled_warm_up(self):
+        async def start():
+            server.app.buddy_ai = None
+            server.app.warm_up = asyncio.ensure_future(asyncio.sleep(10))
+            server.app.warm_up.cancel()
+            await asyncio.sleep(0)
+            with self.assertRaises(RuntimeError):
+                await server.buddy_ai()
+            return await server.readiness()
+
+        cancelled = asyncio.run(start())
+
+        self.assertEqual(cancelled.status_code, 503)
+        self.assertIn(b"cancelled", cancelled.body)
+
+    def test_requests_before_startup(self):
+        server.app.buddy_ai = None
+        server.app.warm_up = None
+
+        with self.assertRaisesRegex(RuntimeError, "startup"):
+            asyncio.run(server.buddy_ai())
+        self.assertEqual(asyncio.run(server.readiness()).status_code, 503)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,15 +1,57 @@
 from dotenv import dotenv_values
 from telethon import TelegramClient
-from telethon.types import User
+from telethon.types import PeerUser
 from telethon import events
-from telegram.channel import Channel
-from ai import BuddyAI, Response
+from telegram.names import NameResolver
+from telegram.streaming import respond_streaming
+from telegram.workers import WorkQueue
+from ai.metadata import MetadataStore
+from ai.metrics import serve_metrics
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+import asyncio
 import logging
+import time
+
+if TYPE_CHECKING:
+    from ai.agent import BuddyAI
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+@dataclass
+class ChatRequest:
+    event: events.NewMessage.Event  # Answered by replying to it.
+    human_message: str
+
+
+def merge_requests(queued: ChatRequest, new: ChatRequest) -> ChatRequest:
+    """Answers a burst of messages of one chat at once, replying to the last."""
+    return ChatRequest(
+        event=new.event,
+        human_message=f"{queued.human_message}\n{new.human_message}",
+    )
+
+
+def new_buddy_ai(llm_backend: str) -> "BuddyAI":
+    """Imports and builds `BuddyAI`, which takes seconds; run it in the background."""
+    start = time.perf_counter()
+    from ai.agent import BuddyAI
+
+    buddy_ai = BuddyAI(with_query_chain=False, llm_backend=llm_backend)
+    buddy_ai.warm_up()
+    log.info(f"Warmed up in {time.perf_counter() - start:.2f} seconds")
+    return buddy_ai
+
+
+async def log_stats(queue: WorkQueue, interval: float = 60.0):
+    while True:
+        await asyncio.sleep(interval)
+        log.info(f"Bot queue: {queue.stats()}")
+
+
 if __name__ == "__main__":
     env = dotenv_values()
     session_name = "telegram_bot"
@@ -18,22 +60,58 @@ if __name__ == "__main__":
     bot_token = env["TELEGRAM_API_KEY"]
     channel_id = int(env["TELEGRAM_CHANNEL_ID"])
 
+    # Warms up while connecting; messages arriving before it is done are queued.
+    warm_up: Future = ThreadPoolExecutor(max_workers=1).submit(
+        new_buddy_ai, env.get("LLM_BACKEND", "openai")
+    )
+
     bot = TelegramClient(session_name, app_id, api_hash).start(bot_token=bot_token)
 
-    buddy_ai: BuddyAI = BuddyAI(with_query_chain=False, with_context=False)
+    names = NameResolver(bot, MetadataStore())
+
+    async def answer(request: ChatRequest):
+        event = request.event
+        buddy_ai: BuddyAI = await asyncio.wrap_future(warm_up)
+        answer = buddy_ai.astream(
+            request.human_message, conversation_id=str(event.chat_id)
+        )
+        await respond_streaming(event, answer)
+
+    # Bursts wait here instead of starting an LLM call each; messages a chat sends
+    # while its previous ones are still queued are answered together.
+    queue: WorkQueue[ChatRequest] = WorkQueue(
+        answer,
+        workers=int(env.get("BOT_WORKERS", 4)),
+        max_size=int(env.get("BOT_QUEUE_SIZE", 100)),
+        max_age=float(env.get("BOT_MAX_QUEUE_AGE", 120)),
+        supersede=env.get("BOT_SUPERSEDE", "merge"),
+        merge=merge_requests,
+    )
+
+    async def start():
+        queue.start()
+        asyncio.ensure_future(log_stats(queue))
+        # The queue metrics, for Prometheus to scrape.
+        if env.get("BOT_METRICS_PORT"):
+            await serve_metrics(int(env["BOT_METRICS_PORT"]))
+
+    bot.loop.run_until_complete(start())
 
     @bot.on(events.NewMessage(incoming=True, chats=[channel_id]))
     async def message_handler(event: events.NewMessage.Event):
-        sender: User = await event.get_sender()
-        sender_name = await Channel.name_from_user(sender)
+        # The sender usually comes with the update; only look it up otherwise.
+        if event.sender is not None:
+            sender_name = names.name_from_user(event.sender)
+        else:
+            sender_name = await names.name(
+                PeerUser(event.sender_id) if event.sender_id else None
+            )
 
         human_message = f"{sender_name}: {event.raw_text}"
         log.debug(f"Human message to AI: '{human_message}'")
 
-        resp: Response = buddy_ai(human_message)
-
         # chat = await event.get_chat()
         # await bot.send_message(entity=chat.id, message=resp.answer)
-        await event.respond(resp.answer)
+        queue.submit(event.chat_id, ChatRequest(event, human_message))
 
     bot.run_until_disconnected()
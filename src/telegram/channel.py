@@ -1,15 +1,29 @@
+import itertools
 import json
+import multiprocessing
+import os
 import time
-from typing import Optional, Dict
-from datetime import datetime
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Optional,
+    Dict,
+    TextIO,
+    Union,
+    overload,
+)
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass, asdict
 from dotenv import dotenv_values
-from langchain import PromptTemplate
 from telethon import TelegramClient
 from telethon.tl.types import (
     Channel as TelegramChannel,
     Message as TelegramMessage,
-    User,
     PeerUser,
     MessageReplyHeader,
     MessageMediaGeo,
@@ -17,17 +31,27 @@ from telethon.tl.types import (
     MessageMediaWebPage,
     WebPageEmpty,
 )
+from ai.metrics import REGISTRY
+from telegram.names import NameResolver
 import logging
 
 log = logging.getLogger(__name__)
 
+MESSAGES_CONVERTED = REGISTRY.counter(
+    "telegram_messages_total", "Channel history messages fetched and converted."
+)
+WINDOW_SECONDS = REGISTRY.histogram(
+    "telegram_window_seconds",
+    "Time to convert a window of history, replies and names included.",
+)
 
-@dataclass
+
+@dataclass(slots=True)
 class Media:
     type: str
 
 
-@dataclass
+@dataclass(slots=True)
 class MessageBase:
     user_id: str
     name: str
@@ -38,56 +62,245 @@ class MessageBase:
 Reply = MessageBase
 
 
-@dataclass
+@dataclass(slots=True)
 class Message(MessageBase):
     time: str
     reply_to: Optional[Reply]
     context_text: str = ""  # Gets extended by other fields.
+    id: int = 0  # Telegram message id.
 
 
 CHAT_HISTORY_DEFAULT_PATH = "./misc/chat_history.json"
+CHAT_HISTORY_JSONL_DEFAULT_PATH = "./misc/chat_history.jsonl"
+
+
+def message_to_json(msg: Message, **kwargs) -> str:
+    return json.dumps(asdict(msg), default=str, ensure_ascii=False, **kwargs)
+
+
+def message_from_dict(msg: dict) -> Message:
+    return Message(
+        user_id=msg["user_id"],
+        name=msg["name"],
+        text=msg["text"],
+        time=msg["time"],
+        media=Media(**msg["media"]) if msg["media"] else None,
+        context_text=msg.get("context_text", ""),
+        id=msg.get("id", 0),
+        reply_to=MessageBase(
+            user_id=msg["reply_to"]["user_id"],
+            name=msg["reply_to"]["name"],
+            text=msg["reply_to"]["text"],
+            media=Media(**msg["reply_to"]["media"])
+            if msg["reply_to"]["media"]
+            else None,
+        )
+        if msg["reply_to"]
+        else None,
+    )
+
+
+def iter_jsonl(file_path: str) -> Iterator[dict]:
+    """Reads a JSON Lines file line by line; a truncated last line is skipped."""
+    with open(file_path, "r") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as err:
+                log.warning(f"Skipping a broken line {line_no} of {file_path}: {err}")
+
+
+def iter_json_array(file_path: str, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """Reads the elements of a JSON array file one by one, in bounded memory."""
+    decoder = json.JSONDecoder()
+
+    with open(file_path, "r") as f:
+        buf = f.read(chunk_size).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{file_path} does not hold a JSON array")
+        buf = buf[1:]
+
+        while True:
+            buf = buf.lstrip().lstrip(",").lstrip()
+            if buf.startswith("]"):
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    if buf:
+                        log.warning(f"{file_path} ends with an unfinished element")
+                    return
+
+                buf += chunk
+                continue
+
+            yield obj
+            buf = buf[end:]
+
 
+def iter_messages_file(file_path: str = CHAT_HISTORY_DEFAULT_PATH) -> Iterator[Message]:
+    """Lazily reads messages saved either as JSON Lines (*.jsonl) or a JSON array."""
+    if file_path.endswith(".jsonl"):
+        records = iter_jsonl(file_path)
+    else:
+        records = iter_json_array(file_path)
 
-class Messages:
-    data: list[Message]
+    for record in records:
+        yield message_from_dict(record)
 
-    def __init__(self, data: list[Message]) -> None:
-        self.data = data
+
+class JsonLinesWriter:
+    """Appends messages to a JSON Lines file, one message per line."""
+
+    file_path: str
+    file: TextIO
+
+    def __init__(self, file_path: str = CHAT_HISTORY_JSONL_DEFAULT_PATH, append=False):
+        self.file_path = file_path
+        if append and os.path.exists(file_path):
+            self._drop_unfinished_line()
+        self.file = open(file_path, "a" if append else "w")
+
+    def __enter__(self) -> "JsonLinesWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, messages: Iterable[Message]):
+        for msg in messages:
+            self.file.write(message_to_json(msg) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def _drop_unfinished_line(self):
+        """Cuts off what an interrupted write left after the last newline."""
+        with open(self.file_path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(pos, 4096)
+                f.seek(pos - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+
+            if pos != end:
+                f.truncate(pos)
+
+
+NO_ROW = -1  # No media or no reply, in the index columns of `Messages`.
+
+# How the time of a message was given, in `Messages._time_kinds`.
+TIME_DATETIME, TIME_STR, TIME_OTHER = 0, 1, 2
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def _utc_micros(time) -> Optional[int]:
+    """Microseconds since the epoch of a UTC `datetime`, or None for anything else."""
+    if not isinstance(time, datetime) or time.utcoffset() != timedelta(0):
+        return None
+
+    return (time - EPOCH) // MICROSECOND
+
+
+class Messages(Sequence[Message]):
+    """
+    A compact, columnar store of messages. Ids, texts and times are kept per
+    column, UTC times as microseconds whether given as `datetime`s (from Telegram)
+    or as their `str` (from a saved history). Users are interned as (user id, name) pairs and media as their types,
+    so the columns only hold indices. A reply is stored once, however many messages
+    answer it, and messages refer to it by index.
+
+    `Message` objects are only materialised when read. Iteration is re-entrant,
+    and slices are `MessagesView`s that copy nothing.
+    """
+
+    def __init__(self, data: Iterable[Message] = ()) -> None:
+        self._ids = array("q")
+        self._users = array("i")  # Into `_people`.
+        self._texts: list[str] = []
+        self._times = array("q")  # Microseconds since `EPOCH`.
+        self._time_kinds = array("b")
+        self._other_times: dict[int, Any] = {}  # Times that are not UTC.
+        self._media = array("h")  # Into `_media_types`, or `NO_ROW`.
+        self._replies = array("i")  # Into `_reply_rows`, or `NO_ROW`.
+        self._context_texts: list[str] = []
+
+        self._people: list[tuple[Any, str]] = []
+        self._people_index: dict[tuple[Any, str], int] = {}
+        self._media_types: list[str] = []
+        self._media_index: dict[str, int] = {}
+        # (user, text, media) of every distinct reply, indexed like the columns.
+        self._reply_rows: list[tuple[int, str, int]] = []
+        self._reply_index: dict[tuple[int, str, int], int] = {}
+
+        self.extend(data)
 
     @staticmethod
     def from_dict(data_dict: list[dict]) -> "Messages":
-        messages = [
-            Message(
-                user_id=msg["user_id"],
-                name=msg["name"],
-                text=msg["text"],
-                time=msg["time"],
-                media=msg["media"],
-                context_text=msg.get("context_text", ""),
-                reply_to=MessageBase(
-                    user_id=msg["reply_to"]["user_id"],
-                    name=msg["reply_to"]["name"],
-                    text=msg["reply_to"]["text"],
-                    media=msg["reply_to"]["media"],
-                )
-                if msg["reply_to"]
-                else None,
-            )
-            for msg in data_dict
-        ]
-
-        return Messages(data=messages)
+        return Messages(message_from_dict(msg) for msg in data_dict)
 
     @staticmethod
     def from_file(file_path: str = CHAT_HISTORY_DEFAULT_PATH) -> "Messages":
-        with open(file_path, "r") as f:
-            json_str = f.read()
-            dict_data = json.loads(json_str)
-            return Messages.from_dict(dict_data)
+        return Messages(iter_messages_file(file_path))
+
+    @property
+    def data(self) -> "Messages":
+        """The messages themselves, for callers of the former list attribute."""
+        return self
+
+    def append(self, msg: Message):
+        self._append_time(msg.time)
+        self._ids.append(msg.id)
+        self._users.append(self._user(msg.user_id, msg.name))
+        self._texts.append(msg.text)
+        self._media.append(self._media_type(msg.media))
+        self._replies.append(self._reply_row(msg.reply_to))
+        self._context_texts.append(msg.context_text)
+
+    def extend(self, messages: Iterable[Message]):
+        for msg in messages:
+            self.append(msg)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @overload
+    def __getitem__(self, index: int) -> Message:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "MessagesView":
+        ...
+
+    def __getitem__(self, index):
+        rows = range(len(self))[index]
+        if isinstance(rows, range):
+            return MessagesView(self, rows)
+
+        return self._message(rows)
+
+    def __iter__(self) -> Iterator[Message]:
+        for row in range(len(self)):
+            yield self._message(row)
 
     def toJSON(self) -> str:
         return json.dumps(
-            [asdict(msg) for msg in self.data],
+            [asdict(msg) for msg in self],
             default=str,
             ensure_ascii=False,
             indent=4,
@@ -97,64 +310,191 @@ class Messages:
 
     def __str__(self):
         return "\n".join(
-            [f"Message from {msg.name} at {msg.time}: {msg.text}" for msg in self.data]
+            [f"Message from {msg.name} at {msg.time}: {msg.text}" for msg in self]
         )
 
     def save(self, file_path: str = CHAT_HISTORY_DEFAULT_PATH):
+        if file_path.endswith(".jsonl"):
+            with JsonLinesWriter(file_path) as writer:
+                writer.write(self)
+            return
+
         with open(file_path, "w") as outfile:
             outfile.write(self.toJSON())
 
-    def __iter__(self) -> "Messages":
-        self.iter_idx = -1
-        return self
+    def batch_messages(self, msg_separator="\n", window_size=4) -> Iterator[str]:
+        """
+        Joins the context texts of consecutive windows of `window_size` messages,
+        dropping an incomplete last one. Reads the column directly, without
+        materialising any message.
+        """
+        texts = self._context_texts
+        for i in range(0, len(texts) - window_size + 1, window_size):
+            yield msg_separator.join(texts[i : i + window_size])
+
+    def _message(self, row: int) -> Message:
+        user_id, name = self._people[self._users[row]]
+        return Message(
+            id=self._ids[row],
+            user_id=user_id,
+            name=name,
+            text=self._texts[row],
+            time=self._time(row),
+            media=self._media_of(self._media[row]),
+            reply_to=self._reply(self._replies[row]),
+            context_text=self._context_texts[row],
+        )
+
+    def _append_time(self, time):
+        micros, kind = _utc_micros(time), TIME_DATETIME
+        if micros is None and isinstance(time, str):
+            try:
+                micros, kind = _utc_micros(datetime.fromisoformat(time)), TIME_STR
+            except ValueError:
+                pass
+        # Only times that read back exactly are encoded.
+        if micros is not None and kind == TIME_STR:
+            if str(EPOCH + micros * MICROSECOND) != time:
+                micros = None
+
+        if micros is None:
+            micros, kind = 0, TIME_OTHER
+            self._other_times[len(self._times)] = time
+
+        self._times.append(micros)
+        self._time_kinds.append(kind)
+
+    def _time(self, row: int):
+        kind = self._time_kinds[row]
+        if kind == TIME_OTHER:
+            return self._other_times[row]
+
+        time = EPOCH + self._times[row] * MICROSECOND
+        return str(time) if kind == TIME_STR else time
+
+    def _reply(self, row: int) -> Optional[Reply]:
+        if row == NO_ROW:
+            return None
+
+        user, text, media = self._reply_rows[row]
+        user_id, name = self._people[user]
+        return Reply(user_id=user_id, name=name, text=text, media=self._media_of(media))
+
+    def _media_of(self, media: int) -> Optional[Media]:
+        return None if media == NO_ROW else Media(type=self._media_types[media])
+
+    def _user(self, user_id, name: str) -> int:
+        key = (user_id, name)
+        user = self._people_index.get(key)
+        if user is None:
+            user = self._people_index[key] = len(self._people)
+            self._people.append(key)
+        return user
+
+    def _media_type(self, media: Union[Media, dict, None]) -> int:
+        if not media:
+            return NO_ROW
+
+        media_type = media["type"] if isinstance(media, dict) else media.type
+        index = self._media_index.get(media_type)
+        if index is None:
+            index = self._media_index[media_type] = len(self._media_types)
+            self._media_types.append(media_type)
+        return index
+
+    def _reply_row(self, reply: Optional[Reply]) -> int:
+        if reply is None:
+            return NO_ROW
+
+        key = (
+            self._user(reply.user_id, reply.name),
+            reply.text,
+            self._media_type(reply.media),
+        )
+        row = self._reply_index.get(key)
+        if row is None:
+            row = self._reply_index[key] = len(self._reply_rows)
+            self._reply_rows.append(key)
+        return row
+
+
+class MessagesView(Sequence[Message]):
+    """A range of `Messages`, materialised message by message as it is read."""
+
+    messages: Messages
+    rows: range
+
+    def __init__(self, messages: Messages, rows: range) -> None:
+        self.messages = messages
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
 
-    def __next__(self) -> Message:
-        self.iter_idx += 1
-        if self.iter_idx >= len(self.data):
-            raise StopIteration
+    def __getitem__(self, index):
+        rows = self.rows[index]
+        if isinstance(rows, range):
+            return MessagesView(self.messages, rows)
 
-        return self.data[self.iter_idx]
+        return self.messages._message(rows)
 
-    def batch_messages(self, msg_separator="\n", window_size=4) -> list[str]:
-        all_msgs: list[str] = [msg.context_text for msg in self]
-        batches: list[str] = []
-        for i in range(0, len(all_msgs) - window_size + 1, window_size):
-            batch = msg_separator.join(all_msgs[i : i + window_size])
-            batches.append(batch)
+    def __iter__(self) -> Iterator[Message]:
+        for row in self.rows:
+            yield self.messages._message(row)
 
-        return batches
+
+# What a message with media of each major MIME type (or pseudo type) has attached.
+MEDIA_CONTENT_TYPES = {
+    "image": "фотографію",
+    "video": "відео",
+    "audio": "аудіо",
+    "empty-webpage": "веб посилання",
+    "geolocation": "геопозицію",
+    "live-geolocation": "геопозицію в режимі онлайн",
+}
 
 
 class MessageFormatter:
-    reply_tmpl = PromptTemplate(
-        template="у відповідь на повідомлення яке написав {name}:{text}{attachment}",
-        input_variables=["name", "text", "attachment"],
-    )
+    """
+    Sets the `context_text` of messages, the text that is embedded. The templates
+    are plain `str.format` strings and media descriptions are computed once per
+    media type, so formatting costs a few string operations per message. Its
+    output must not change: stored embeddings are keyed by these texts.
+    """
 
-    # message_tmpl_with_time = PromptTemplate(
-    #     template="{name} написав о {time}:{text}{attachment}{reply}",
-    #     input_variables=["name", "time", "text", "attachment", "reply"],
-    # )
+    reply_tmpl = "у відповідь на повідомлення яке написав {name}:{text}{attachment}"
 
-    message_tmpl = PromptTemplate(
-        template="{name} написав:{text}{attachment}{reply}",
-        input_variables=["name", "text", "attachment", "reply"],
-    )
+    # message_tmpl_with_time = "{name} написав о {time}:{text}{attachment}{reply}"
+
+    message_tmpl = "{name} написав:{text}{attachment}{reply}"
+
+    media_descriptions: dict[str, str] = {
+        media_type: f"прикріпив {content_type}".upper()
+        for media_type, content_type in MEDIA_CONTENT_TYPES.items()
+    }
 
     @classmethod
     def format(cls, message: Message):
+        message.context_text = cls.context_text(message)
+
+    @classmethod
+    def format_batch(cls, messages: Iterable[Message]):
+        context_text = cls.context_text
+        for message in messages:
+            message.context_text = context_text(message)
+
+    @classmethod
+    def context_text(cls, message: Message) -> str:
         reply = cls.reply(message)
         if reply != "":
             reply = " " + reply
 
-        message.context_text = cls.message_tmpl.format(
-            **{
-                "name": message.name,
-                # "time": cls.time(message.time),
-                "text": cls.text(message.text),
-                "attachment": cls.attachment(message),
-                "reply": reply,
-            }
+        return cls.message_tmpl.format(
+            name=message.name,
+            # time=cls.time(message.time),
+            text=cls.text(message.text),
+            attachment=cls.attachment(message),
+            reply=reply,
         )
 
     @classmethod
@@ -166,7 +506,7 @@ class MessageFormatter:
         return " '" + text + "'" if text != "" else ""
 
     @classmethod
-    def attachment(cls, msg: Messages | Reply) -> str:
+    def attachment(cls, msg: Message | Reply) -> str:
         media_type = cls.media_type(msg.media)
         if media_type == "":
             return ""
@@ -181,55 +521,115 @@ class MessageFormatter:
         if not media:
             return ""
 
-        match media.type.split("/")[0]:
-            case "image":
-                content_type = "фотографію"
-            case "video":
-                content_type = "відео"
-            case "audio":
-                content_type = "аудіо"
-            case "empty-webpage":
-                content_type = "веб посилання"
-            case "geolocation":
-                content_type = "геопозицію"
-            case "live-geolocation":
-                content_type = "геопозицію в режимі онлайн"
-            case _:
-                log.warn(f"unknown media type: {media}")
-                return ""
-
-        return f"прикріпив {content_type}".upper()
+        description = cls.media_descriptions.get(media.type)
+        if description is None:
+            description = cls.media_descriptions.get(media.type.split("/")[0])
+            if description is None:
+                log.warning(f"unknown media type: {media}")
+                description = ""
+            # Full MIME types, like image/jpeg, are looked up directly next time.
+            cls.media_descriptions[media.type] = description
+
+        return description
 
     @classmethod
-    def reply(cls, msg: Messages) -> str:
+    def reply(cls, msg: Message) -> str:
         reply = msg.reply_to
         if not reply:
             return ""
 
         return cls.reply_tmpl.format(
-            **{
-                "name": "сам" if reply.user_id == msg.user_id else reply.name,
-                "text": cls.text(reply.text),
-                "attachment": cls.attachment(reply),
-            }
+            name="сам" if reply.user_id == msg.user_id else reply.name,
+            text=cls.text(reply.text),
+            attachment=cls.attachment(reply),
+        )
+
+
+def _reformat_records(records: list[dict]) -> list[str]:
+    lines: list[str] = []
+    for record in records:
+        msg = message_from_dict(record)
+        MessageFormatter.format(msg)
+        lines.append(message_to_json(msg) + "\n")
+
+    return lines
+
+
+def reformat_history(
+    src_path: str,
+    dst_path: str,
+    processes: Optional[int] = None,
+    chunk_size: int = 10_000,
+) -> int:
+    """
+    Recomputes the `context_text` of every message of a saved history, JSON Lines
+    or a JSON array, and writes the messages to the JSON Lines file `dst_path`.
+    Chunks of `chunk_size` messages are formatted by a pool of `processes` (by
+    default, one per CPU), or in this process with `processes=1`. Returns the
+    number of messages written.
+
+    The output is written to a temporary file that replaces `dst_path` once
+    complete, so `dst_path` may be `src_path` and survives a failed run.
+    """
+    if not dst_path.endswith(".jsonl"):
+        raise ValueError(f"{dst_path} is not a JSON Lines file")
+
+    if src_path.endswith(".jsonl"):
+        records = iter_jsonl(src_path)
+    else:
+        records = iter_json_array(src_path)
+
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+    pool = multiprocessing.Pool(processes) if processes != 1 else None
+    tmp_path = f"{dst_path}.tmp"
+    written = 0
+    try:
+        # `imap` keeps the order of the chunks.
+        formatted = (
+            pool.imap(_reformat_records, chunks)
+            if pool
+            else map(_reformat_records, chunks)
         )
+        with open(tmp_path, "w") as f:
+            for lines in formatted:
+                f.writelines(lines)
+                written += len(lines)
+        os.replace(tmp_path, dst_path)
+    finally:
+        if pool:
+            pool.terminate()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    log.info(f"Reformatted {written} messages into {dst_path}")
+    return written
 
 
 class Channel:
     client: TelegramClient  # Needs to be a user client (not a Telegram bot).
     channel: TelegramChannel
 
-    UNKNOWN_USER_NAME = "Незнайомець"
-    user_cache: Dict[int, str] = {
-        411323238: "Андрій",
-        596110122: "Микола",
-        564660774: "Володя",
-        6470622385: "Йосип",  # Bot name.
-    }
+    # Messages are converted in windows, so the reply targets of a whole window are
+    # fetched with one `get_messages` call. Recently seen messages are kept around
+    # (up to `recent_cache_size`) since replies mostly target them.
+    window_size: int
+    recent_cache_size: int
+    names: NameResolver
 
-    def __init__(self, client: TelegramClient, channel: TelegramChannel) -> None:
+    def __init__(
+        self,
+        client: TelegramClient,
+        channel: TelegramChannel,
+        window_size: int = 100,
+        recent_cache_size: int = 10_000,
+        names: Optional[NameResolver] = None,
+    ) -> None:
         self.client = client
         self.channel = channel
+        self.window_size = window_size
+        self.recent_cache_size = recent_cache_size
+        self.names = names or NameResolver(client)
+        self._recent: OrderedDict[int, TelegramMessage] = OrderedDict()
 
     async def history(
         self,
@@ -238,10 +638,25 @@ class Channel:
         offset_date=None,
         search: Optional[str] = None,
     ) -> Messages:
+        messages = Messages()
+        async for msg in self.iter_history(
+            formatters, min_id=min_id, offset_date=offset_date, search=search
+        ):
+            messages.append(msg)
+        return messages
+
+    async def iter_history(
+        self,
+        formatters: Optional[list] = None,
+        min_id: int = 0,
+        offset_date=None,
+        search: Optional[str] = None,
+    ) -> AsyncIterator[Message]:
+        """Yields the messages as they are fetched, a window at a time."""
         if not formatters:
             formatters = [MessageFormatter()]
 
-        messages: list[Message] = []
+        window: list[TelegramMessage] = []
         async for tmessage in self.client.iter_messages(
             self.channel,
             min_id=min_id,
@@ -250,66 +665,30 @@ class Channel:
             reverse=True,
         ):
             if isinstance(tmessage, TelegramMessage):
-                msg = Message(
-                    user_id=tmessage.from_id.user_id,
-                    name=await self.name_from_peer(tmessage.from_id),
-                    text=tmessage.text,
-                    time=tmessage.date,
-                    media=self.media(tmessage),
-                    reply_to=await self.reply(tmessage),
-                )
-
-                for formatter in formatters:
-                    formatter.format(msg)
-
-                messages.append(msg)
+                window.append(tmessage)
+                if len(window) >= self.window_size:
+                    for msg in await self._timed_messages(window, formatters):
+                        yield msg
+                    window = []
             else:
                 log.warning(
                     f"Received a message of the unsupported type: {type(tmessage)}"
                 )
 
-        return Messages(data=messages)
-
-    async def name_from_peer(self, peer: Optional[PeerUser]) -> str:
-        if peer is None:
-            return self.UNKNOWN_USER_NAME
-
-        key = peer.user_id
-
-        try:
-            return self.user_cache[key]
-        except KeyError:
-            user: User = await self.client.get_entity(peer)
+        if window:
+            for msg in await self._timed_messages(window, formatters):
+                yield msg
 
-            if user.first_name is not None:
-                new_user = user.first_name
+    async def _timed_messages(
+        self, tmsgs: list[TelegramMessage], formatters: list
+    ) -> list[Message]:
+        with WINDOW_SECONDS.time():
+            messages = await self.messages(tmsgs, formatters)
+        MESSAGES_CONVERTED.inc(len(messages))
+        return messages
 
-            if user.last_name is not None:
-                new_user += (" " if user != "" else "") + user.last_name
-
-            self.user_cache[key] = new_user
-
-        return self.user_cache[key]
-
-    @classmethod
-    async def name_from_user(self, user: Optional[User]) -> str:
-        if user is None:
-            return self.UNKNOWN_USER_NAME
-
-        key = user.id
-
-        try:
-            return self.user_cache[key]
-        except KeyError:
-            if user.first_name is not None:
-                new_user = user.first_name
-
-            if user.last_name is not None:
-                new_user += (" " if user != "" else "") + user.last_name
-
-            self.user_cache[key] = new_user
-
-        return self.user_cache[key]
+    async def name_from_peer(self, peer: Optional[PeerUser]) -> str:
+        return await self.names.name(peer)
 
     def media(self, tmsg: TelegramMessage) -> Optional[Media]:
         if not tmsg.media:
@@ -336,31 +715,132 @@ class Channel:
 
         return Media(type=media_type(tmsg))
 
+    async def messages(
+        self, tmsgs: list[TelegramMessage], formatters: list
+    ) -> list[Message]:
+        for tmsg in tmsgs:
+            self._remember(tmsg)
+
+        treplies = await self.reply_targets(tmsgs)
+        await self.names.prefetch(
+            tmsg.from_id.user_id
+            for tmsg in [*tmsgs, *treplies.values()]
+            if isinstance(tmsg.from_id, PeerUser)
+        )
+
+        messages: list[Message] = []
+        for tmsg in tmsgs:
+            treply_msg = None
+            if tmsg.reply_to and isinstance(tmsg.reply_to, MessageReplyHeader):
+                treply_msg = treplies.get(tmsg.reply_to.reply_to_msg_id)
+
+            messages.append(
+                Message(
+                    id=tmsg.id,
+                    user_id=tmsg.from_id.user_id,
+                    name=await self.name_from_peer(tmsg.from_id),
+                    text=tmsg.text,
+                    time=tmsg.date,
+                    media=self.media(tmsg),
+                    reply_to=await self.reply_from(treply_msg),
+                )
+            )
+
+        for formatter in formatters:
+            # Formatters written before `format_batch` only have `format`.
+            format_batch = getattr(formatter, "format_batch", None)
+            if format_batch is not None:
+                format_batch(messages)
+            else:
+                for msg in messages:
+                    formatter.format(msg)
+
+        return messages
+
+    async def reply_targets(
+        self, tmsgs: list[TelegramMessage]
+    ) -> Dict[int, TelegramMessage]:
+        """Resolves what the messages reply to with at most one `get_messages` call."""
+        ids = {
+            tmsg.reply_to.reply_to_msg_id
+            for tmsg in tmsgs
+            if tmsg.reply_to and isinstance(tmsg.reply_to, MessageReplyHeader)
+        }
+
+        found: Dict[int, TelegramMessage] = {}
+        missing: list[int] = []
+        for msg_id in sorted(ids):
+            if msg_id in self._recent:
+                found[msg_id] = self._recent[msg_id]
+            else:
+                missing.append(msg_id)
+
+        if missing:
+            treply_msgs = await self.client.get_messages(self.channel, ids=missing)
+            for treply_msg in treply_msgs:
+                if treply_msg:
+                    self._remember(treply_msg)
+                    found[treply_msg.id] = treply_msg
+
+        return found
+
     async def reply(self, tmsg: TelegramMessage) -> Optional[Reply]:
         if tmsg.reply_to and isinstance(tmsg.reply_to, MessageReplyHeader):
-            treply_msg: TelegramMessage = await self.client.get_messages(
-                self.channel, ids=tmsg.reply_to.reply_to_msg_id
-            )
-            if treply_msg:
-                return Reply(
-                    user_id=treply_msg.from_id.user_id,
-                    name=await self.name_from_peer(treply_msg.from_id),
-                    text=treply_msg.text,
-                    media=self.media(treply_msg),
-                )
+            treplies = await self.reply_targets([tmsg])
+            return await self.reply_from(treplies.get(tmsg.reply_to.reply_to_msg_id))
 
         return None
 
+    async def reply_from(
+        self, treply_msg: Optional[TelegramMessage]
+    ) -> Optional[Reply]:
+        if not treply_msg:
+            return None
+
+        return Reply(
+            user_id=treply_msg.from_id.user_id,
+            name=await self.name_from_peer(treply_msg.from_id),
+            text=treply_msg.text,
+            media=self.media(treply_msg),
+        )
+
+    def _remember(self, tmsg: TelegramMessage):
+        self._recent[tmsg.id] = tmsg
+        self._recent.move_to_end(tmsg.id)
+        while len(self._recent) > self.recent_cache_size:
+            self._recent.popitem(last=False)
+
 
 async def save_history(
     client: TelegramClient,
     channel_id: int,
-    history_path: str = CHAT_HISTORY_DEFAULT_PATH,
+    history_path: str = CHAT_HISTORY_JSONL_DEFAULT_PATH,
 ) -> None:
+    """
+    A JSON Lines history is written while the channel is iterated, flushing every
+    window, and a rerun resumes after the last saved message. Other paths get a JSON
+    array written at the end.
+    """
     channel = await client.get_entity(channel_id)
     chan = Channel(client, channel)
-    messages = await chan.history()
-    messages.save(history_path)
+
+    if not history_path.endswith(".jsonl"):
+        messages = await chan.history()
+        messages.save(history_path)
+        return
+
+    min_id = 0
+    if os.path.exists(history_path):
+        for msg in iter_messages_file(history_path):
+            min_id = msg.id
+
+    with JsonLinesWriter(history_path, append=min_id > 0) as writer:
+        saved = 0
+        async for msg in chan.iter_history(min_id=min_id):
+            writer.write([msg])
+            saved += 1
+            if saved % chan.window_size == 0:
+                writer.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import time
+from typing import Optional
+from dotenv import dotenv_values
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+import logging
+
+from ai.metadata import MetadataStore
+from telegram.channel import Channel, JsonLinesWriter
+from telegram.names import NameResolver
+
+log = logging.getLogger(__name__)
+
+
+HISTORY_DUMP_DEFAULT_DIR = "./misc/history"
+
+
+class FloodWaitScheduler:
+    """
+    The flood-wait budget belongs to the account, not to a channel: once Telegram
+    asks for a pause, every channel dump sharing the client waits it out.
+    """
+
+    flood_waits: int
+
+    def __init__(self):
+        self.flood_waits = 0
+        self._resume_at = 0.0
+
+    def backoff(self, seconds: float):
+        self.flood_waits += 1
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        log.warning(f"Flood wait: pausing all requests for {seconds} seconds")
+
+    async def wait(self):
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+class ScheduledClient:
+    """Routes the `TelegramClient` calls made by `Channel` through a scheduler."""
+
+    client: TelegramClient
+    scheduler: FloodWaitScheduler
+
+    def __init__(self, client: TelegramClient, scheduler: FloodWaitScheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    async def _call(self, fn, *args, **kwargs):
+        while True:
+            await self.scheduler.wait()
+            try:
+                return await fn(*args, **kwargs)
+            except FloodWaitError as err:
+                self.scheduler.backoff(err.seconds)
+
+    async def get_entity(self, entity):
+        return await self._call(self.client.get_entity, entity)
+
+    async def get_messages(self, *args, **kwargs):
+        return await self._call(self.client.get_messages, *args, **kwargs)
+
+    async def iter_messages(self, *args, **kwargs):
+        # A flood wait raised mid-iteration ends it; `dump_channel` restarts it.
+        async for tmsg in self.client.iter_messages(*args, **kwargs):
+            await self.scheduler.wait()
+            yield tmsg
+
+
+def last_saved_id(file_path: str, tail_size: int = 1 << 16) -> int:
+    """The id of the last complete message of a JSON Lines dump, 0 if there is none."""
+    if not os.path.exists(file_path):
+        return 0
+
+    with open(file_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(max(0, end - tail_size))
+        lines = f.read().split(b"\n")
+
+    for line in reversed(lines):
+        try:
+            return json.loads(line)["id"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            continue
+
+    return 0
+
+
+def checkpoint_key(channel_id: int) -> str:
+    # Kept apart from the vector db ingestion watermark of the same channel.
+    return f"dump/{channel_id}"
+
+
+async def dump_channel(
+    client: ScheduledClient,
+    channel_id: int,
+    metadata: MetadataStore,
+    output_dir: str = HISTORY_DUMP_DEFAULT_DIR,
+    names: Optional[NameResolver] = None,
+) -> int:
+    """
+    Appends the channel history to `<output_dir>/<channel_id>.jsonl`, checkpointing
+    the last saved id in `metadata` every window. Resumes after the checkpoint, and
+    restarts from it after a flood wait. Returns the number of saved messages.
+    """
+    path = os.path.join(output_dir, f"{channel_id}.jsonl")
+    key = checkpoint_key(channel_id)
+    saved = 0
+
+    while True:
+        # The file may be a flush ahead of the checkpoint after a crash.
+        min_id = max(int(metadata.last_saved_msg_id(key) or 0), last_saved_id(path))
+        last_id: Optional[int] = None
+
+        channel = await client.get_entity(channel_id)
+        chan = Channel(client, channel, names=names)
+        try:
+            with JsonLinesWriter(path, append=True) as writer:
+                async for msg in chan.iter_history(min_id=min_id):
+                    writer.write([msg])
+                    saved += 1
+                    last_id = msg.id
+                    if saved % chan.window_size == 0:
+                        writer.flush()
+                        metadata.store_last_saved_msg_id(key, str(last_id))
+
+            return saved
+        except FloodWaitError as err:
+            client.scheduler.backoff(err.seconds)
+        finally:
+            if last_id is not None:
+                metadata.store_last_saved_msg_id(key, str(last_id))
+
+
+async def dump_channels(
+    client: TelegramClient,
+    channel_ids: list[int],
+    metadata: MetadataStore,
+    output_dir: str = HISTORY_DUMP_DEFAULT_DIR,
+    max_parallel: int = 4,
+) -> dict[int, int]:
+    """
+    Dumps several channels concurrently over one client, at most `max_parallel` at
+    a time. Returns the number of saved messages per channel.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    client = ScheduledClient(client, FloodWaitScheduler())
+    semaphore = asyncio.Semaphore(max_parallel)
+    names = NameResolver(client, metadata)
+
+    async def dump(channel_id: int) -> int:
+        async with semaphore:
+            saved = await dump_channel(
+                client, channel_id, metadata, output_dir, names=names
+            )
+            log.info(f"Saved {saved} messages of {channel_id}")
+            return saved
+
+    counts = await asyncio.gather(*[dump(channel_id) for channel_id in channel_ids])
+    return dict(zip(channel_ids, counts))
+
+
+if __name__ == "__main__":
+    t = time.time()
+
+    env = dotenv_values()
+    username = env["TELEGRAM_USER"]
+    app_id = env["TELEGRAM_APP_ID"]
+    api_hash = env["TELEGRAM_API_HASH"]
+    channel_ids = [int(id) for id in env["TELEGRAM_CHANNEL_IDS"].split(",")]
+
+    client = TelegramClient(
+        username,
+        app_id,
+        api_hash,
+    )
+    # Let every flood wait reach the shared scheduler instead of sleeping per call.
+    client.flood_sleep_threshold = 0
+    metadata = MetadataStore()
+
+    with client:
+        counts = client.loop.run_until_complete(
+            dump_channels(client, channel_ids, metadata)
+        )
+
+    metadata.close()
+
+    elapsed_time = time.time() - t
+    print(f"Saved {counts} messages in {elapsed_time:f} seconds.")
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from ai.metadata import MetadataStore
+from telegram.channel import iter_messages_file
+from telegram.dumper import checkpoint_key, dump_channels
+from telegram.fake import FakeTelegramClient, synthetic_messages
+
+
+class TestDumpChannels(unittest.TestCase):
+    channel_ids = [1, 2, 3]
+    messages = 300
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataStore(os.path.join(self.dir.name, "metadata.db"))
+
+    def tearDown(self):
+        self.metadata.close()
+        self.dir.cleanup()
+
+    def dump(self, client: FakeTelegramClient, **kwargs) -> dict[int, int]:
+        return asyncio.run(
+            dump_channels(
+                client, self.channel_ids, self.metadata, self.dir.name, **kwargs
+            )
+        )
+
+    def histories(self) -> dict:
+        return {
+            channel_id: synthetic_messages(self.messages, channel_id=channel_id)
+            for channel_id in self.channel_ids
+        }
+
+    def assertDumped(self):
+        for channel_id in self.channel_ids:
+            path = os.path.join(self.dir.name, f"{channel_id}.jsonl")
+            ids = [msg.id for msg in iter_messages_file(path)]
+            self.assertEqual(ids, list(range(1, self.messages + 1)))
+            self.assertEqual(
+                self.metadata.last_saved_msg_id(checkpoint_key(channel_id)),
+                str(self.messages),
+            )
+
+    def test_channels_are_dumped_concurrently(self):
+        client = FakeTelegramClient(self.histories(), latency=0.01)
+        counts = self.dump(client)
+
+        self.assertEqual(counts, {1: 300, 2: 300, 3: 300})
+        self.assertDumped()
+        self.assertEqual(client.max_in_flight, len(self.channel_ids))
+
+    def test_parallelism_is_bounded(self):
+        client = FakeTelegramClient(self.histories(), latency=0.01)
+        self.dump(client, max_parallel=1)
+
+        self.assertDumped()
+        self.assertEqual(client.max_in_flight, 1)
+
+    def test_flood_waits_pause_and_resume(self):
+        client = FakeTelegramClient(self.histories(), flood_wait_every=10)
+        counts = self.dump(client)
+
+        self.assertGreater(client.flood_waits, 0)
+        self.assertEqual(counts, {1: 300, 2: 300, 3: 300})
+        self.assertDumped()
+
+        # Nothing new: a rerun resumes from the checkpoints.
+        self.assertEqual(self.dump(client), {1: 0, 2: 0, 3: 0})
+        self.assertDumped()
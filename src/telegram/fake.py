@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import (
+    Message as TelegramMessage,
+    MessageReplyHeader,
+    PeerChannel,
+    PeerUser,
+    User,
+)
+
+
+USERS = {
+    411323238: "Андрій",
+    596110122: "Микола",
+    564660774: "Володя",
+}
+
+
+def synthetic_messages(
+    count: int,
+    first_id: int = 1,
+    reply_every: int = 5,
+    reply_distance: int = 3,
+    users: Optional[dict[int, str]] = None,
+    channel_id: int = 1,
+) -> list[TelegramMessage]:
+    """A channel history where every `reply_every`-th message answers an earlier one."""
+    user_ids = list(users or USERS)
+    start = datetime(2023, 5, 8, tzinfo=timezone.utc)
+
+    messages: list[TelegramMessage] = []
+    for msg_id in range(first_id, first_id + count):
+        reply_to = None
+        if reply_every and msg_id % reply_every == 0 and msg_id > reply_distance:
+            reply_to = MessageReplyHeader(reply_to_msg_id=msg_id - reply_distance)
+
+        tmsg = TelegramMessage(
+            id=msg_id,
+            peer_id=PeerChannel(channel_id),
+            date=start + timedelta(minutes=msg_id),
+            message="",
+            from_id=PeerUser(user_ids[msg_id % len(user_ids)]),
+            reply_to=reply_to,
+        )
+        tmsg.text = f"повідомлення номер {msg_id}"
+        messages.append(tmsg)
+
+    return messages
+
+
+class FakeTelegramClient:
+    """
+    Serves synthetic channel histories the way `TelegramClient` does, without the
+    network. Every method call counts as one API round-trip in `requests` and takes
+    `latency` seconds; `iter_messages` pays one round-trip per `PAGE_SIZE` messages.
+    Every `flood_wait_every`-th round-trip fails with a `FloodWaitError`.
+    `max_in_flight` is the most round-trips that were awaited at the same time.
+    """
+
+    PAGE_SIZE = 100
+
+    histories: dict[int, list[TelegramMessage]]
+    users: dict[int, str]
+    latency: float
+    requests: int
+    in_flight: int
+    max_in_flight: int
+
+    def __init__(
+        self,
+        histories: dict[int, list[TelegramMessage]],
+        users: Optional[dict[int, str]] = None,
+        latency: float = 0.0,
+        flood_wait_every: int = 0,
+        flood_wait_seconds: int = 1,
+    ):
+        self.histories = histories
+        self.users = users or USERS
+        self.latency = latency
+        self.flood_wait_every = flood_wait_every
+        self.flood_wait_seconds = flood_wait_seconds
+        self.requests = 0
+        self.flood_waits = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._by_id: dict[int, dict[int, TelegramMessage]] = {}
+
+    async def _round_trip(self):
+        self.requests += 1
+        if self.flood_wait_every and self.requests % self.flood_wait_every == 0:
+            self.flood_waits += 1
+            raise FloodWaitError(request=None, capture=self.flood_wait_seconds)
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+    def _history(self, channel) -> list[TelegramMessage]:
+        if isinstance(channel, PeerChannel):
+            channel = channel.channel_id
+        return self.histories[channel]
+
+    async def get_entity(self, entity):
+        await self._round_trip()
+        if isinstance(entity, list):
+            return [self._entity(e) for e in entity]
+
+        return self._entity(entity)
+
+    def _entity(self, entity):
+        if isinstance(entity, PeerUser):
+            if entity.user_id not in self.users:
+                raise ValueError(f"Could not find the input entity for {entity}")
+            first_name, _, last_name = self.users[entity.user_id].partition(" ")
+            return User(
+                id=entity.user_id, first_name=first_name, last_name=last_name or None
+            )
+
+        return PeerChannel(entity)
+
+    async def get_messages(self, channel, ids):
+        await self._round_trip()
+        history = self._history(channel)
+        by_id = self._by_id.get(id(history))
+        if by_id is None or len(by_id) != len(history):
+            by_id = self._by_id[id(history)] = {tmsg.id: tmsg for tmsg in history}
+
+        if isinstance(ids, list):
+            return [by_id.get(msg_id) for msg_id in ids]
+
+        return by_id.get(ids)
+
+    async def iter_messages(
+        self,
+        channel,
+        min_id: int = 0,
+        offset_date=None,
+        search: Optional[str] = None,
+        reverse: bool = False,
+        limit: Optional[int] = None,
+    ):
+        history = [
+            tmsg
+            for tmsg in self._history(channel)
+            if tmsg.id > min_id and (not search or search in tmsg.message)
+        ]
+        if not reverse:
+            history.reverse()
+        if limit is not None:
+            history = history[:limit]
+
+        for i, tmsg in enumerate(history):
+            if i % self.PAGE_SIZE == 0:
+                await self._round_trip()
+            yield tmsg
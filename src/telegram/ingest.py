@@ -0,0 +1,82 @@
+import time
+from dotenv import dotenv_values
+from telethon import TelegramClient
+import logging
+
+from ai.db import MetadataStore, VectorDB, iter_documents
+from telegram.channel import Channel, Message
+from telegram.names import NameResolver
+
+log = logging.getLogger(__name__)
+
+
+async def ingest_history(
+    client: TelegramClient,
+    channel_id: int,
+    vectordb: VectorDB,
+    metadata: MetadataStore,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Appends the channel messages newer than the stored `last_saved_msg_id` to the
+    vector db while they are being fetched. The watermark is advanced after every
+    stored batch, so an interrupted run resumes where it stopped. Chunks are stored
+    under content-hash ids, so a batch stored just before a crash, and stored again
+    by the rerun, is not duplicated. Returns the number of ingested messages.
+    """
+    key = str(channel_id)
+    min_id = int(metadata.last_saved_msg_id(key) or 0)
+    log.info(f"Ingesting new messages of {channel_id} after {min_id}")
+
+    def store(batch: list[Message]):
+        vectordb.store_documents(
+            list(iter_documents(batch, metadata={"channel_id": channel_id}))
+        )
+        metadata.store_message_states(
+            key, [msg.id for msg in batch], "ingested", str(batch[-1].id)
+        )
+
+    ingested = 0
+    batch: list[Message] = []
+    channel = await client.get_entity(channel_id)
+    chan = Channel(client, channel, names=NameResolver(client, metadata))
+    async for msg in chan.iter_history(min_id=min_id):
+        batch.append(msg)
+        if len(batch) == batch_size:
+            store(batch)
+            ingested += len(batch)
+            batch = []
+
+    if batch:
+        store(batch)
+        ingested += len(batch)
+
+    return ingested
+
+
+if __name__ == "__main__":
+    t = time.time()
+
+    env = dotenv_values()
+    username = env["TELEGRAM_USER"]
+    app_id = env["TELEGRAM_APP_ID"]
+    api_hash = env["TELEGRAM_API_HASH"]
+    channel_id = int(env["TELEGRAM_CHANNEL_ID"])
+
+    client = TelegramClient(
+        username,
+        app_id,
+        api_hash,
+    )
+    vectordb = VectorDB()
+    metadata = MetadataStore()
+
+    with client:
+        ingested = client.loop.run_until_complete(
+            ingest_history(client, channel_id, vectordb, metadata)
+        )
+
+    metadata.close()
+
+    elapsed_time = time.time() - t
+    print("Ingested %d messages in %f seconds." % (ingested, elapsed_time))
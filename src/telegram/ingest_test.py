@@ -0,0 +1,102 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from ai.db import VectorDB, VectorDBConfig
+from ai.fake import FakeEmbeddings
+from ai.metadata import MetadataStore
+from telegram.fake import FakeTelegramClient, synthetic_messages
+from telegram.ingest import ingest_history
+
+
+class StubVectorDB:
+    def __init__(self):
+        self.documents = []
+
+    def store_documents(self, documents):
+        self.documents.extend(documents)
+        return [str(i) for i, _ in enumerate(documents)]
+
+
+class TestIngestHistory(unittest.TestCase):
+    channel_id = 1
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataStore(os.path.join(self.dir.name, "metadata.db"))
+        self.vectordb = StubVectorDB()
+        self.history = synthetic_messages(50)
+        self.client = FakeTelegramClient({self.channel_id: self.history})
+
+    def tearDown(self):
+        self.metadata.close()
+        self.dir.cleanup()
+
+    def ingest(self) -> int:
+        return asyncio.run(
+            ingest_history(
+                self.client,
+                self.channel_id,
+                self.vectordb,
+                self.metadata,
+                batch_size=20,
+            )
+        )
+
+    def test_resumes_from_watermark(self):
+        self.assertEqual(self.ingest(), 50)
+        self.assertEqual(self.metadata.last_saved_msg_id(str(self.channel_id)), "50")
+        ingested_text = "".join(doc.page_content for doc in self.vectordb.documents)
+        self.assertIn("номер 1'", ingested_text)
+
+        self.vectordb.documents.clear()
+        self.history.extend(synthetic_messages(10, first_id=51))
+
+        self.assertEqual(self.ingest(), 10)
+        self.assertEqual(self.metadata.last_saved_msg_id(str(self.channel_id)), "60")
+        states = self.metadata.message_states(str(self.channel_id), list(range(1, 61)))
+        self.assertEqual(set(states.values()), {"ingested"})
+        self.assertEqual(len(states), 60)
+        ingested_text = "".join(doc.page_content for doc in self.vectordb.documents)
+        self.assertIn("номер 51'", ingested_text)
+        self.assertNotIn("номер 50'", ingested_text)
+
+        self.assertEqual(self.ingest(), 0)
+
+    def new_vectordb(self, name: str) -> VectorDB:
+        return VectorDB(
+            VectorDBConfig(
+                persistent_dir=os.path.join(self.dir.name, name),
+                embedding_model="fake",
+                embedding_cache=False,
+                index="numpy",
+            ),
+            embeddings=FakeEmbeddings(),
+        )
+
+    def test_replayed_batch_is_not_stored_twice(self):
+        """A crash between storing a batch and advancing the watermark."""
+        self.vectordb = self.new_vectordb("crashed")
+        with mock.patch.object(
+            self.metadata, "store_message_states", side_effect=KeyboardInterrupt
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.ingest()
+        self.assertGreater(self.vectordb.collection.count(), 0)
+        self.assertIsNone(self.metadata.last_saved_msg_id(str(self.channel_id)))
+
+        self.assertEqual(self.ingest(), 50)
+        crashed = self.vectordb.collection.count()
+
+        self.metadata.close()
+        self.metadata = MetadataStore(os.path.join(self.dir.name, "clean.db"))
+        self.vectordb = self.new_vectordb("clean")
+        self.assertEqual(self.ingest(), 50)
+        self.assertEqual(crashed, self.vectordb.collection.count())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import time
+from typing import Iterable, Optional
+
+from telethon import TelegramClient
+from telethon.tl.types import PeerUser, User
+
+from ai.metadata import MetadataStore
+
+log = logging.getLogger(__name__)
+
+
+UNKNOWN_USER_NAME = "Незнайомець"
+
+# Never looked up, never expire.
+KNOWN_USERS: dict[int, str] = {
+    411323238: "Андрій",
+    596110122: "Микола",
+    564660774: "Володя",
+    6470622385: "Йосип",  # Bot name.
+}
+
+
+def user_name(user: Optional[User]) -> str:
+    if user is None:
+        return UNKNOWN_USER_NAME
+
+    name = " ".join(part for part in (user.first_name, user.last_name) if part)
+    return name or UNKNOWN_USER_NAME
+
+
+class NameResolver:
+    """
+    Resolves user ids to display names. Names are kept in memory and, given a
+    `metadata` store, persisted across restarts; either copy is refreshed after
+    `ttl` seconds. Ids that cannot be resolved are named `UNKNOWN_USER_NAME` and
+    not looked up again for `failure_ttl` seconds; these are kept in memory only.
+    `prefetch` resolves all the unknown ids of a batch with one `get_entity` call,
+    and concurrent lookups of the same id share one request.
+    """
+
+    client: Optional[TelegramClient]
+    metadata: Optional[MetadataStore]
+    ttl: float
+    failure_ttl: float
+
+    lookups: int  # `get_entity` calls.
+
+    def __init__(
+        self,
+        client: Optional[TelegramClient] = None,
+        metadata: Optional[MetadataStore] = None,
+        ttl: float = 7 * 24 * 3600,
+        failure_ttl: float = 3600,
+    ):
+        self.client = client
+        self.metadata = metadata
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.lookups = 0
+        self._names: dict[int, tuple[str, float]] = {}
+        self._failed: dict[int, float] = {}  # Unresolvable ids, by the failure time.
+        self._in_flight: dict[int, asyncio.Future] = {}
+
+    async def name(self, peer: Optional[PeerUser]) -> str:
+        if peer is None:
+            return UNKNOWN_USER_NAME
+
+        name = self.cached(peer.user_id)
+        if name is not None:
+            return name
+
+        return (await self.names([peer.user_id]))[peer.user_id]
+
+    def name_from_user(self, user: Optional[User]) -> str:
+        """
+        Names a user entity at hand, remembering it for later lookups by id. The
+        entity wins over any cached name, including a failed lookup of its id.
+        """
+        if user is None:
+            return UNKNOWN_USER_NAME
+        if user.id in KNOWN_USERS:
+            return KNOWN_USERS[user.id]
+
+        name = user_name(user)
+        cached, resolved_at = self._names.get(user.id, (None, 0.0))
+        if name != cached or time.time() - resolved_at > self.ttl:
+            self._remember({user.id: name})
+
+        return name
+
+    def cached(self, user_id: int, fresh: bool = True) -> Optional[str]:
+        if user_id in KNOWN_USERS:
+            return KNOWN_USERS[user_id]
+
+        now = time.time()
+        name, resolved_at = self._names.get(user_id, (None, 0.0))
+        if not fresh or now - resolved_at <= self.ttl:
+            return name
+
+        failed_at = self._failed.get(user_id)
+        if failed_at is not None and now - failed_at <= self.failure_ttl:
+            # A stale name is better than none.
+            return name or UNKNOWN_USER_NAME
+
+        return None
+
+    async def prefetch(self, user_ids: Iterable[int]):
+        await self.names(user_ids)
+
+    async def names(self, user_ids: Iterable[int]) -> dict[int, str]:
+        user_ids = set(user_ids)
+        missing = [id for id in user_ids if self.cached(id) is None]
+        if missing and self.metadata:
+            self._names.update(self.metadata.user_names(missing))
+
+        lookup = [
+            id
+            for id in missing
+            if self.cached(id) is None and id not in self._in_flight
+        ]
+        if lookup:
+            loop = asyncio.get_running_loop()
+            futures = {id: loop.create_future() for id in lookup}
+            self._in_flight.update(futures)
+            try:
+                self._remember(await self._lookup(lookup))
+            finally:
+                for id, future in futures.items():
+                    del self._in_flight[id]
+                    future.set_result(None)
+
+        waiting = [self._in_flight[id] for id in missing if id in self._in_flight]
+        if waiting:
+            await asyncio.gather(*waiting)
+
+        # Stale or unresolvable names are better than none.
+        return {
+            id: self.cached(id) or self.cached(id, fresh=False) or UNKNOWN_USER_NAME
+            for id in user_ids
+        }
+
+    async def _lookup(self, user_ids: list[int]) -> dict[int, str]:
+        if self.client is None:
+            return {}
+
+        self.lookups += 1
+        log.debug(f"Resolving the names of {len(user_ids)} users")
+        try:
+            users = await self.client.get_entity([PeerUser(id) for id in user_ids])
+            return {id: user_name(user) for id, user in zip(user_ids, users)}
+        except Exception as e:
+            # Any id unknown to the session fails the whole batch with a ValueError,
+            # and so does an RPC error; retry one by one.
+            log.debug(f"Could not resolve {len(user_ids)} names at once: {e!r}")
+
+        self.lookups += len(user_ids)
+        users = await asyncio.gather(
+            *[self.client.get_entity(PeerUser(id)) for id in user_ids],
+            return_exceptions=True,
+        )
+
+        resolved: dict[int, str] = {}
+        for id, user in zip(user_ids, users):
+            if isinstance(user, Exception):
+                log.warning(f"Could not resolve the name of {id}: {user}")
+                self._failed[id] = time.time()
+            else:
+                resolved[id] = user_name(user)
+
+        return resolved
+
+    def _remember(self, names: dict[int, str]):
+        if not names:
+            return
+
+        now = time.time()
+        self._names.update((id, (name, now)) for id, name in names.items())
+        for id in names:
+            self._failed.pop(id, None)
+        if self.metadata:
+            self.metadata.store_user_names(names)
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from telethon.errors import ServerError
+from telethon.tl.types import PeerUser, User
+
+from ai.metadata import MetadataStore
+from telegram.channel import Channel
+from telegram.fake import FakeTelegramClient, synthetic_messages
+from telegram.names import UNKNOWN_USER_NAME, NameResolver
+
+USERS = {1: "Оксана Петренко", 2: "Тарас", 3: "Ірина"}
+
+
+class TestNameResolver(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.metadata = MetadataStore(os.path.join(self.dir.name, "metadata.db"))
+        self.client = FakeTelegramClient({}, users=USERS, latency=0.01)
+
+    def tearDown(self):
+        self.metadata.close()
+        self.dir.cleanup()
+
+    def test_prefetch_is_one_lookup(self):
+        names = NameResolver(self.client, self.metadata)
+        asyncio.run(names.prefetch([1, 2, 3, 1]))
+
+        self.assertEqual(self.client.requests, 1)
+        self.assertEqual(asyncio.run(names.name(PeerUser(1))), "Оксана Петренко")
+        self.assertEqual(self.client.requests, 1)
+
+    def test_concurrent_lookups_are_deduped(self):
+        names = NameResolver(self.client)
+
+        async def lookup():
+            return await asyncio.gather(*[names.name(PeerUser(2)) for _ in range(10)])
+
+        self.assertEqual(asyncio.run(lookup()), ["Тарас"] * 10)
+        self.assertEqual(self.client.requests, 1)
+
+    def test_names_persist(self):
+        asyncio.run(NameResolver(self.client, self.metadata).prefetch([1, 2]))
+
+        offline = NameResolver(metadata=self.metadata)
+        self.assertEqual(
+            asyncio.run(offline.names([1, 2])), {1: "Оксана Петренко", 2: "Тарас"}
+        )
+
+    def test_stale_names_are_refreshed(self):
+        names = NameResolver(self.client, self.metadata, ttl=0)
+        asyncio.run(names.name(PeerUser(3)))
+        asyncio.run(names.name(PeerUser(3)))
+        self.assertEqual(self.client.requests, 2)
+
+        # Without a client, a stale name beats none.
+        offline = NameResolver(metadata=self.metadata, ttl=0)
+        self.assertEqual(asyncio.run(offline.name(PeerUser(3))), "Ірина")
+
+    def test_unknown_user(self):
+        names = NameResolver(self.client)
+        self.assertEqual(
+            asyncio.run(names.names([1, 42])),
+            {1: "Оксана Петренко", 42: UNKNOWN_USER_NAME},
+        )
+        self.assertEqual(asyncio.run(names.name(None)), UNKNOWN_USER_NAME)
+
+    def test_unknown_user_is_not_looked_up_again(self):
+        names = NameResolver(self.client)
+        asyncio.run(names.names([1, 42]))
+        requests = self.client.requests
+
+        self.assertEqual(asyncio.run(names.name(PeerUser(42))), UNKNOWN_USER_NAME)
+        self.assertEqual(self.client.requests, requests)
+
+        # Once the failure expires, the id is looked up again.
+        retrying = NameResolver(self.client, failure_ttl=0)
+        asyncio.run(retrying.name(PeerUser(42)))
+        requests = self.client.requests
+        asyncio.run(retrying.name(PeerUser(42)))
+        self.assertGreater(self.client.requests, requests)
+
+    def test_entity_at_hand_beats_failed_lookup(self):
+        names = NameResolver(self.client)
+        asyncio.run(names.name(PeerUser(42)))
+
+        self.assertEqual(names.name_from_user(User(id=42, first_name="Олена")), "Олена")
+        self.assertEqual(asyncio.run(names.name(PeerUser(42))), "Олена")
+
+    def test_batch_rpc_error_falls_back_to_single_lookups(self):
+        get_entity = self.client.get_entity
+
+        async def flaky_get_entity(entity):
+            if isinstance(entity, list):
+                raise ServerError(request=None, message="INTERNAL")
+            return await get_entity(entity)
+
+        self.client.get_entity = flaky_get_entity
+        names = NameResolver(self.client)
+
+        self.assertEqual(
+            asyncio.run(names.names([1, 2])), {1: "Оксана Петренко", 2: "Тарас"}
+        )
+
+    def test_channel_history_prefetches_names(self):
+        client = FakeTelegramClient(
+            {7: synthetic_messages(500, users=USERS, channel_id=7)}, users=USERS
+        )
+        chan = Channel(client, 7, names=NameResolver(client, self.metadata))
+        messages = asyncio.run(chan.history())
+
+        self.assertEqual({msg.name for msg in messages.data}, set(USERS.values()))
+        self.assertEqual(chan.names.lookups, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import time
+from typing import AsyncIterator
+from telethon import events
+import logging
+
+log = logging.getLogger(__name__)
+
+
+async def respond_streaming(
+    event: events.NewMessage.Event,
+    pieces: AsyncIterator[str],
+    min_edit_interval: float = 1.0,
+) -> str:
+    """
+    Sends the answer as soon as its first piece arrives and then edits the sent
+    message as more pieces come in, at most once per `min_edit_interval` seconds
+    since Telegram throttles edits. Returns the whole answer.
+    """
+    text = ""
+    sent_text = ""
+    message = None
+    last_edit = 0.0
+
+    async for piece in pieces:
+        text += piece
+        if not text.strip():
+            continue
+
+        now = time.monotonic()
+        if message is None:
+            message = await event.respond(text)
+        elif now - last_edit >= min_edit_interval:
+            await message.edit(text)
+        else:
+            continue
+
+        sent_text = text
+        last_edit = now
+
+    if message is not None and text != sent_text:
+        await message.edit(text)
+
+    return text
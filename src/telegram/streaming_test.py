@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+from telegram.streaming import respond_streaming
+
+
+class FakeSentMessage:
+    def __init__(self, text: str):
+        self.edits = [text]
+
+    async def edit(self, text: str):
+        self.edits.append(text)
+
+
+class FakeEvent:
+    def __init__(self):
+        self.sent: list[FakeSentMessage] = []
+
+    async def respond(self, text: str) -> FakeSentMessage:
+        self.sent.append(FakeSentMessage(text))
+        return self.sent[-1]
+
+
+async def pieces(words: list[str], delay: float):
+    for word in words:
+        await asyncio.sleep(delay)
+        yield word
+
+
+class TestRespondStreaming(unittest.TestCase):
+    def test_edits_are_throttled(self):
+        event = FakeEvent()
+        words = [f"{i} " for i in range(20)]
+        text = asyncio.run(
+            respond_streaming(event, pieces(words, 0.01), min_edit_interval=0.05)
+        )
+
+        self.assertEqual(text, "".join(words))
+        self.assertEqual(len(event.sent), 1)
+        edits = event.sent[0].edits
+        self.assertEqual(edits[0], "0 ")
+        self.assertEqual(edits[-1], text)
+        self.assertLess(len(edits), len(words) // 2)
+
+    def test_nothing_is_sent_for_an_empty_answer(self):
+        event = FakeEvent()
+        asyncio.run(respond_streaming(event, pieces([" ", ""], 0)))
+        self.assertEqual(event.sent, [])
@@ -1,16 +1,32 @@
+import asyncio
+import dataclasses
+import itertools
+import os
+from datetime import datetime, timedelta, timezone
 import unittest
 import json
 import logging
-from telegram.channel import Messages, Channel
+from telegram.channel import (
+    Media,
+    Message,
+    Messages,
+    MessagesView,
+    Reply,
+    Channel,
+    JsonLinesWriter,
+    iter_json_array,
+    iter_messages_file,
+    MessageFormatter,
+    reformat_history,
+    save_history,
+)
+from telegram.fake import FakeTelegramClient, synthetic_messages
 import telethon
 from dotenv import dotenv_values
+from langchain import PromptTemplate
 
 
-class TestTelegramChannel(unittest.TestCase):
-    temp_file = "./misc/temp_history.json"
-
-    def test_json_serialization(self):
-        json_data = """
+JSON_DATA = """
         [{
             "user_id": 596110122,
             "name": "Микола",
@@ -33,7 +49,12 @@ class TestTelegramChannel(unittest.TestCase):
             }
         }]"""
 
-        dict_data = json.loads(json_data)
+
+class TestTelegramChannel(unittest.TestCase):
+    temp_file = "./misc/temp_history.json"
+
+    def test_json_serialization(self):
+        dict_data = json.loads(JSON_DATA)
         msgs_from_dict = Messages.from_dict(dict_data)
         msgs = [msg for msg in msgs_from_dict]
         self.assertEqual(len(msgs), 2)
@@ -44,6 +65,15 @@ class TestTelegramChannel(unittest.TestCase):
 
         self.assertEqual(msgs_from_file.toJSON(), msgs_from_dict.toJSON())
 
+    def test_json_array_is_read_lazily(self):
+        dict_data = json.loads(JSON_DATA)
+        Messages.from_dict(dict_data).save(self.temp_file)
+
+        self.assertEqual(
+            list(iter_json_array(self.temp_file, chunk_size=16)),
+            [{**msg, "context_text": "", "id": 0} for msg in dict_data],
+        )
+
     def test_integration_history_fetch(self):
         """An integration test that calls Telegram."""
         env = dotenv_values()
@@ -88,3 +118,273 @@ class TestTelegramChannel(unittest.TestCase):
             os.remove(self.temp_file)
         except Exception as err:
             logging.warn(f"On deleting {self.temp_file}: {err}")
+
+
+class TestJsonLinesHistory(unittest.TestCase):
+    temp_file = "./misc/temp_history.jsonl"
+
+    def tearDown(self) -> None:
+        import os
+
+        if os.path.exists(self.temp_file):
+            os.remove(self.temp_file)
+
+    def test_round_trip(self):
+        msgs = Messages.from_dict(json.loads(JSON_DATA))
+        msgs.save(self.temp_file)
+
+        self.assertEqual(Messages.from_file(self.temp_file).toJSON(), msgs.toJSON())
+
+    def test_unfinished_line(self):
+        msgs = Messages.from_dict(json.loads(JSON_DATA))
+        with JsonLinesWriter(self.temp_file) as writer:
+            writer.write(msgs.data[:1])
+        with open(self.temp_file, "a") as f:
+            f.write('{"user_id": 5641')
+
+        self.assertEqual(len(list(iter_messages_file(self.temp_file))), 1)
+
+        with JsonLinesWriter(self.temp_file, append=True) as writer:
+            writer.write(msgs.data[1:])
+        self.assertEqual(Messages.from_file(self.temp_file).toJSON(), msgs.toJSON())
+
+    def test_save_history_resumes(self):
+        tmsgs = synthetic_messages(250)
+        client = FakeTelegramClient({1: tmsgs})
+        asyncio.run(save_history(client, 1, self.temp_file))
+        self.assertEqual(len(Messages.from_file(self.temp_file).data), 250)
+
+        tmsgs.extend(synthetic_messages(50, first_id=251))
+        asyncio.run(save_history(client, 1, self.temp_file))
+
+        ids = [msg.id for msg in iter_messages_file(self.temp_file)]
+        self.assertEqual(ids, list(range(1, 301)))
+
+
+class TestMessages(unittest.TestCase):
+    def messages(self, count: int) -> list[Message]:
+        reply = Reply(user_id=1, name="Андрій", text="питання", media=None)
+        return [
+            Message(
+                id=i,
+                user_id=i % 2,
+                name=["Микола", "Володя"][i % 2],
+                text=f"повідомлення {i}",
+                time=f"2023-05-08 11:{i:02}:00+00:00",
+                media=Media(type="image/jpeg") if i % 3 == 0 else None,
+                reply_to=dataclasses.replace(reply) if i % 2 else None,
+                context_text=f"текст {i}",
+            )
+            for i in range(count)
+        ]
+
+    def test_materialises_what_was_stored(self):
+        data = self.messages(10)
+        msgs = Messages(data)
+
+        self.assertEqual(len(msgs), 10)
+        self.assertEqual(list(msgs), data)
+        self.assertEqual(msgs[-1], data[-1])
+        with self.assertRaises(IndexError):
+            msgs[10]
+
+        # Users, media types and replies are stored once.
+        self.assertEqual(len(msgs._people), 3)
+        self.assertEqual(msgs._media_types, ["image/jpeg"])
+        self.assertEqual(len(msgs._reply_rows), 1)
+
+    def test_times_read_back_exactly(self):
+        times = [
+            datetime(2023, 5, 8, 11, 32, 9, 15, tzinfo=timezone.utc),
+            "2023-05-08 11:32:09+00:00",
+            "2023-05-08T11:32:09+00:00",
+            "2023-05-08 11:32:09",
+            datetime(2023, 5, 8, 11, 32, 9, tzinfo=timezone(timedelta(hours=3))),
+            None,
+        ]
+        data = self.messages(len(times))
+        for msg, time in zip(data, times):
+            msg.time = time
+        msgs = Messages(data)
+
+        self.assertEqual([msg.time for msg in msgs], times)
+        self.assertEqual([type(msg.time) for msg in msgs], [type(t) for t in times])
+        self.assertEqual(sorted(msgs._other_times), [2, 3, 4, 5])
+
+    def test_iteration_is_reentrant(self):
+        msgs = Messages(self.messages(3))
+        pairs = [(a.id, b.id) for a in msgs for b in msgs]
+        self.assertEqual(len(pairs), 9)
+
+    def test_slices_are_views(self):
+        data = self.messages(10)
+        view = Messages(data)[2:8][1::2]
+
+        self.assertIsInstance(view, MessagesView)
+        self.assertEqual(list(view), data[2:8][1::2])
+        self.assertEqual(view[-1], data[7])
+
+    def test_batch_messages(self):
+        batches = Messages(self.messages(10)).batch_messages(window_size=4)
+
+        self.assertEqual(next(batches), "текст 0\nтекст 1\nтекст 2\nтекст 3")
+        self.assertEqual(list(batches), ["текст 4\nтекст 5\nтекст 6\nтекст 7"])
+
+    def test_media_round_trip(self):
+        msgs = Messages(self.messages(4))
+        self.assertEqual(
+            Messages.from_dict(json.loads(msgs.toJSON())).toJSON(), msgs.toJSON()
+        )
+
+
+def legacy_context_text(msg: Message) -> str:
+    """The former `MessageFormatter`, built on langchain's `PromptTemplate`."""
+    reply_tmpl = PromptTemplate(
+        template="у відповідь на повідомлення яке написав {name}:{text}{attachment}",
+        input_variables=["name", "text", "attachment"],
+    )
+    message_tmpl = PromptTemplate(
+        template="{name} написав:{text}{attachment}{reply}",
+        input_variables=["name", "text", "attachment", "reply"],
+    )
+
+    def text(text):
+        return " '" + text + "'" if text != "" else ""
+
+    def attachment(msg):
+        if not msg.media:
+            return ""
+        content_type = {
+            "image": "фотографію",
+            "video": "відео",
+            "audio": "аудіо",
+            "empty-webpage": "веб посилання",
+            "geolocation": "геопозицію",
+            "live-geolocation": "геопозицію в режимі онлайн",
+        }.get(msg.media.type.split("/")[0])
+        if content_type is None:
+            return ""
+        media_type = f"прикріпив {content_type}".upper()
+        if msg.text != "":
+            media_type = " та " + media_type
+        return " " + media_type
+
+    reply = ""
+    if msg.reply_to:
+        reply = " " + reply_tmpl.format(
+            name="сам" if msg.reply_to.user_id == msg.user_id else msg.reply_to.name,
+            text=text(msg.reply_to.text),
+            attachment=attachment(msg.reply_to),
+        )
+
+    return message_tmpl.format(
+        name=msg.name, text=text(msg.text), attachment=attachment(msg), reply=reply
+    )
+
+
+class TestMessageFormatter(unittest.TestCase):
+    media_types = [
+        None,
+        "image/jpeg",
+        "video/mp4",
+        "audio/ogg",
+        "empty-webpage",
+        "geolocation",
+        "live-geolocation",
+        "application/pdf",
+    ]
+
+    def messages(self) -> list[Message]:
+        replies = [None] + [
+            Reply(
+                user_id=user_id,
+                name="Микола",
+                text=text,
+                media=Media(type=media_type) if media_type else None,
+            )
+            for user_id in (1, 2)
+            for text in ("", "питання {name}")
+            for media_type in self.media_types
+        ]
+        return [
+            Message(
+                id=i,
+                user_id=1,
+                name="Андрій {}",
+                text=text,
+                time="2023-05-08 11:32:09+00:00",
+                media=Media(type=media_type) if media_type else None,
+                reply_to=reply,
+            )
+            for i, (text, media_type, reply) in enumerate(
+                itertools.product(("", "відповідь 'так'"), self.media_types, replies)
+            )
+        ]
+
+    def test_output_is_unchanged(self):
+        messages = self.messages()
+        MessageFormatter.format_batch(messages)
+
+        for msg in messages:
+            self.assertEqual(msg.context_text, legacy_context_text(msg))
+
+    def test_reformat_history(self):
+        src, dst = "./misc/temp_formatter.json", "./misc/temp_formatter.jsonl"
+        Messages(self.messages()).save(src)
+        self.addCleanup(os.remove, src)
+        messages = self.messages()
+        MessageFormatter.format_batch(messages)
+
+        for processes in (1, 2):
+            written = reformat_history(src, dst, processes=processes, chunk_size=50)
+            self.assertEqual(written, len(messages))
+            self.assertEqual(list(iter_messages_file(dst)), messages)
+
+        # In place, over its own output.
+        self.assertEqual(reformat_history(dst, dst, processes=1), len(messages))
+        self.assertEqual(list(iter_messages_file(dst)), messages)
+        os.remove(dst)
+
+    def test_formatter_without_format_batch(self):
+        class UpperFormatter:
+            @staticmethod
+            def format(msg: Message):
+                msg.context_text = msg.text.upper()
+
+        chan = Channel(FakeTelegramClient({1: synthetic_messages(10)}), 1)
+        history = asyncio.run(chan.history(formatters=[UpperFormatter()]))
+
+        self.assertEqual(len(history), 10)
+        for msg in history:
+            self.assertEqual(msg.context_text, msg.text.upper())
+
+
+class TestChannelReplies(unittest.TestCase):
+    def history(self, tmsgs, **kwargs) -> tuple[Messages, FakeTelegramClient]:
+        client = FakeTelegramClient({1: tmsgs})
+        chan = Channel(client, 1, **kwargs)
+        return asyncio.run(chan.history()), client
+
+    def test_replies_are_resolved(self):
+        history, _ = self.history(synthetic_messages(30))
+
+        for msg in history:
+            if msg.id % 5 == 0:
+                self.assertEqual(msg.reply_to.text, f"повідомлення номер {msg.id - 3}")
+                self.assertIn("у відповідь на повідомлення", msg.context_text)
+            else:
+                self.assertIsNone(msg.reply_to)
+
+    def test_reply_targets_are_fetched_in_batches(self):
+        tmsgs = synthetic_messages(1000, first_id=501, reply_distance=500)
+        history, client = self.history(tmsgs, window_size=100)
+
+        self.assertEqual(len(history.data), 1000)
+        # 10 pages of history, and replies to messages 1..500 in the first 5 windows.
+        self.assertEqual(client.requests, 15)
+
+    def test_reply_targets_in_recent_messages_are_not_fetched(self):
+        history, client = self.history(synthetic_messages(1000), window_size=100)
+
+        self.assertEqual(len(history.data), 1000)
+        self.assertEqual(client.requests, 10)
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from ai.metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+
+SUPERSEDE_POLICIES = ("none", "latest", "merge")
+
+QUEUE_DEPTH = REGISTRY.gauge("work_queue_depth", "Jobs waiting.", ("queue",))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "work_queue_wait_seconds",
+    "Time jobs waited before being handled or dropped.",
+    ("queue",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+QUEUE_JOBS = REGISTRY.counter(
+    "work_queue_jobs_total",
+    "Jobs by outcome: processed, failed, superseded, dropped_full or dropped_stale.",
+    ("queue", "outcome"),
+)
+
+
+@dataclass
+class Job(Generic[T]):
+    key: Hashable
+    item: T
+    enqueued_at: float
+
+
+class WorkQueue(Generic[T]):
+    """
+    A bounded queue drained by `workers` tasks that each await `handle(item)`, so
+    at most `workers` items are handled at a time and a burst waits in the queue
+    instead of piling up on the LLM.
+
+    Load shedding:
+    - a job still queued when another one with the same key (a chat) arrives is
+      superseded: with `supersede="latest"` it is replaced by the new item, with
+      "merge" it becomes `merge(queued, new)`; it keeps its place in the queue;
+    - when `max_size` jobs are queued, the oldest one is dropped for the new one;
+    - a job that waited longer than `max_age` seconds is dropped unhandled.
+
+    The depth, the waits and the outcomes are exported in `ai.metrics.REGISTRY`,
+    labelled with `name`. Waits are measured with `clock`.
+    """
+
+    name: str
+
+    handle: Callable[[T], Awaitable[None]]
+    workers: int
+    max_size: int
+    max_age: Optional[float]
+    supersede: str
+    merge: Optional[Callable[[T, T], T]]
+
+    submitted: int
+    processed: int
+    failed: int
+    superseded: int
+    dropped_full: int
+    dropped_stale: int
+    max_depth: int
+    wait_total: float
+    wait_max: float
+
+    def __init__(
+        self,
+        handle: Callable[[T], Awaitable[None]],
+        workers: int = 2,
+        max_size: int = 100,
+        max_age: Optional[float] = 120.0,
+        supersede: str = "latest",
+        merge: Optional[Callable[[T, T], T]] = None,
+        name: str = "bot",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if supersede not in SUPERSEDE_POLICIES:
+            raise ValueError(
+                f"Unknown supersede policy {supersede!r}, "
+                f"expected one of {SUPERSEDE_POLICIES}"
+            )
+        if supersede == "merge" and merge is None:
+            raise ValueError("The merge policy needs a merge function")
+
+        self.name = name
+        self.clock = clock
+        self.handle = handle
+        self.workers = workers
+        self.max_size = max_size
+        self.max_age = max_age
+        self.supersede = supersede
+        self.merge = merge
+
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.superseded = 0
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        self._jobs: deque[Job[T]] = deque()
+        self._queued: dict[Hashable, Job[T]] = {}
+        self._ready = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._idle = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def start(self):
+        """Starts the workers on the running event loop."""
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers, cancelling the items being handled."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """Waits until the queue is empty and every worker is idle."""
+        while self._jobs or self._idle < len(self._tasks):
+            await asyncio.sleep(0.01)
+
+    def submit(self, key: Hashable, item: T) -> bool:
+        """Queues the item; returns False if it superseded a queued one."""
+        self.submitted += 1
+
+        queued = self._queued.get(key)
+        if queued is not None and self.supersede != "none":
+            self.superseded += 1
+            self._count("superseded")
+            if self.supersede == "merge":
+                queued.item = self.merge(queued.item, item)
+            else:
+                queued.item = item
+            return False
+
+        if len(self._jobs) >= self.max_size:
+            dropped = self._jobs.popleft()
+            self._forget(dropped)
+            self.dropped_full += 1
+            self._count("dropped_full")
+            log.warning(f"Queue is full, dropped the oldest job of {dropped.key}")
+
+        job = Job(key=key, item=item, enqueued_at=self.clock())
+        self._jobs.append(job)
+        self._queued[key] = job
+        self.max_depth = max(self.max_depth, len(self._jobs))
+        QUEUE_DEPTH.set(len(self._jobs), queue=self.name)
+        self._ready.set()
+        return True
+
+    def stats(self) -> dict[str, float]:
+        handled = self.processed + self.failed
+        return {
+            "depth": len(self._jobs),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "superseded": self.superseded,
+            "dropped_full": self.dropped_full,
+            "dropped_stale": self.dropped_stale,
+            "wait_avg": self.wait_total / handled if handled else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    async def _work(self):
+        while True:
+            self._idle += 1
+            try:
+                while not self._jobs:
+                    self._ready.clear()
+                    await self._ready.wait()
+            finally:
+                self._idle -= 1
+
+            job = self._jobs.popleft()
+            self._forget(job)
+            QUEUE_DEPTH.set(len(self._jobs), queue=self.name)
+
+            wait = self.clock() - job.enqueued_at
+            QUEUE_WAIT_SECONDS.observe(wait, queue=self.name)
+            if self.max_age is not None and wait > self.max_age:
+                self.dropped_stale += 1
+                self._count("dropped_stale")
+                log.warning(f"Dropped a job of {job.key} after {wait:.1f} seconds")
+                continue
+
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            try:
+                await self.handle(job.item)
+                self.processed += 1
+                self._count("processed")
+            except Exception:
+                self.failed += 1
+                self._count("failed")
+                log.exception(f"Failed to handle a job of {job.key}")
+
+    def _count(self, outcome: str):
+        QUEUE_JOBS.inc(queue=self.name, outcome=outcome)
+
+    def _forget(self, job: Job[T]):
+        if self._queued.get(job.key) is job:
+            del self._queued[job.key]
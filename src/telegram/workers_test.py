@@ -0,0 +1,138 @@
+import asyncio
+import unittest
+
+from telegram.workers import QUEUE_DEPTH, QUEUE_JOBS, WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+    def run_queue(
+        self, submit, latency: float = 0.05, clock_step: float = 0.0, **kwargs
+    ) -> list:
+        """With a `clock_step`, every item handled advances the queue's clock by it."""
+        handled = []
+        in_flight = 0
+        self.max_in_flight = 0
+        now = 0.0
+        if clock_step:
+            kwargs["clock"] = lambda: now
+
+        async def handle(item):
+            nonlocal in_flight, now
+            in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, in_flight)
+            await asyncio.sleep(latency)
+            now += clock_step
+            in_flight -= 1
+            handled.append(item)
+
+        async def run():
+            self.queue = WorkQueue(handle, **kwargs)
+            self.queue.start()
+            await submit(self.queue)
+            await self.queue.join()
+            await self.queue.stop()
+
+        asyncio.run(run())
+        return handled
+
+    def test_workers_bound_concurrency(self):
+        async def submit(queue):
+            for i in range(10):
+                queue.submit(i, i)
+
+        handled = self.run_queue(submit, workers=3)
+
+        self.assertCountEqual(handled, range(10))
+        self.assertEqual(self.max_in_flight, 3)
+        stats = self.queue.stats()
+        self.assertEqual(stats["processed"], 10)
+        self.assertEqual(stats["max_depth"], 10)
+        self.assertGreater(stats["wait_max"], 0.05)
+
+    def test_queued_messages_of_a_chat_are_merged(self):
+        async def submit(queue):
+            queue.submit("a", "a1")
+            await asyncio.sleep(0.01)  # "a1" is being handled.
+            for item in ["a2", "b1", "a3", "a4"]:
+                queue.submit(item[0], item)
+
+        handled = self.run_queue(
+            submit, workers=1, supersede="merge", merge=lambda a, b: f"{a}+{b}"
+        )
+
+        self.assertEqual(handled, ["a1", "a2+a3+a4", "b1"])
+        self.assertEqual(self.queue.superseded, 2)
+
+    def test_latest_message_wins(self):
+        async def submit(queue):
+            for item in ["a1", "a2", "a3"]:
+                queue.submit("a", item)
+
+        self.assertEqual(self.run_queue(submit, supersede="latest"), ["a3"])
+
+    def test_full_queue_drops_oldest(self):
+        async def submit(queue):
+            for i in range(5):
+                queue.submit(i, i)
+
+        handled = self.run_queue(submit, workers=1, max_size=2, supersede="none")
+
+        self.assertEqual(handled, [3, 4])
+        self.assertEqual(self.queue.dropped_full, 3)
+
+    def test_stale_jobs_are_dropped(self):
+        async def submit(queue):
+            for i in range(4):
+                queue.submit(i, i)
+
+        handled = self.run_queue(
+            submit, latency=0, clock_step=0.1, workers=1, max_age=0.15
+        )
+
+        # Waited 0, 0.1, 0.2 and 0.3 seconds.
+        self.assertEqual(handled, [0, 1])
+        self.assertEqual(self.queue.dropped_stale, 2)
+
+    def test_metrics(self):
+        async def submit(queue):
+            for i in range(4):
+                queue.submit(i, i)
+            self.assertEqual(QUEUE_DEPTH.value(queue="metrics"), 4)
+
+        self.run_queue(
+            submit,
+            latency=0,
+            clock_step=0.1,
+            workers=1,
+            max_age=0.15,
+            name="metrics",
+        )
+
+        self.assertEqual(QUEUE_DEPTH.value(queue="metrics"), 0)
+        self.assertEqual(QUEUE_JOBS.value(queue="metrics", outcome="processed"), 2)
+        self.assertEqual(QUEUE_JOBS.value(queue="metrics", outcome="dropped_stale"), 2)
+
+    def test_failures_do_not_stop_workers(self):
+        handled = []
+
+        async def handle(item):
+            if item == 0:
+                raise RuntimeError("boom")
+            handled.append(item)
+
+        async def run():
+            queue = WorkQueue(handle, workers=1, supersede="none")
+            queue.start()
+            for i in range(3):
+                queue.submit(i, i)
+            await queue.join()
+            await queue.stop()
+            return queue
+
+        queue = asyncio.run(run())
+        self.assertEqual(handled, [1, 2])
+        self.assertEqual(queue.failed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()